@@ -0,0 +1,2 @@
+"""Benchmarks of compdb: a synthetic mysqldump generator and the timing harness.
+Run with: python -m bench.run --help"""
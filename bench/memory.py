@@ -0,0 +1,134 @@
+"""
+Measures the memory kept by the parsed tables of a synthetic dump, as the
+slotted Table, Field and Key objects of compdb and as the nested dicts they
+replaced.
+
+    python -m bench.memory --tables 10000
+
+Each model is measured in its own process, as the peak RSS added by parsing
+the dump and keeping its tables. Both models parse the dump table by table,
+the nested dicts being built from each table as soon as it is parsed.
+"""
+import getopt
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import compdb
+from bench.run import peak_rss_kb
+from bench.synthetic import generate_schema, write_dump
+
+DEFAULT_PARAMS = {'tables': 1000, 'columns': 20, 'index_density': 0.2, 'fk_density': 0.1, 'seed': 0}
+MODELS = ('slots', 'dicts')
+
+
+def as_dicts(value):
+    """The nested dicts of a parsed schema object, as the parser built them
+    before the slotted objects: Fields as an OrderedDict, the other objects
+    as dicts and their tuples as lists."""
+    if isinstance(value, compdb.Fields):
+        return OrderedDict((name, as_dicts(field)) for name, field in value.items())
+    if isinstance(value, compdb.SchemaObject):
+        return dict((key, as_dicts(item)) for key, item in value.items())
+    if isinstance(value, dict):
+        return dict((key, as_dicts(item)) for key, item in value.items())
+    if isinstance(value, tuple):
+        return [as_dicts(item) for item in value]
+    return value
+
+
+def load_tables(file_name, model):
+    """The tables of a dump, as the objects of the parser or as nested dicts"""
+    convert = as_dicts if model == 'dicts' else lambda value: value
+    tables = {}
+    for parsed in compdb.iter_dump_objects(compdb.iter_dump_file(file_name)):
+        if parsed[0] == 'table':
+            tables[parsed[1]['name']] = convert(parsed[1])
+        elif parsed[0] in ('fk', 'ix'):
+            tables[parsed[1]][parsed[0]][parsed[2]] = convert(parsed[3])
+    return tables
+
+
+def run_model(file_name, model, results):
+    before = peak_rss_kb()
+    tables = load_tables(file_name, model)
+    results.put((peak_rss_kb() - before, len(tables)))
+
+
+def measure(file_name, model):
+    """The peak RSS in KB added by the tables of model, in a child process"""
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_model, args=(file_name, model, results))
+    process.start()
+    rss, tables = results.get()
+    process.join()
+    return rss
+
+
+def run(params):
+    """Generate the dump of params and measure the memory of each model."""
+    temp_dir = tempfile.mkdtemp(prefix='compdb-bench-')
+    try:
+        schema = generate_schema(params['tables'], params['columns'], params['index_density'], params['fk_density'],
+                                 params['seed'])
+        file_name = os.path.join(temp_dir, 'source.sql')
+        write_dump(schema, file_name)
+        return dict((model, measure(file_name, model)) for model in MODELS)
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def report(params, results, out=sys.stdout):
+    out.write('%d tables of %d columns\n' % (params['tables'], params['columns']))
+    out.write('%-12s %12s\n' % ('model', 'RSS KB'))
+    for model in MODELS:
+        out.write('%-12s %12d\n' % (model, results[model]))
+    if results['dicts']:
+        out.write('the slotted objects take %.0f%% of the memory of the dicts\n'
+                  % (100.0 * results['slots'] / results['dicts']))
+
+
+def usage():
+    print "Usage: python -m bench.memory [OPTION]..."
+    print """Measures the memory of the parsed tables of a synthetic dump.
+
+Options:
+
+  --tables=N         number of tables (default %(tables)d)
+  --columns=N        average number of columns per table (default %(columns)d)
+  --index-density=F  probability of a column to be indexed (default %(index_density)s)
+  --fk-density=F     probability of a table to reference another one (default %(fk_density)s)
+  --seed=N           seed of the generator (default %(seed)d)
+  -h                 show this help screen""" % DEFAULT_PARAMS
+    sys.exit(2)
+
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "h", ["help", "tables=", "columns=", "index-density=",
+                                                       "fk-density=", "seed="])
+    except getopt.GetoptError:
+        usage()
+    params = dict(DEFAULT_PARAMS)
+    try:
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                usage()
+            else:
+                name = opt[2:].replace('-', '_')
+                params[name] = type(DEFAULT_PARAMS[name])(arg)
+    except ValueError:
+        usage()
+    if args:
+        usage()
+
+    report(params, run(params))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+Times the parsing, the comparison and the whole CompDB.compare of synthetic
+dumps, and checks the results against a saved baseline.
+
+    python -m bench.run --tables 2000 --output results.json
+    python -m bench.run --tables 2000 --baseline results.json --threshold 0.1
+
+Each phase runs in its own process so that its peak memory is measured on
+its own. The exit status is 1 when a phase is slower than its baseline by
+more than the threshold.
+"""
+import getopt
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import compdb
+from bench.synthetic import generate_schema, mutate_schema, write_dump
+
+DEFAULT_PARAMS = {'tables': 1000, 'columns': 20, 'index_density': 0.2, 'fk_density': 0.1, 'changed': 0.01,
+                  'rows': 0, 'seed': 0, 'repeat': 3}
+PHASES = ('parse', 'compare', 'end_to_end')
+DEFAULT_THRESHOLD = 0.1
+
+
+class CountingSink(compdb.OutputSink):
+    """ counts the lines of the migration without keeping them """
+    def __init__(self):
+        self.count = 0
+
+    def write(self, line):
+        self.count += 1
+
+
+def peak_rss_kb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024
+    return rss
+
+
+def count_lines(file_name):
+    with open(file_name, 'rb') as fd:
+        return sum(block.count(b'\n') for block in iter(lambda: fd.read(1024 * 1024), b''))
+
+
+def best_time(function, repeat):
+    """Smallest duration of repeat calls of function, and its last result"""
+    best = None
+    result = None
+    for i in range(repeat):
+        start = time.time()
+        result = function()
+        duration = time.time() - start
+        if best is None or duration < best:
+            best = duration
+    return best, result
+
+
+def time_parse(source, target, repeat):
+    seconds, tables = best_time(lambda: compdb.analyse_dump_file(source), repeat)
+    return seconds, len(tables)
+
+
+def time_compare(source, target, repeat):
+    tables_source = compdb.analyse_dump_file(source)
+    tables_target = compdb.analyse_dump_file(target)
+    common = [name for name in tables_source if name in tables_target]
+
+    def compare():
+        for name in common:
+            compdb.compare_tables(tables_source[name], tables_target[name], '', False)
+    seconds, result = best_time(compare, repeat)
+    return seconds, len(common)
+
+
+def time_end_to_end(source, target, repeat):
+    def compare():
+        comp = compdb.CompDB()
+        comp.set_files(source, target)
+        comp.no_foreign_key = False
+        comp.set_output(CountingSink())
+        comp.compare()
+    seconds, result = best_time(compare, repeat)
+    return seconds, len(compdb.analyse_dump_file(source))
+
+
+TIMERS = {'parse': time_parse, 'compare': time_compare, 'end_to_end': time_end_to_end}
+
+
+def run_phase(phase, source, target, repeat, results):
+    seconds, tables = TIMERS[phase](source, target, repeat)
+    results.put((seconds, tables, peak_rss_kb()))
+
+
+def measure(phase, source, target, repeat):
+    """Run a phase in a child process. Returns its result dict."""
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_phase, args=(phase, source, target, repeat, results))
+    process.start()
+    seconds, tables, rss = results.get()
+    process.join()
+    return {'seconds': seconds, 'tables': tables, 'peak_rss_kb': rss}
+
+
+def run(params):
+    """Generate the dumps of params and time all the phases on them."""
+    temp_dir = tempfile.mkdtemp(prefix='compdb-bench-')
+    try:
+        schema = generate_schema(params['tables'], params['columns'], params['index_density'], params['fk_density'],
+                                 params['seed'])
+        source = os.path.join(temp_dir, 'source.sql')
+        target = os.path.join(temp_dir, 'target.sql')
+        write_dump(schema, source, params['rows'])
+        write_dump(mutate_schema(schema, params['changed'], params['seed'] + 1), target, params['rows'])
+        lines = count_lines(source)
+        phases = {}
+        for phase in PHASES:
+            result = measure(phase, source, target, params['repeat'])
+            result['tables_per_second'] = result['tables'] / result['seconds'] if result['seconds'] else None
+            if phase != 'compare':
+                # the end to end phase reads both dumps
+                read = lines * (2 if phase == 'end_to_end' else 1)
+                result['lines_per_second'] = read / result['seconds'] if result['seconds'] else None
+            phases[phase] = result
+    finally:
+        shutil.rmtree(temp_dir)
+    return {'params': params, 'lines': lines, 'python': platform.python_version(), 'phases': phases}
+
+
+def find_regressions(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """Phases slower than in baseline by more than threshold, as (phase, seconds, baseline seconds)"""
+    regressions = []
+    for phase, result in sorted(results['phases'].items()):
+        expected = baseline['phases'].get(phase)
+        if expected and result['seconds'] > expected['seconds'] * (1 + threshold):
+            regressions.append((phase, result['seconds'], expected['seconds']))
+    return regressions
+
+
+def format_rate(rate):
+    return '-' if rate is None else '%.0f' % rate
+
+
+def report(results, out=sys.stdout):
+    out.write('%d tables, %d lines, python %s\n' % (results['params']['tables'], results['lines'],
+                                                   results['python']))
+    out.write('%-12s %10s %14s %14s %12s\n' % ('phase', 'seconds', 'lines/s', 'tables/s', 'peak RSS KB'))
+    for phase in PHASES:
+        result = results['phases'][phase]
+        out.write('%-12s %10.3f %14s %14s %12d\n' % (phase, result['seconds'],
+                                                     format_rate(result.get('lines_per_second')),
+                                                     format_rate(result['tables_per_second']),
+                                                     result['peak_rss_kb']))
+
+
+def usage():
+    print "Usage: python -m bench.run [OPTION]..."
+    print """Times compdb on synthetic dumps.
+
+Options:
+
+  --tables=N         number of tables (default %(tables)d)
+  --columns=N        average number of columns per table (default %(columns)d)
+  --index-density=F  probability of a column to be indexed (default %(index_density)s)
+  --fk-density=F     probability of a table to reference another one (default %(fk_density)s)
+  --changed=F        proportion of the tables changed in the target (default %(changed)s)
+  --rows=N           rows of data per table, 0 for a schema only dump (default %(rows)d)
+  --seed=N           seed of the generator (default %(seed)d)
+  --repeat=N         the best of N runs is kept (default %(repeat)d)
+  --output=FILE      save the results as JSON in FILE
+  --baseline=FILE    compare the results with the JSON results in FILE
+  --threshold=F      slowdown tolerated against the baseline (default 0.1)
+  -h                 show this help screen""" % DEFAULT_PARAMS
+    sys.exit(2)
+
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "h", ["help", "tables=", "columns=", "index-density=",
+                                                       "fk-density=", "changed=", "rows=", "seed=", "repeat=",
+                                                       "output=", "baseline=", "threshold="])
+    except getopt.GetoptError:
+        usage()
+    params = dict(DEFAULT_PARAMS)
+    output = baseline = None
+    threshold = DEFAULT_THRESHOLD
+    try:
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                usage()
+            elif opt == "--output":
+                output = arg
+            elif opt == "--baseline":
+                baseline = arg
+            elif opt == "--threshold":
+                threshold = float(arg)
+            else:
+                name = opt[2:].replace('-', '_')
+                params[name] = type(DEFAULT_PARAMS[name])(arg)
+    except ValueError:
+        usage()
+    if args:
+        usage()
+
+    results = run(params)
+    report(results)
+    if output:
+        with open(output, 'w') as fd:
+            json.dump(results, fd, indent=2, sort_keys=True)
+    if baseline:
+        with open(baseline) as fd:
+            expected = json.load(fd)
+        if expected['params'] != params:
+            print "WARNING: the baseline was measured with other parameters: %s" % expected['params']
+        regressions = find_regressions(results, expected, threshold)
+        for phase, seconds, expected_seconds in regressions:
+            print "REGRESSION: %s took %.3f s, %.0f%% more than the %.3f s of the baseline" % (
+                phase, seconds, 100 * (seconds / expected_seconds - 1), expected_seconds)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
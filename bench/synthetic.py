@@ -0,0 +1,130 @@
+"""
+Deterministic generator of mysqldump schemas for the benchmarks.
+The same parameters and seed always give the same dump.
+"""
+import random
+
+COLUMN_TYPES = ('int(11)', 'bigint(20)', 'smallint(6)', 'tinyint(1)', 'varchar(32)', 'varchar(255)',
+                'text', 'longtext', 'datetime', 'date', 'decimal(10,2)', "enum('draft','published')")
+COLUMN_OPTIONS = ('NOT NULL', 'DEFAULT NULL', "NOT NULL DEFAULT '0'", '')
+
+DUMP_HEADER = """-- MySQL dump 10.13  Distrib 5.5.62, for debian-linux-gnu (x86_64)
+--
+-- Host: localhost    Database: synthetic
+-- ------------------------------------------------------
+
+/*!40101 SET @OLD_CHARACTER_SET_CLIENT=@@CHARACTER_SET_CLIENT */;
+/*!40101 SET NAMES utf8 */;
+/*!40014 SET @OLD_FOREIGN_KEY_CHECKS=@@FOREIGN_KEY_CHECKS, FOREIGN_KEY_CHECKS=0 */;
+"""
+
+DUMP_FOOTER = """/*!40014 SET FOREIGN_KEY_CHECKS=@OLD_FOREIGN_KEY_CHECKS */;
+/*!40101 SET CHARACTER_SET_CLIENT=@OLD_CHARACTER_SET_CLIENT */;
+
+-- Dump completed
+"""
+
+
+def generate_schema(tables=1000, columns=20, index_density=0.2, fk_density=0.1, seed=0):
+    """Build the definition of a synthetic schema.
+    tables - number of tables
+    columns - average number of columns of a table, between half and one and a half of it
+    index_density - probability of each column to be part of a secondary or unique key
+    fk_density - probability of each table to reference each of up to 3 earlier tables
+    Returns a list of table dicts: name, columns [(name, type, options)],
+    keys [(kind, name, fields)] and fks [(name, field, table)]."""
+    rand = random.Random(seed)
+    schema = []
+    for number in range(tables):
+        name = 'table_%05d' % number
+        column_count = max(1, rand.randint(columns // 2, columns + columns // 2))
+        table = {'name': name,
+                 'columns': [('id', 'int(11)', 'NOT NULL AUTO_INCREMENT')],
+                 'keys': [],
+                 'fks': []}
+        for column in range(column_count):
+            table['columns'].append(('column_%d' % column, rand.choice(COLUMN_TYPES), rand.choice(COLUMN_OPTIONS)))
+            if rand.random() < index_density:
+                kind = rand.choice(('KEY', 'KEY', 'UNIQUE KEY'))
+                table['keys'].append((kind, '%s_column_%d' % (name, column), ['column_%d' % column]))
+        for reference in range(min(3, number)):
+            if rand.random() < fk_density:
+                referenced = 'table_%05d' % rand.randrange(number)
+                field = '%s_id' % referenced
+                if field not in [column[0] for column in table['columns']]:
+                    table['columns'].append((field, 'int(11)', 'NOT NULL'))
+                    table['keys'].append(('KEY', '%s_%s' % (name, field), [field]))
+                    table['fks'].append(('%s_%s_fk' % (name, field), field, referenced))
+        schema.append(table)
+    return schema
+
+
+def mutate_schema(schema, changed=0.01, seed=1):
+    """Copy a schema changing a column type, adding, dropping a column or adding
+    a unique key in the proportion changed of its tables."""
+    rand = random.Random(seed)
+    mutated = []
+    for table in schema:
+        table = {'name': table['name'], 'columns': list(table['columns']), 'keys': list(table['keys']),
+                 'fks': list(table['fks'])}
+        if rand.random() < changed:
+            change = rand.choice(('type', 'add', 'drop', 'unique'))
+            plain = [i for i, column in enumerate(table['columns']) if column[0].startswith('column_')]
+            if change == 'type' and plain:
+                i = rand.choice(plain)
+                table['columns'][i] = (table['columns'][i][0], rand.choice(COLUMN_TYPES), table['columns'][i][2])
+            elif change == 'drop' and plain:
+                i = rand.choice(plain)
+                dropped = table['columns'].pop(i)[0]
+                table['keys'] = [key for key in table['keys'] if dropped not in key[2]]
+            elif change == 'unique' and plain:
+                field = table['columns'][rand.choice(plain)][0]
+                table['keys'].append(('UNIQUE KEY', '%s_%s_uniq' % (table['name'], field), [field]))
+            else:
+                table['columns'].insert(rand.randint(1, len(table['columns'])),
+                                        ('added_%d' % rand.randrange(1000), 'varchar(255)', 'DEFAULT NULL'))
+        mutated.append(table)
+    return mutated
+
+
+def quoted(fields):
+    return ','.join('`%s`' % field for field in fields)
+
+
+def iter_dump_lines(schema, rows=0, seed=2):
+    """Yield the lines of the mysqldump output of a schema, with rows rows of
+    data per table in extended INSERT statements."""
+    rand = random.Random(seed)
+    yield DUMP_HEADER
+    for table in schema:
+        name = table['name']
+        yield '\n--\n-- Table structure for table `%s`\n--\n\n' % name
+        yield 'DROP TABLE IF EXISTS `%s`;\n' % name
+        yield '/*!40101 SET @saved_cs_client     = @@character_set_client */;\n'
+        yield 'CREATE TABLE `%s` (\n' % name
+        definitions = ['  `%s` %s%s' % (column, column_type, ' ' + options if options else '')
+                       for column, column_type, options in table['columns']]
+        definitions.append('  PRIMARY KEY (`id`)')
+        definitions.extend('  %s `%s` (%s)' % (kind, key_name, quoted(fields))
+                           for kind, key_name, fields in table['keys'])
+        definitions.extend('  CONSTRAINT `%s` FOREIGN KEY (`%s`) REFERENCES `%s` (`id`)' % fk
+                           for fk in table['fks'])
+        yield ',\n'.join(definitions) + '\n'
+        yield ') ENGINE=InnoDB DEFAULT CHARSET=utf8;\n'
+        yield '/*!40101 SET character_set_client = @saved_cs_client */;\n'
+        if rows:
+            yield '\nLOCK TABLES `%s` WRITE;\n' % name
+            yield '/*!40000 ALTER TABLE `%s` DISABLE KEYS */;\n' % name
+            values = ','.join('(%d,%s)' % (row, ','.join("'%08x'" % rand.getrandbits(32)
+                                                        for column in table['columns'][1:]))
+                              for row in range(1, rows + 1))
+            yield 'INSERT INTO `%s` VALUES %s;\n' % (name, values)
+            yield '/*!40000 ALTER TABLE `%s` ENABLE KEYS */;\n' % name
+            yield 'UNLOCK TABLES;\n'
+    yield DUMP_FOOTER
+
+
+def write_dump(schema, file_name, rows=0):
+    with open(file_name, 'w') as fd:
+        for line in iter_dump_lines(schema, rows):
+            fd.write(line)
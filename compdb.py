@@ -1,13 +1,41 @@
 """
 Reports all the differences between 2 DB schemas.
-Both schemas must only contain mysql DDL statements either generated by 'mysql_dump' or 'manage.py sql'.
+Both schemas are either generated by 'mysql_dump' or 'manage.py sql'. Full dumps can be used: the data
+statements they contain are skipped without being parsed. They can be gzip, bzip2 or xz compressed.
 Original from https://code.google.com/p/sql-dump-schema-diff
 """
 
 from __future__ import with_statement
 from collections import OrderedDict
+import bz2
+import copy
+import difflib
+import fnmatch
+import gc
+import hashlib
+import io
+import itertools
+import mmap
+import os
 import sys
 import re
+import time
+import zlib
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+try:
+    import resource
+except ImportError:
+    resource = None
 
 
 def clean_field_name(field_name):
@@ -29,6 +57,276 @@ def describe_field(field):
     return ret
 
 
+def intern_value(value):
+    """The interned copy of a byte string: type strings, default values and
+    field names are repeated in most tables, each is only held once."""
+    if type(value) is str:
+        return intern(value)
+    return value
+
+
+class SchemaObject(object):
+    """ base of the parsed schema objects
+        the attributes are kept in __slots__ and read or set with the item
+        syntax of the dicts the objects replace, e.g. field['type']. Objects
+        are equal when the tuples of their attributes are.
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return [key for key in self.__slots__ if hasattr(self, key)]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    def __contains__(self, key):
+        return key in self.__slots__ and hasattr(self, key)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def as_tuple(self):
+        return tuple(getattr(self, key, None) for key in self.__slots__)
+
+    def as_dict(self):
+        """The dict the object replaces, its tuples of fields as lists"""
+        return dict((key, list(value) if type(value) is tuple else value) for key, value in self.items())
+
+    def __eq__(self, other):
+        if type(other) is type(self):
+            return self.as_tuple() == other.as_tuple()
+        if isinstance(other, dict):
+            return self.as_dict() == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, ', '.join('%s=%r' % item for item in self.items()))
+
+
+class Field(SchemaObject):
+    """ a column of a table """
+    __slots__ = ('name', 'type', 'nn', 'default', 'inc')
+
+    def __init__(self, name, type, nn=False, default=False, inc=False):
+        self.name = intern_value(name)
+        self.type = intern_value(type)
+        self.nn = nn
+        self.default = intern_value(default)
+        self.inc = inc
+
+    def __setitem__(self, key, value):
+        SchemaObject.__setitem__(self, key, intern_value(value))
+
+
+class Key(SchemaObject):
+    """ a unique or fulltext key, name is '' for anonymous keys """
+    __slots__ = ('name', 'fields')
+
+    def __init__(self, name, fields):
+        self.name = intern_value(name)
+        self.fields = tuple(intern_value(field) for field in fields)
+
+
+class Index(SchemaObject):
+    """ a secondary (not unique) index, compared by its index id (see index_id)
+        whatever its name: the fields are in the order of the index and end
+        with their prefix length if any, e.g. 'title(10)'. type is 'HASH' or
+        None for the default BTREE.
+    """
+    __slots__ = ('name', 'fields', 'type')
+
+    def __init__(self, name, fields, type=None):
+        self.name = intern_value(name)
+        self.fields = tuple(intern_value(field) for field in fields)
+        self.type = type
+
+
+class Partition(SchemaObject):
+    """ a partition of a RANGE or LIST partitioned table: values is its
+        normalised VALUES clause, e.g. 'LESS THAN (2020)', 'LESS THAN MAXVALUE'
+        or 'IN (1,2)'.
+    """
+    __slots__ = ('name', 'values')
+
+    def __init__(self, name, values):
+        self.name = intern_value(name)
+        self.values = values
+
+
+class Partitioning(SchemaObject):
+    """ the PARTITION BY clause of a table
+        type: 'RANGE', 'LIST', 'HASH' or 'KEY', after 'LINEAR ' when linear
+              and before ' COLUMNS' for RANGE COLUMNS and LIST COLUMNS
+        expression: the normalised expression or columns partitioned by
+        count: the number of partitions
+        sub: the normalised SUBPARTITION BY clause, or None. The number and
+             the definitions of the subpartitions and the options of the
+             partitions (ENGINE, COMMENT, DATA DIRECTORY...) are not kept.
+        partitions: the Partitions of RANGE and LIST partitioning in their
+                    order, empty for HASH and KEY partitioning which only
+                    keep their number
+    """
+    __slots__ = ('type', 'expression', 'count', 'sub', 'partitions')
+
+    def __init__(self, type, expression, count=1, sub=None, partitions=()):
+        self.type = type
+        self.expression = expression
+        self.count = count
+        self.sub = sub
+        self.partitions = tuple(partitions)
+
+
+class ForeignKey(SchemaObject):
+    """ a foreign key: the fields k of the table reference the fields fk of table """
+    __slots__ = ('table', 'k', 'fk', 'name')
+
+    def __init__(self, table, k, fk, name):
+        self.table = intern_value(table)
+        self.k = tuple(intern_value(field) for field in k)
+        self.fk = tuple(intern_value(field) for field in fk)
+        self.name = intern_value(name)
+
+
+class Fields(dict):
+    """ the fields of a table by name, in the order of the table
+        a lighter OrderedDict: the order is only kept in a list of names.
+    """
+    __slots__ = ('order',)
+
+    def __init__(self, items=()):
+        dict.__init__(self)
+        self.order = []
+        for key, value in items:
+            self[key] = value
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self.order.append(intern_value(key))
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.order.remove(key)
+
+    def __iter__(self):
+        return iter(self.order)
+
+    iterkeys = __iter__
+
+    def keys(self):
+        return list(self.order)
+
+    def values(self):
+        return [self[key] for key in self.order]
+
+    def items(self):
+        return [(key, self[key]) for key in self.order]
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def popitem(self, last=True):
+        if not self.order:
+            raise KeyError('popitem(): no fields')
+        key = self.order[-1] if last else self.order[0]
+        value = self[key]
+        del self[key]
+        return key, value
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in OrderedDict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        dict.clear(self)
+        del self.order[:]
+
+    def copy(self):
+        return Fields(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, (Fields, OrderedDict)):
+            return self.items() == list(other.items())
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return Fields, (self.items(),)
+
+    def __repr__(self):
+        return 'Fields(%r)' % self.items()
+
+
+class Table(SchemaObject):
+    """ a parsed table
+        fields: Fields of the columns by name
+        pk: set of the names of the primary key fields
+        fk, uk, ft: ForeignKey and Key by key id
+        ix: Index by index id
+        options: the table options of TABLE_OPTIONS by name, e.g. ENGINE
+        partitions: Partitioning, or None
+        fingerprint: see table_fingerprint
+    """
+    __slots__ = ('name', 'fields', 'pk', 'fk', 'uk', 'ft', 'ix', 'options', 'partitions', 'fingerprint')
+
+    def __init__(self, name):
+        self.name = name
+        self.fields = Fields()
+        self.pk = set()
+        self.fk = {}
+        self.uk = {}
+        self.ft = {}
+        self.ix = {}
+        self.options = {}
+        self.partitions = None
+
+
 class CompDB:
     """ open 2 files
         convert them into a canonical dictionary
@@ -40,73 +338,639 @@ class CompDB:
         self.source_file_name = ''
         self.target_file_name = ''
         self.table_prefix = ''
+        self.include = []
+        self.exclude = []
         self.no_loss = ''
         self.no_foreign_key = True
+        self.parser = None
+        self.buffer_size = DEFAULT_BUFFER_SIZE
+        self.jobs = 1
+        self.cache = None
+        self.output = None
+        self.incremental = False
+        self.detect_renames = False
+        self.coalesce = False
+        self.online_ddl = False
+        self.size_hints = {}
+        self.osc_min_size = DEFAULT_OSC_MIN_SIZE
+        self.store_dir = None
+        self.databases = False
+        self.database_map = {}
 
     def set_no_removing(self, no_removing):
         self.no_loss = ''
         if no_removing:
             self.no_loss = '-- ' 
     
+    def set_detect_renames(self, detect_renames):
+        """Pair the dropped and created tables and columns of the same structure
+        into RENAME TABLE and CHANGE COLUMN statements."""
+        self.detect_renames = detect_renames
+
+    def set_coalesce(self, coalesce):
+        """Merge the changes of each table into a single ALTER TABLE, see iter_coalesced_alter."""
+        self.coalesce = coalesce
+
+    def set_online_ddl(self, online_ddl):
+        """End the ALTER TABLE statements with the ALGORITHM and LOCK of their
+        InnoDB online DDL, see iter_table_changes."""
+        self.online_ddl = online_ddl
+
+    def set_size_hints(self, size_hints, min_size=None):
+        """size_hints - size by (database, table name), see read_size_hints. The
+        changes of the tables of at least min_size bytes which need a COPY are
+        printed as an OSC_COMMAND, see iter_osc_alter."""
+        self.size_hints = size_hints
+        if min_size is not None:
+            self.osc_min_size = min_size
+
+    def set_store_dir(self, directory):
+        """Parse the schemas into SchemaStores of directory instead of memory
+        and compare them table by table, see iter_store_migration."""
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.store_dir = directory
+
+    def set_databases(self, databases, database_map=None):
+        """Compare dumps of several databases database by database, see
+        iter_database_migration.
+        database_map - the target database by source database, for the source
+                       databases compared with a target database of another
+                       name. Several source databases can share a target."""
+        self.databases = databases
+        self.database_map = dict(database_map or {})
+
     def set_files(self, source_file_name, target_file_name):
         self.source_file_name = source_file_name
         self.target_file_name = target_file_name
     
     def set_table_prefix(self, table_prefix):
         self.table_prefix = table_prefix
+
+    def set_table_filter(self, include=(), exclude=()):
+        """Only compare the tables matching one of the include patterns, if any,
+        and none of the exclude ones, see TableFilter. The other tables are
+        skipped unparsed."""
+        try:
+            TableFilter(include, exclude)
+        except re.error, e:
+            raise ValueError("Invalid table pattern: %s" % e)
+        self.include = list(include)
+        self.exclude = list(exclude)
+
+    def table_filter(self):
+        """The TableFilter of the table prefix and the include and exclude
+        patterns, None when all the tables are compared."""
+        if not (self.table_prefix or self.include or self.exclude):
+            return None
+        return TableFilter(self.include, self.exclude, self.table_prefix)
         
+    def set_buffer_size(self, buffer_size):
+        self.buffer_size = max(int(buffer_size), 1)
+
+    def set_jobs(self, jobs):
+        self.jobs = max(int(jobs), 1)
+
+    def set_cache(self, directory, max_size=None):
+        if max_size is None:
+            max_size = DEFAULT_CACHE_SIZE
+        self.cache = SchemaCache(directory, max_size)
+
+    def set_parser(self, parser):
+        if parser not in PARSERS:
+            raise ValueError("Unknown parser '%s', expected one of: %s" % (parser, ', '.join(sorted(PARSERS))))
+        self.parser = parser
+
+    def set_output(self, output):
+        """output - the OutputSink the statements are written to. Defaults to a StdoutSink."""
+        self.output = output
+
     def set_format(self, data_format):
-        if data_format not in ('default', 'sql'):
+        if data_format not in ('default', 'sql', 'fingerprints', 'ndjson', 'missing-indexes'):
             data_format = 'sql'
         self.format = data_format
         
     def compare(self):
-        with open(self.source_file_name, 'r') as fd:
-            #print "Analysing %s" % self.source_file_name
-            tables_source = analyse_file(fd, self.table_prefix)
-        with open(self.target_file_name, 'r') as fd:
-            #print "Analysing %s" % self.target_file_name
-            tables_target = analyse_file(fd, self.table_prefix)
+        """Write the migration to the output sink, statement by statement."""
+        self._write(self.iter_statements())
+
+    def compare_database(self, pool, schema, target_file_name):
+        """Write the migration from the live schema, introspected through the
+        ConnectionPool pool, to the schema of target_file_name."""
+        with phase('read'):
+            tables_source = introspect_schemas(pool, [schema], self.table_filter())[0]
+        tables_target = analyse_dump_files([target_file_name], self.table_filter(), self.parser, self.buffer_size,
+                                           self.jobs, cache=self.cache, incremental=self.incremental)[0]
+        self._write(self.iter_migration(tables_source, tables_target))
+
+    def add_history_version(self, history, version, file_name):
+        """Parse the schema of file_name and record it as version in the
+        SchemaHistory history.
+        Returns the number of table definitions which were not stored yet."""
+        tables = analyse_dump_files([file_name], self.table_filter(), self.parser, self.buffer_size, self.jobs,
+                                    cache=self.cache, incremental=self.incremental)[0]
+        return history.add_version(version, tables)
+
+    def compare_history(self, history, old_version, new_version):
+        """Write the migration between two versions of the SchemaHistory
+        history, see iter_history_migration. The other formats than SQL load
+        both versions."""
+        if self.format == 'sql':
+            self._write(self.iter_history_migration(history, old_version, new_version))
+        else:
+            self._write(self.iter_output(history.load_version(old_version), history.load_version(new_version)))
+
+    def execute(self, pool, stop_on_error=True):
+        """Run the migration from the source to the target schema through the
+        ConnectionPool pool, the independent tables at the same time, see
+        migration_steps and iter_executed_steps. The statements are written to
+        the output sink after the time they took, the failed and not run ones
+        commented out.
+        Returns the names of the steps which failed or were not run."""
+        tables_source, tables_target = analyse_dump_files([self.source_file_name, self.target_file_name],
+                                                          self.table_filter(), self.parser, self.buffer_size,
+                                                          self.jobs, cache=self.cache, incremental=self.incremental)
+        not_done = []
+        self._write(self._iter_execution(pool, self.migration_steps(tables_source, tables_target), stop_on_error,
+                                         not_done))
+        return not_done
+
+    def _iter_execution(self, pool, steps, stop_on_error, not_done):
+        for step, results in iter_executed_steps(pool, steps, stop_on_error):
+            if results is None:
+                not_done.append(step.name)
+                yield '-- %s: not run' % step.name
+                for statement in step.statements:
+                    yield '-- ' + statement.replace('\n', '\n-- ')
+                continue
+            for statement, seconds, error in results:
+                if error is None:
+                    yield '-- %s: %.3f s' % (step.name, seconds)
+                    yield statement
+                else:
+                    not_done.append(step.name)
+                    yield '-- %s: FAILED after %.3f s: %s' % (step.name, seconds, str(error).replace('\n', ' '))
+                    if statement is not None:
+                        yield '-- ' + statement.replace('\n', '\n-- ')
+
+    def _write(self, lines):
+        output = self.output
+        if output is None:
+            output = StdoutSink()
+        if active_stats is not None:
+            lines = active_stats.iter_phase('compare', lines)
+        with phase('emit'):
+            try:
+                for line in lines:
+                    output.write(line)
+            finally:
+                output.flush()
+
+    def iter_statements(self):
+        """Parse both schemas then yield the lines of the migration as they are
+        produced, without their end of line."""
+        if self.format == 'fingerprints':
+            file_names = [file_name for file_name in (self.source_file_name, self.target_file_name) if file_name]
+            for file_name, tables in zip(file_names, analyse_dump_files(file_names, self.table_filter(), self.parser,
+                                                                        self.buffer_size, self.jobs,
+                                                                        cache=self.cache,
+                                                                        incremental=self.incremental)):
+                for line in self._generate_fingerprints(file_name, tables):
+                    yield line
+            return
+        if self.databases:
+            databases_source, databases_target = parse_database_files(
+                [self.source_file_name, self.target_file_name], self.table_filter(), self.parser, self.buffer_size,
+                self.jobs)
+            for line in self.iter_database_migration(databases_source, databases_target):
+                yield line
+            return
+        if self.store_dir is not None and self.format not in ('ndjson', 'missing-indexes'):
+            for line in self._iter_stored_migration():
+                yield line
+            return
+        tables_source, tables_target = analyse_dump_files([self.source_file_name, self.target_file_name],
+                                                          self.table_filter(), self.parser, self.buffer_size,
+                                                          self.jobs, cache=self.cache, incremental=self.incremental)
+        for line in self.iter_output(tables_source, tables_target):
+            yield line
+
+    def iter_output(self, tables_source, tables_target, database=''):
+        """The lines of self.format comparing the parsed tables_source to
+        tables_target, the tables of database if any."""
+        if self.format == 'ndjson':
+            import json
+            encoder = json.JSONEncoder(sort_keys=True)
+            for record in self.iter_change_records(tables_source, tables_target):
+                if database:
+                    record['database'] = database
+                yield encoder.encode(record)
+        elif self.format == 'missing-indexes':
+            prefix = database + '.' if database else ''
+            for table_name, kind, key in iter_missing_indexes(tables_source, tables_target):
+                yield '%s%s: missing %s' % (prefix, table_name, describe_key(kind, key))
+        else:
+            for line in self.iter_migration(tables_source, tables_target, database or None):
+                yield line
+
+    def database_pairs(self, databases_source, databases_target):
+        """The (source database, target database) pairs compared by
+        iter_database_migration: the databases are matched by name, or by
+        self.database_map. The target is None for the source databases
+        without target, the source is None for the target databases no
+        source database was matched with."""
+        pairs = []
+        matched = set()
+        for source_database in databases_source:
+            target_database = self.database_map.get(source_database, source_database)
+            if target_database in databases_target:
+                pairs.append((source_database, target_database))
+                matched.add(target_database)
+            else:
+                pairs.append((source_database, None))
+        pairs.extend((None, target_database) for target_database in databases_target
+                     if target_database not in matched)
+        return pairs
+
+    def iter_database_migration(self, databases_source, databases_target):
+        """Yield the lines of the migrations of each pair of database_pairs,
+        from the parsed databases_source to databases_target (see
+        analyse_database_file). The SQL migration of a database starts with
+        its USE statement; the databases without target are dropped and the
+        ones without source created."""
+        sql = self.format not in ('ndjson', 'missing-indexes')
+        for source_database, target_database in self.database_pairs(databases_source, databases_target):
+            if target_database is None:
+                if self.format == 'sql':
+                    yield '%sDROP DATABASE `%s`;' % (self.no_loss, source_database)
+                    continue
+                database, tables_source, tables_target = source_database, databases_source[source_database], {}
+            elif source_database is None:
+                if sql:
+                    yield 'CREATE DATABASE `%s`;' % target_database
+                database, tables_source, tables_target = target_database, {}, databases_target[target_database]
+            else:
+                database = source_database
+                tables_source = databases_source[source_database]
+                tables_target = databases_target[target_database]
+            use = ['USE `%s`;' % database] if sql and database else []
+            for line in self.iter_output(tables_source, tables_target, database):
+                for statement in use:
+                    yield statement
+                use = []
+                yield line
+
+    def iter_migration(self, tables_source, tables_target, database=None):
+        """Yield the lines of the migration from the parsed tables_source to
+        tables_target, the tables of database if any."""
+        if schema_digest(tables_source) == schema_digest(tables_target):
+            return
+        renamed_from = {}
+        if self.detect_renames:
+            renames = find_table_renames(tables_source, tables_target)
+            tables_source = rename_tables(tables_source, renames)
+            renamed_from = dict((new_name, old_name) for old_name, new_name in renames.items())
         # 1. compare tables
         for table_name in tables_source:
+            if table_name in renamed_from:
+                yield 'RENAME TABLE `%s` TO `%s`;' % (renamed_from[table_name], table_name)
             if table_name in tables_target:
-                output = compare_tables(tables_source[table_name], tables_target[table_name], self.no_loss,
-                                        self.no_foreign_key)
-                if output:
-                    print output
+                if get_fingerprint(tables_source[table_name]) == get_fingerprint(tables_target[table_name]):
+                    continue
+                changed = False
+                for statement in self.iter_alter(tables_source[table_name], tables_target[table_name],
+                                                 database=database):
+                    changed = True
+                    yield statement
+                if changed:
+                    yield ''
             else:
                 if self.format == 'sql':
-                    print '%sDROP TABLE `%s`;' % (self.no_loss, table_name)
+                    yield '%sDROP TABLE `%s`;' % (self.no_loss, table_name)
+
+        for table_name in tables_target:
+            if table_name not in tables_source:
+                yield 'CREATE TABLE `%s` (' % table_name
+                for line in self._generate_create_table(tables_target[table_name]):
+                    yield line
+                yield describe_table_end(tables_target[table_name])
+                for statement in self._generate_after_create_table(tables_target[table_name]):
+                    yield statement
+
+    def _iter_stored_migration(self):
+        store_file_names = [os.path.join(self.store_dir, name) for name in ('source.sqlite', 'target.sqlite')]
+        file_names = [self.source_file_name, self.target_file_name]
+        if self.jobs > 1 and '-' not in file_names:
+            import multiprocessing
+            pool = multiprocessing.Pool(2)
+            try:
+                with phase('parse'):
+                    for result in [pool.apply_async(store_dump_file, (file_name, store_file_name, self.table_filter(),
+                                                                      self.buffer_size))
+                                   for file_name, store_file_name in zip(file_names, store_file_names)]:
+                        result.get()
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            for file_name, store_file_name in zip(file_names, store_file_names):
+                store_dump_file(file_name, store_file_name, self.table_filter(), self.buffer_size)
+        source_store, target_store = [SchemaStore(store_file_name) for store_file_name in store_file_names]
+        try:
+            for line in self.iter_store_migration(source_store, target_store):
+                yield line
+        finally:
+            source_store.close()
+            target_store.close()
+
+    def iter_store_migration(self, source_store, target_store):
+        """iter_migration of two SchemaStores: the changed, dropped and created
+        tables are found by joins of the stores on the names and fingerprints
+        of their tables, then only the changed tables are loaded, one pair at a
+        time, so that the memory used does not depend on the size of the
+        schemas. The tables come in the order of the dumps; the renames are not
+        detected."""
+        connection = source_store.connection
+        connection.execute('ATTACH DATABASE ? AS target', (target_store.file_name,))
+        try:
+            changed = connection.execute(
+                'SELECT source.name, target.name IS NULL FROM main.tables AS source '
+                'LEFT JOIN target.tables AS target ON target.name = source.name '
+                'WHERE target.name IS NULL OR target.fingerprint != source.fingerprint ORDER BY source.position')
+            for table_name, dropped in changed:
+                if dropped:
+                    if self.format == 'sql':
+                        yield '%sDROP TABLE `%s`;' % (self.no_loss, table_name)
+                    continue
+                statements = list(self.iter_alter(source_store.load_table(table_name),
+                                                  target_store.load_table(table_name)))
+                for statement in statements:
+                    yield statement
+                if statements:
+                    yield ''
+            created = connection.execute(
+                'SELECT target.name FROM target.tables AS target '
+                'LEFT JOIN main.tables AS source ON source.name = target.name '
+                'WHERE source.name IS NULL ORDER BY target.position')
+            for table_name, in created:
+                table = target_store.load_table(table_name)
+                yield 'CREATE TABLE `%s` (' % table_name
+                for line in self._generate_create_table(table):
+                    yield line
+                yield describe_table_end(table)
+                for statement in self._generate_after_create_table(table):
+                    yield statement
+        finally:
+            connection.execute('DETACH DATABASE target')
+
+    def iter_history_migration(self, history, old_version, new_version):
+        """iter_migration between two versions of the SchemaHistory history:
+        their manifests are compared, and only the tables which fingerprints
+        differ are loaded and compared. The tables come in name order; the
+        renames are not detected."""
+        source = history.manifest(old_version)
+        target = history.manifest(new_version)
+        for table_name, fingerprint in source.items():
+            if table_name not in target:
+                if self.format == 'sql':
+                    yield '%sDROP TABLE `%s`;' % (self.no_loss, table_name)
+            elif target[table_name] != fingerprint:
+                statements = list(self.iter_alter(history.load_table(table_name, fingerprint),
+                                                  history.load_table(table_name, target[table_name])))
+                for statement in statements:
+                    yield statement
+                if statements:
+                    yield ''
+        for table_name, fingerprint in target.items():
+            if table_name not in source:
+                table = history.load_table(table_name, fingerprint)
+                yield 'CREATE TABLE `%s` (' % table_name
+                for line in self._generate_create_table(table):
+                    yield line
+                yield describe_table_end(table)
+                for statement in self._generate_after_create_table(table):
+                    yield statement
+
+    def size_hint(self, table_name, database=None):
+        """The (database, size) of the size hint of table_name in database,
+        else of its hint without database, or None. The tables of a dump
+        without databases take the hint of a database when it is the only
+        hint of their name."""
+        if database is not None and (database, table_name) in self.size_hints:
+            return database, self.size_hints[database, table_name]
+        if (None, table_name) in self.size_hints:
+            return database, self.size_hints[None, table_name]
+        if database is None:
+            hints = [(hint_database, size) for (hint_database, hint_table_name), size in self.size_hints.items()
+                     if hint_table_name == table_name]
+            if len(hints) == 1:
+                return hints[0]
+        return None
+
+    def iter_alter(self, source, target, no_foreign_key=None, database=None):
+        """The statements changing the source table into the target table, of database if any"""
+        if no_foreign_key is None:
+            no_foreign_key = self.no_foreign_key
+        size_hint = self.size_hint(source['name'], database) if self.size_hints else None
+        if size_hint and size_hint[1] >= self.osc_min_size and \
+                needs_copy(source, target, no_foreign_key, self.detect_renames):
+            return iter_osc_alter(source, target, self.no_loss, no_foreign_key, self.detect_renames,
+                                  size_hint[0])
+        compare = iter_coalesced_alter if self.coalesce else iter_compare_tables
+        return compare(source, target, self.no_loss, no_foreign_key, self.detect_renames, self.online_ddl)
+
+    def iter_change_records(self, tables_source, tables_target):
+        """Yield a dict per change of the migration from the parsed tables_source
+        to tables_target, in the order of iter_migration, see change_record.
+        The changes of the tables are the ones of compare_tables, the keys of
+        the created tables are part of their definition."""
+        if schema_digest(tables_source) == schema_digest(tables_target):
+            return
+        renamed_from = {}
+        original_tables = tables_source
+        if self.detect_renames:
+            renames = find_table_renames(tables_source, tables_target)
+            tables_source = rename_tables(tables_source, renames)
+            renamed_from = dict((new_name, old_name) for old_name, new_name in renames.items())
+        for table_name in tables_source:
+            source = tables_source[table_name]
+            if table_name in renamed_from:
+                yield change_record(table_name, 'table', 'rename', original_tables[renamed_from[table_name]],
+                                    tables_target[table_name],
+                                    'RENAME TABLE `%s` TO `%s`;' % (renamed_from[table_name], table_name))
+            if table_name in tables_target:
+                target = tables_target[table_name]
+                if get_fingerprint(source) == get_fingerprint(target):
+                    continue
+                for kind, destructive, statement, clause, ddl, before, after in iter_replaced_primary_keys(
+                        iter_table_diff(source, target, self.no_foreign_key, self.detect_renames)):
+                    if kind == CHANGE_COMMENT:
+                        continue
+                    if self.online_ddl:
+                        clause += online_ddl_options(ddl)
+                    if before is None:
+                        change = 'add'
+                    elif after is None:
+                        change = 'drop'
+                    elif kind == CHANGE_COLUMN and before['name'] != after['name']:
+                        change = 'rename'
+                    else:
+                        change = 'modify'
+                    yield change_record(table_name, RECORD_OBJECTS[kind], change, before, after,
+                                        '%s%s %s;' % (self.no_loss if destructive else '', statement, clause),
+                                        destructive, ddl)
+            else:
+                yield change_record(table_name, 'table', 'drop', source, None,
+                                    '%sDROP TABLE `%s`;' % (self.no_loss, table_name), True)
+        for table_name in tables_target:
+            if table_name not in tables_source:
+                target = tables_target[table_name]
+                statements = ['CREATE TABLE `%s` (' % table_name] + list(self._generate_create_table(target)) + \
+                    [describe_table_end(target)] + list(self._generate_after_create_table(target))
+                yield change_record(table_name, 'table', 'create', None, target, '\n'.join(statements))
+
+    def migration_steps(self, tables_source, tables_target):
+        """The migration from the parsed tables_source to tables_target as the
+        MigrationSteps of each table, for execute_migration_steps: the foreign
+        keys are dropped first, the ones referencing a table wait for its
+        creation and the changes of its primary key. The commented out
+        statements, e.g. the pt-online-schema-change of the large tables, are
+        left to be run by hand."""
+        steps = OrderedDict()
 
+        def add(kind, table_name, statements):
+            statements = [statement for statement in statements if statement and not statement.startswith('--')]
+            if statements:
+                step = MigrationStep(kind, table_name, statements)
+                steps[step.name] = step
+
+        renamed_from = {}
+        if self.detect_renames:
+            renames = find_table_renames(tables_source, tables_target)
+            tables_source = rename_tables(tables_source, renames)
+            renamed_from = dict((new_name, old_name) for old_name, new_name in renames.items())
+        for table_name in tables_source:
+            if table_name in renamed_from:
+                add('rename', table_name, ['RENAME TABLE `%s` TO `%s`;' % (renamed_from[table_name], table_name)])
+            if table_name in tables_target:
+                source = tables_source[table_name]
+                target = tables_target[table_name]
+                if get_fingerprint(source) == get_fingerprint(target):
+                    continue
+                if not self.no_foreign_key:
+                    add('drop foreign keys', table_name, iter_foreign_key_changes(
+                        source, target, CHANGE_DROP_FOREIGN_KEY, self.no_loss, self.detect_renames, self.online_ddl))
+                    add('add foreign keys', table_name, iter_foreign_key_changes(
+                        source, target, CHANGE_ADD_FOREIGN_KEY, self.no_loss, self.detect_renames, self.online_ddl))
+                add('alter', table_name, self.iter_alter(source, target, no_foreign_key=True))
+            elif self.format == 'sql':
+                add('drop', table_name, ['%sDROP TABLE `%s`;' % (self.no_loss, table_name)])
         for table_name in tables_target:
             if table_name not in tables_source:
-                print 'CREATE TABLE `%s` (' % table_name
-                self._generate_create_table(tables_target[table_name])
-                print ');'
-                self._generate_after_create_table(tables_target[table_name])
+                target = tables_target[table_name]
+                add('create', table_name, ['CREATE TABLE `%s` (\n%s\n%s' % (
+                    table_name, '\n'.join(self._generate_create_table(target)), describe_table_end(target))] +
+                    list(self._generate_after_create_table(target, no_foreign_key=True)))
+                if not self.no_foreign_key:
+                    add('add foreign keys', table_name, self._generate_after_create_table(target, uk=False))
+
+        def depend(step, kind, table_names):
+            for table_name in table_names:
+                name = '%s `%s`' % (kind, table_name)
+                if name in steps and name != step.name:
+                    step.depends.append(name)
+
+        referencing = {}
+        for table_name, table in tables_source.items():
+            for key in table['fk'].values():
+                referencing.setdefault(key['table'], set()).add(table_name)
+        for step in steps.values():
+            kind = step.kind
+            if kind == 'alter':
+                depend(step, 'rename', [step.table])
+                depend(step, 'drop foreign keys', [step.table] + sorted(referencing.get(step.table, ())))
+            elif kind == 'drop':
+                depend(step, 'drop foreign keys', sorted(referencing.get(step.table, ())))
+                depend(step, 'drop', sorted(referencing.get(step.table, ())))
+            elif kind == 'add foreign keys':
+                referenced = sorted(set(key['table'] for key in tables_target[step.table]['fk'].values()))
+                for depended in ('rename', 'drop foreign keys', 'alter', 'create'):
+                    depend(step, depended, [step.table] + referenced)
+        return list(steps.values())
+
+    def compare_fleet(self, baseline_file_name, target_file_names):
+        """Write the migrations bringing each target schema to the baseline, the
+        targets needing the same migration being grouped together.
+        The baseline is parsed once, then the targets are parsed and compared
+        with it by a pool of self.jobs processes. A target which can not be
+        read is reported without stopping the others. The migrations follow
+        the order of the tables in the dumps, whether the targets are parsed
+        or read from the cache, so the targets dumped alike are grouped.
+        Returns the number of failed targets."""
+        with phase('compare'):
+            patterns, failures = group_fleet_diffs(self.iter_fleet_diffs(baseline_file_name, target_file_names))
+        self._write(iter_fleet_report(patterns, failures))
+        return len(failures)
 
+    def iter_fleet_diffs(self, baseline_file_name, target_file_names):
+        """Yield (target file name, migration text, error) for each target, in order.
+        Either the migration (maybe empty) or the error message is None."""
+        global fleet_state
+        baseline = analyse_dump_files([baseline_file_name], self.table_filter(), self.parser, self.buffer_size,
+                                      self.jobs, cache=self.cache, incremental=self.incremental)[0]
+        # forked workers inherit the parsed baseline instead of receiving a copy
+        fleet_state = (self, baseline)
+        try:
+            if self.jobs <= 1 or len(target_file_names) <= 1:
+                for file_name in target_file_names:
+                    yield diff_fleet_target(file_name)
+                return
+            import multiprocessing
+            pool = multiprocessing.Pool(self.jobs)
+            try:
+                for result in pool.imap(diff_fleet_target, target_file_names):
+                    yield result
+            finally:
+                pool.terminate()
+                pool.join()
+        finally:
+            fleet_state = None
+
+    def _generate_fingerprints(self, file_name, tables):
+        """ one line per table with its fingerprint, after the digest of the schema
+        """
+        yield '-- %s %s' % (schema_digest(tables), file_name)
+        for table_name in sorted(tables):
+            yield '%s %s' % (get_fingerprint(tables[table_name]), table_name)
 
-    def _generate_after_create_table(self, target):
+    def _generate_after_create_table(self, target, no_foreign_key=None, uk=True):
         """
          after the create statement (e.g. add a field or an index)
         """
+        if no_foreign_key is None:
+            no_foreign_key = self.no_foreign_key
         # 2.2. compare fk, uk
-        if not self.no_foreign_key:
+        if not no_foreign_key:
             for key_hash in target['fk']:
-                print 'ALTER TABLE `%s` ADD CONSTRAINT `%s` FOREIGN KEY (%s) REFERENCES `%s` (%s);' \
+                yield 'ALTER TABLE `%s` ADD CONSTRAINT `%s` FOREIGN KEY (%s) REFERENCES `%s` (%s);' \
                       % (target['name'], target['fk'][key_hash]['name'],
                          get_quoted_fields(target['fk'][key_hash]['k']),
                          target['fk'][key_hash]['table'],
                          get_quoted_fields(target['fk'][key_hash]['fk']))
+        if not uk:
+            return
 
         for key_type in [{'name': 'UNIQUE INDEX', 'id': 'uk'}, {'name': 'FULLTEXT KEY', 'id': 'ft'}]:
             for key_name in target[key_type['id']]:
                 index_name = target[key_type['id']][key_name]['name']
                 if index_name == '':
                     index_name = key_name
-                print 'ALTER TABLE %s ADD %s `%s` (%s);' % (
+                yield 'ALTER TABLE %s ADD %s `%s` (%s);' % (
                     target['name'], key_type['name'], index_name,
                     ', '.join(target[key_type['id']][key_name]['fields']))
+        indexes = target.get('ix') or {}
+        for key_id in sorted(indexes):
+            yield 'ALTER TABLE `%s` ADD %s;' % (target['name'], describe_index(indexes[key_id]))
 
     def _generate_create_table(self, target):
         """ make syntax to create the table
@@ -119,175 +983,1193 @@ class CompDB:
         if len(target['pk']):
             output_fields.append('PRIMARY KEY (%s)' % get_quoted_fields(target['pk']))
 
-        field_output = ",\n".join("\t%s" % field for field in output_fields)
-        print field_output
+        yield ",\n".join("\t%s" % field for field in output_fields)
+
+
+# (CompDB, parsed baseline) of the fleet being compared, see CompDB.iter_fleet_diffs
+fleet_state = None
+
+
+def diff_fleet_target(file_name):
+    """Parse a target of the fleet and compare it with the baseline.
+    Returns (file name, migration text, error message)."""
+    comp, baseline = fleet_state
+    try:
+        tables = analyse_dump_files([file_name], comp.table_filter(), comp.parser, comp.buffer_size,
+                                    cache=comp.cache, incremental=comp.incremental)[0]
+        return file_name, ''.join('%s\n' % line for line in comp.iter_migration(tables, baseline)), None
+    except Exception, e:
+        return file_name, None, '%s: %s' % (type(e).__name__, e)
+
+
+def group_fleet_diffs(results):
+    """Group the targets of the results of CompDB.iter_fleet_diffs by migration.
+    Returns (OrderedDict of the target file names by migration, [(file name, error)])."""
+    patterns = OrderedDict()
+    failures = []
+    for file_name, migration, error in results:
+        if error is None:
+            patterns.setdefault(migration, []).append(file_name)
+        else:
+            failures.append((file_name, error))
+    return patterns, failures
+
+
+def iter_fleet_report(patterns, failures):
+    """Lines of the fleet report: the targets without drift, each distinct
+    migration after the list of its targets, then the failures."""
+    up_to_date = patterns.get('', [])
+    yield '-- Up to date: %d schemas' % len(up_to_date)
+    for file_name in up_to_date:
+        yield '--   %s' % file_name
+    yield ''
+    number = 0
+    for migration, file_names in patterns.items():
+        if not migration:
+            continue
+        number += 1
+        yield '-- Drift %d: %d schemas' % (number, len(file_names))
+        for file_name in file_names:
+            yield '--   %s' % file_name
+        for line in migration.splitlines():
+            yield line
+        yield ''
+    if failures:
+        yield '-- Failed: %d schemas' % len(failures)
+        for file_name, error in failures:
+            yield '--   %s: %s' % (file_name, error)
 
 
-def compare_tables(source, target, no_loss, no_foreign_key=False):
+def compare_tables(source, target, no_loss, no_foreign_key=False, detect_renames=False, online_ddl=False):
     """
     this covers the case:
         * after the create statement (e.g. add a field or an index)
         1. source is not None
     source: Source table dictionary
     target: Target table dictionary
-    output: migration lines
+    detect_renames: a dropped and an added column of the same definition are renamed, see find_column_renames
+    online_ddl: end each statement with its ALGORITHM and LOCK, see iter_table_changes
+    output: migration lines, see iter_compare_tables
     """
+    return ''.join('%s\n' % statement for statement in iter_compare_tables(source, target, no_loss, no_foreign_key,
+                                                                           detect_renames, online_ddl))
+
+
+def iter_compare_tables(source, target, no_loss, no_foreign_key=False, detect_renames=False, online_ddl=False):
+    """compare_tables yielding each migration line, without its end of line,
+    as soon as it is found.
+    online_ddl - add its ALGORITHM and LOCK to each statement, see online_ddl_options"""
+    for kind, destructive, statement, clause, ddl, before, after in iter_replaced_primary_keys(
+            iter_table_diff(source, target, no_foreign_key, detect_renames)):
+        if kind == CHANGE_COMMENT:
+            yield clause
+        else:
+            if online_ddl:
+                clause += online_ddl_options(ddl)
+            yield '%s%s %s;' % (no_loss if destructive else '', statement, clause)
+
+
+def iter_foreign_key_changes(source, target, kind, no_loss, detect_renames=False, online_ddl=False):
+    """The statements of iter_compare_tables of the CHANGE_DROP_FOREIGN_KEY
+    or CHANGE_ADD_FOREIGN_KEY kind only."""
+    for change_kind, destructive, statement, clause, ddl in iter_table_changes(source, target, False, detect_renames):
+        if change_kind == kind:
+            if online_ddl:
+                clause += online_ddl_options(ddl)
+            yield '%s%s %s;' % (no_loss if destructive else '', statement, clause)
+
+
+# kinds of the changes of iter_table_changes, in the order of their clauses in
+# the single ALTER TABLE of iter_coalesced_alter
+CHANGE_COMMENT = 'comment'
+CHANGE_DROP_FOREIGN_KEY = 'drop foreign key'
+CHANGE_DROP_INDEX = 'drop index'
+CHANGE_DROP_PRIMARY_KEY = 'drop primary key'
+CHANGE_COLUMN = 'column'
+CHANGE_ADD_INDEX = 'add index'
+CHANGE_ADD_PRIMARY_KEY = 'add primary key'
+CHANGE_ADD_FOREIGN_KEY = 'add foreign key'
+CHANGE_TABLE_OPTIONS = 'table options'
+CHANGE_PARTITION = 'partition'
+CLAUSE_ORDER = dict((kind, i) for i, kind in enumerate((CHANGE_DROP_INDEX, CHANGE_DROP_PRIMARY_KEY, CHANGE_COLUMN,
+                                                       CHANGE_ADD_INDEX, CHANGE_ADD_PRIMARY_KEY,
+                                                       CHANGE_ADD_FOREIGN_KEY, CHANGE_TABLE_OPTIONS)))
+
+# InnoDB online DDL algorithms, the cheapest first, and the LOCK they are run with:
+# None for the default of INSTANT, 'NONE' when reads and writes go on, 'SHARED' when only reads do
+INSTANT = 'INSTANT'
+INPLACE = 'INPLACE'
+COPY = 'COPY'
+ALGORITHMS = (INSTANT, INPLACE, COPY)
+LOCKS = (None, 'NONE', 'SHARED')
+DDL_INSTANT = (INSTANT, None)
+DDL_INPLACE = (INPLACE, 'NONE')
+DDL_COPY = (COPY, 'SHARED')
+DDL_INPLACE_SHARED = (INPLACE, 'SHARED')
+
+RE_VARCHAR = re.compile(r'(?i)varchar\((\d+)\)$')
+RE_MEMBERS = re.compile(r'(?i)(enum|set)\((.*)\)$')
+
+# longest varchar, in bytes, of which the length fits in one byte
+SHORT_VARCHAR_BYTES = 255
+# the bytes per character of the character sets, e.g. 1 in latin1, 3 in utf8
+# and 4 in utf8mb4
+CHARACTER_BYTES = (1, 2, 3, 4)
+
+
+def same_length_bytes(source_length, target_length):
+    """True if the values of a varchar of source_length and of target_length
+    characters have the same number of length bytes in every character set"""
+    return all((source_length * size <= SHORT_VARCHAR_BYTES) == (target_length * size <= SHORT_VARCHAR_BYTES)
+               for size in CHARACTER_BYTES)
+
+
+def column_ddl(source_field, target_field):
+    """The (algorithm, lock) of the MODIFY or CHANGE COLUMN of source_field into target_field:
+        renaming, changing the default or adding ENUM and SET members at the end is INSTANT,
+        extending a VARCHAR within the same length bytes in every character
+        set (see same_length_bytes) or changing NULL is INPLACE,
+        any other type change or AUTO_INCREMENT change needs a COPY."""
+    if source_field['inc'] != target_field['inc']:
+        return DDL_COPY
+    source_type = source_field['type']
+    target_type = target_field['type']
+    if source_type != target_type:
+        source_members = RE_MEMBERS.match(source_type)
+        target_members = RE_MEMBERS.match(target_type)
+        source_length = RE_VARCHAR.match(source_type)
+        target_length = RE_VARCHAR.match(target_type)
+        if source_members and target_members and \
+                source_members.group(1).lower() == target_members.group(1).lower() and \
+                target_members.group(2).startswith(source_members.group(2) + ','):
+            ddl = DDL_INSTANT
+        elif source_length and target_length and \
+                int(source_length.group(1)) <= int(target_length.group(1)) and \
+                same_length_bytes(int(source_length.group(1)), int(target_length.group(1))):
+            ddl = DDL_INPLACE
+        else:
+            return DDL_COPY
+    else:
+        ddl = DDL_INSTANT
+    if source_field['nn'] != target_field['nn']:
+        return DDL_INPLACE
+    return ddl
+
+
+def combine_ddl(ddls):
+    """The (algorithm, lock) of an ALTER TABLE made of changes of the (algorithm, lock) ddls"""
+    ddls = list(ddls)
+    algorithm = max(ALGORITHMS.index(ddl[0]) for ddl in ddls)
+    if algorithm == 0:
+        return DDL_INSTANT
+    return ALGORITHMS[algorithm], LOCKS[max(max(LOCKS.index(ddl[1]) for ddl in ddls), 1)]
+
+
+def online_ddl_options(ddl):
+    """The ALGORITHM and LOCK clauses of an (algorithm, lock)"""
+    algorithm, lock = ddl
+    if lock is None:
+        return ', ALGORITHM=%s' % algorithm
+    return ', ALGORITHM=%s, LOCK=%s' % (algorithm, lock)
+
+
+def iter_table_changes(source, target, no_foreign_key=False, detect_renames=False):
+    """The changes from the source to the target table, in the order of the
+    statements of iter_compare_tables.
+    Yields (kind, destructive, statement, clause, ddl): a CHANGE_ kind, True
+    if the change loses data, the 'ALTER TABLE <name>' the clause applies to,
+    the clause, e.g. 'DROP COLUMN `a`', and the (algorithm, lock) of the InnoDB
+    online DDL of MySQL 8.0.29 and later it needs. The clause of the
+    CHANGE_COMMENT changes is a whole comment line, their ddl is None."""
+    for change in iter_table_diff(source, target, no_foreign_key, detect_renames):
+        yield change[:5]
+
+
+def iter_table_diff(source, target, no_foreign_key=False, detect_renames=False):
+    """iter_table_changes yielding (kind, destructive, statement, clause, ddl,
+    before, after): before and after are the changed Field, Key, ForeignKey
+    or primary key set of the source and of the target table, None when the
+    change adds or drops it. Both are None for the CHANGE_COMMENT changes."""
+    renames = {}
+    if detect_renames:
+        renames = find_column_renames(source, target)
+        if renames:
+            # the keys follow their renamed columns
+            source = rename_key_columns(source, renames)
+    alter = 'ALTER TABLE `%s`' % source['name']
     # 2.1. compare fields
-    output = ""
     for field_name in source['fields']:
         if field_name in target['fields']:
             if source['fields'][field_name] != target['fields'][field_name]:
-                output += "ALTER TABLE `%s` MODIFY COLUMN %s;\n" % (source['name'],
-                                                              describe_field(target['fields'][field_name]))
+                yield CHANGE_COLUMN, False, alter, 'MODIFY COLUMN %s' % describe_field(target['fields'][field_name]), \
+                    column_ddl(source['fields'][field_name], target['fields'][field_name]), \
+                    source['fields'][field_name], target['fields'][field_name]
+        elif field_name in renames:
+            yield CHANGE_COLUMN, False, alter, 'CHANGE COLUMN `%s` %s' % (
+                field_name, describe_field(target['fields'][renames[field_name]])), \
+                column_ddl(source['fields'][field_name], target['fields'][renames[field_name]]), \
+                source['fields'][field_name], target['fields'][renames[field_name]]
         else:
-            output += '%sALTER TABLE `%s` DROP COLUMN `%s`;\n' % (no_loss, source['name'], field_name)
+            yield CHANGE_COLUMN, True, alter, 'DROP COLUMN `%s`' % field_name, DDL_INSTANT, \
+                source['fields'][field_name], None
+    renamed = set(renames.values())
     last = None
     for (name, field) in target['fields'].items():
-        if name not in source['fields']:
+        if name not in source['fields'] and name not in renamed:
             if last:
                 column_order = "AFTER `%s`" % last
             else:
                 column_order = "FIRST"
-            output += 'ALTER TABLE `%s` ADD COLUMN %s %s;\n' % (source['name'],
-                                                       describe_field(field), column_order)
+            yield CHANGE_COLUMN, False, alter, 'ADD COLUMN %s %s' % (describe_field(field), column_order), \
+                DDL_COPY if field['inc'] else DDL_INSTANT, None, field
         last = name
 
     # 2.2. compare fk
     if not no_foreign_key:
         for key_hash in source['fk']:
             if key_hash not in target['fk']:
-                output += '%sALTER TABLE `%s` DROP FOREIGN KEY `%s`;\n' % (no_loss, target['name'],
-                                                                     target['fk'][key_hash]['name'])
+                yield CHANGE_DROP_FOREIGN_KEY, True, 'ALTER TABLE `%s`' % target['name'], \
+                    'DROP FOREIGN KEY `%s`' % source['fk'][key_hash]['name'], DDL_INPLACE, source['fk'][key_hash], None
 
         for key_hash in target['fk']:
             if key_hash not in source['fk']:
-                output += 'ALTER TABLE `%s` ADD CONSTRAINT `%s` FOREIGN KEY (%s) REFERENCES `%s` (%s);\n' \
-                      % (target['name'], target['fk'][key_hash]['name'],
-                         get_quoted_fields(target['fk'][key_hash]['k']),
-                         target['fk'][key_hash]['table'],
-                         get_quoted_fields(target['fk'][key_hash]['fk']))
+                # INPLACE only with foreign_key_checks disabled
+                yield CHANGE_ADD_FOREIGN_KEY, False, 'ALTER TABLE `%s`' % target['name'], \
+                    'ADD CONSTRAINT `%s` FOREIGN KEY (%s) REFERENCES `%s` (%s)' % (
+                        target['fk'][key_hash]['name'], get_quoted_fields(target['fk'][key_hash]['k']),
+                        target['fk'][key_hash]['table'], get_quoted_fields(target['fk'][key_hash]['fk'])), DDL_COPY, \
+                    None, target['fk'][key_hash]
     # 2.3. compare uk
     for key_type in [{'name': 'UNIQUE INDEX', 'id': 'uk'}, {'name': 'FULLTEXT KEY', 'id': 'ft'}]:
         for key_name in source[key_type['id']]:
             if key_name not in target[key_type['id']]:
-                output += '-- %s (%s) \n' % (key_type['name'], ', '.join(source[key_type['id']][key_name]['fields']))
+                comment = '-- %s (%s) ' % (key_type['name'], ', '.join(source[key_type['id']][key_name]['fields']))
+                yield CHANGE_COMMENT, False, None, comment, None, None, None
                 index_name = source[key_type['id']][key_name]['name']
                 if index_name == '':
-                    output += '-- %s (%s) \n' % (key_type['name'], ', '.join(source[key_type['id']][key_name]['fields']))
+                    yield CHANGE_COMMENT, False, None, comment, None, None, None
                 else:
-                    output += '%sALTER TABLE %s DROP INDEX `%s`;\n' % (no_loss, source['name'],
-                                                                 source[key_type['id']][key_name]['name'])
+                    yield CHANGE_DROP_INDEX, True, 'ALTER TABLE %s' % source['name'], \
+                        'DROP INDEX `%s`' % source[key_type['id']][key_name]['name'], DDL_INPLACE, \
+                        source[key_type['id']][key_name], None
 
         for key_name in target[key_type['id']]:
             if key_name not in source[key_type['id']]:
                 index_name = target[key_type['id']][key_name]['name']
                 if index_name == '':
                     index_name = key_name
-                output += 'ALTER TABLE %s ADD %s `%s` (%s);\n' % (
-                    target['name'], key_type['name'], index_name,
-                    ', '.join(target[key_type['id']][key_name]['fields']))
+                yield CHANGE_ADD_INDEX, False, 'ALTER TABLE %s' % target['name'], 'ADD %s `%s` (%s)' % (
+                    key_type['name'], index_name, ', '.join(target[key_type['id']][key_name]['fields'])), \
+                    (INPLACE, 'SHARED') if key_type['id'] == 'ft' else DDL_INPLACE, \
+                    None, target[key_type['id']][key_name]
+    # 2.3.1. compare the secondary indexes by index id: a renamed index is the same index
+    source_indexes = source.get('ix') or {}
+    target_indexes = target.get('ix') or {}
+    for key_id in sorted(source_indexes):
+        index = source_indexes[key_id]
+        if not any(index_field(field) in target['fields'] for field in index['fields']):
+            # dropped with its columns
+            continue
+        if key_id not in target_indexes or target_indexes[key_id]['type'] != index['type']:
+            yield CHANGE_DROP_INDEX, False, alter, 'DROP INDEX `%s`' % index['name'], DDL_INPLACE, index, None
+    for key_id in sorted(target_indexes):
+        index = target_indexes[key_id]
+        if key_id not in source_indexes or source_indexes[key_id]['type'] != index['type']:
+            yield CHANGE_ADD_INDEX, False, alter, 'ADD %s' % describe_index(index), DDL_INPLACE, None, index
     # 2.4. compare pk
     if source['pk'] != target['pk']:
-        output += 'ALTER TABLE %s DROP PRIMARY KEY;\n' % source['name']
-        output += 'ALTER TABLE %s ADD PRIMARY KEY (%s);\n' % (source['name'], ', '.join(target['pk']))
+        # a primary key dropped without being replaced in the same ALTER TABLE
+        # needs a copy, see iter_replaced_primary_keys
+        if source['pk']:
+            yield CHANGE_DROP_PRIMARY_KEY, False, 'ALTER TABLE %s' % source['name'], 'DROP PRIMARY KEY', \
+                DDL_INPLACE if target['pk'] else DDL_COPY, source['pk'], None
+        if target['pk']:
+            yield CHANGE_ADD_PRIMARY_KEY, False, 'ALTER TABLE %s' % source['name'], \
+                'ADD PRIMARY KEY (%s)' % ', '.join(target['pk']), DDL_INPLACE, None, target['pk']
+    # 2.5. compare the table options, when both tables declare theirs
+    source_options = source.get('options')
+    target_options = target.get('options')
+    if source_options and target_options:
+        changed = {}
+        for name, default in TABLE_OPTIONS.items():
+            value = target_options.get(name, default)
+            if value is not None and source_options.get(name, default) not in (None, value):
+                changed[name] = value
+        if changed:
+            # a new engine copies the table, a new row format or character set rebuilds it in place
+            yield CHANGE_TABLE_OPTIONS, False, alter, describe_table_options(changed), \
+                DDL_COPY if 'ENGINE' in changed else DDL_INPLACE, source_options, target_options
+    # 2.6. compare the partitions
+    for destructive, clause, ddl, before, after in iter_partition_changes(source.get('partitions'),
+                                                                          target.get('partitions')):
+        yield CHANGE_PARTITION, destructive, alter, clause, ddl, before, after
 
-    return output
 
+def iter_replaced_primary_keys(changes):
+    """The changes of iter_table_diff in which the drop of a primary key and
+    the addition of its replacement are a single CHANGE_ADD_PRIMARY_KEY
+    change, of both clauses: on its own, the DROP PRIMARY KEY would need a
+    COPY, and leave the table without a primary key in between."""
+    dropped = None
+    for change in changes:
+        if dropped is not None:
+            if change[0] == CHANGE_ADD_PRIMARY_KEY:
+                change = (CHANGE_ADD_PRIMARY_KEY, False, change[2], '%s, %s' % (dropped[3], change[3]),
+                          combine_ddl((dropped[4], change[4])), dropped[5], change[6])
+            else:
+                yield dropped
+            dropped = None
+        if change[0] == CHANGE_DROP_PRIMARY_KEY:
+            dropped = change
+        else:
+            yield change
+    if dropped is not None:
+        yield dropped
 
-def analyse_file(lines, table_prefix=""):
-    """Produce a dict of tables.
-    lines - an iterable of lines or IO stream
-    table_prefix - prefix for table names to match - filter out those that do not.
-    Output Format - dict of tables:
-        <table_name>:
-            name: "<table_name>",
-            fields: (OrderedDictionary of names)
-                <field_name>:
-                    'name': <field_name>,
-                    'type': <field type>,
-                    'nn': <true if not null>,
-                    'default': <default value or None>,
-                    'inc': <true if auto increment>
-            pk: [<primary key name>, <primary key name>...],
-            fk: {<foreign keys dict>},
-            uk: {<unique keys dict>},
-            ft: {<fulltext key  dict>},
-    """
-    # read the file
-    tables = {}
-    current_table = None
-    comment = False
-    line_number = 0
-    for line in lines:
-        line_number += 1
-        detected = False
-        if re.match('--', line):
-            continue
-        if re.match('/\*.*\*/', line):
-            continue
-        if re.match('\/\*\!.*\*\/\;*$',line):
-           # print "ignoring as line is commented :(%s)"%line
-            continue
-        if re.match('^\s*\/\*\!.*',line):
-           # print "comment started as line as comment start:(%s)"%line
-            comment = True
+
+def iter_partition_changes(source, target):
+    """The changes from the source to the target Partitioning, either None.
+    Yields (destructive, clause, ddl, before, after) as iter_table_diff does:
+        - a table partitioned another way is partitioned again, a whole table copy,
+        - the number of HASH and KEY partitions is changed by ADD PARTITION
+          PARTITIONS and COALESCE PARTITION,
+        - the RANGE and LIST partitions which differ from the source to the
+          target are paired by runs, the unchanged partitions between them: a
+          run of new partitions is added, a run of partitions gone is dropped,
+          their data lost, and a run of changed ones is reorganized into the
+          target partitions. MySQL only reorganizes partitions into ones
+          covering the same values, except for the last RANGE partition: the
+          runs are widened until they do (see partition_run_end). Partitions
+          inserted before an unchanged RANGE partition split it, which is
+          reorganized with them.
+    before and after are the Partitionings, or the lists of the Partitions of
+    the run. The partitions are compared by their name and values only."""
+    if source == target:
+        return
+    if target is None:
+        yield False, 'REMOVE PARTITIONING', DDL_COPY, source, None
+        return
+    if source is None or (source['type'], source['expression'], source['sub']) != \
+            (target['type'], target['expression'], target['sub']):
+        yield False, describe_partitioning(target), DDL_COPY, source, target
+        return
+    if target['type'].split()[-1] in ('HASH', 'KEY'):
+        if target['count'] > source['count']:
+            yield False, 'ADD PARTITION PARTITIONS %d' % (target['count'] - source['count']), DDL_INPLACE_SHARED, \
+                source, target
+        elif target['count'] < source['count']:
+            yield False, 'COALESCE PARTITION %d' % (source['count'] - target['count']), DDL_INPLACE_SHARED, \
+                source, target
+        return
+    ranged = target['type'].startswith('RANGE')
+    source_partitions = source['partitions']
+    target_partitions = target['partitions']
+    matcher = difflib.SequenceMatcher(None, [partition.as_tuple() for partition in source_partitions],
+                                      [partition.as_tuple() for partition in target_partitions], autojunk=False)
+    # the end of the partitions already changed, after a widened run
+    source_end = target_end = 0
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        i1 = max(i1, source_end)
+        j1 = max(j1, target_end)
+        i2 = max(i2, i1)
+        j2 = max(j2, j1)
+        if tag == 'equal' or (i1 == i2 and j1 == j2):
             continue
-        if current_table is None:
-            # as it is inside the comments
-            if comment is True:
-                # check if it is comment end
-                if re.match('.*\*\/\;*$',line):
-            #        print "comment ended so making comment as False"
-                    comment = False
-             #   print "ignoring as line is inside comments :(%s)"%line
-                continue
-            # statements to ignore
-            if re.match('(?i)\s*DROP TABLE', line):
-                detected = True
-            # statements to ignore
-            if re.match('(?i)\s*SET @|\w', line):
-                detected = True
-            match = re.match('(?i)CREATE TABLE `([^`]*)`', line)
-            if (match):
-                detected = True
-                current_table = {'name' : match.group(1), 'fields': OrderedDict(), 'pk': set(), 'fk': {}, 'uk': {}, 'ft': {}}
-            # ALTER TABLE `plays_text_sample` ADD CONSTRAINT text_id_refs_id_4aaf935 FOREIGN KEY
-            # (`text_id`) REFERENCES `plays_text` (`id`);
-            foreign_key = re.match(
-                '(?i)\s*ALTER TABLE\s+`([^`]+)`\s+ADD CONSTRAINT\s+(.+)\s+'
-                'FOREIGN KEY\s+\(([^)]+)\)\s+REFERENCES\s+`([^`]+)`\s+\(([^)]+)\)', line)
-            if foreign_key:
-                detected = True
-                # split the fields
-                key_fields = re.split(',', foreign_key.group(3))
-                source_fields = []
-                for field in key_fields:
-                    source_fields.append(field.strip(' ').strip('`'))
-                key_fields = re.split(',', foreign_key.group(5))
-                target_fields = []
-                for field in key_fields:
-                    target_fields.append(field.strip(' ').strip('`'))
+        if j1 < j2 and (i1 < i2 or (ranged and i2 < len(source_partitions))):
+            i2, j2 = partition_run_end(source_partitions, target_partitions, i1, i2, j1, j2, ranged)
+        source_end = i2
+        target_end = j2
+        dropped = list(source_partitions[i1:i2])
+        added = list(target_partitions[j1:j2])
+        definitions = ', '.join(describe_partition(partition) for partition in added)
+        if not dropped:
+            yield False, 'ADD PARTITION (%s)' % definitions, DDL_INPLACE, None, added
+        elif not added:
+            yield True, 'DROP PARTITION %s' % ', '.join(partition['name'] for partition in dropped), DDL_INPLACE, \
+                dropped, None
+        else:
+            yield False, 'REORGANIZE PARTITION %s INTO (%s)' % (
+                ', '.join(partition['name'] for partition in dropped), definitions), DDL_INPLACE_SHARED, \
+                dropped, added
 
-                fk_table = clean_field_name(foreign_key.group(4))
-                fkid = ''.join(source_fields) + '->' + fk_table + '.' + ''.join(target_fields)
-                tables[foreign_key.group(1)]['fk'][fkid] = {'table': fk_table, 'k': source_fields,
-                                                            'fk': target_fields,
-                                                            'name': clean_field_name(foreign_key.group(2))}
-                #['fk'][foreign_key.group(2)] = {'table': foreign_key.group(4),
-                # 'k': source_fields, 'fk': target_fields}
 
+def partition_values(partition):
+    """The set of the values of a LIST partition"""
+    values = partition['values']
+    return set(value.strip() for value in split_definitions(read_parenthesized(values, values.index('('))[0]))
+
+
+def partition_run_end(source_partitions, target_partitions, i1, i2, j1, j2, ranged):
+    """The ends (i2, j2) of the run of source_partitions[i1:i2] reorganized
+    into target_partitions[j1:j2], widened until both cover the same values:
+        - RANGE partitions up to the first bound ending both runs, the runs
+          starting after the same bound. The partitions are in the order of
+          their bounds, which are unique.
+        - LIST partitions until the values of both runs are the same.
+    Both runs go up to the end of the partitions when they never do."""
+    if ranged:
+        target_ends = dict((partition['values'], end)
+                           for end, partition in enumerate(target_partitions[j1:], j1 + 1) if end >= j2)
+        for end in xrange(max(i2, i1 + 1), len(source_partitions) + 1):
+            if source_partitions[end - 1]['values'] in target_ends:
+                return end, target_ends[source_partitions[end - 1]['values']]
+        return len(source_partitions), len(target_partitions)
+    source_values = set()
+    for partition in source_partitions[i1:i2]:
+        source_values |= partition_values(partition)
+    target_values = set()
+    for partition in target_partitions[j1:j2]:
+        target_values |= partition_values(partition)
+    while source_values != target_values:
+        if i2 < len(source_partitions) and (target_values - source_values or j2 == len(target_partitions)):
+            source_values |= partition_values(source_partitions[i2])
+            i2 += 1
+        elif j2 < len(target_partitions):
+            target_values |= partition_values(target_partitions[j2])
+            j2 += 1
         else:
-            # statements to ignore
-            if re.match('\s*KEY `', line):
-                detected = True
-            # remove , at the end
-            line = line.strip(",")
-            # FIELD
+            break
+    return i2, j2
+
+
+# the indexes of a table by key type, and their name in the statements
+INDEX_TYPES = (('uk', 'UNIQUE INDEX'), ('ft', 'FULLTEXT KEY'), ('ix', 'INDEX'))
+
+
+def describe_key(kind, key):
+    """The definition of a unique, fulltext or secondary index of INDEX_TYPES"""
+    if kind == 'ix':
+        return describe_index(key)
+    return '%s `%s` (%s)' % (dict(INDEX_TYPES)[kind], key['name'] or ''.join(key['fields']),
+                             get_quoted_fields(key['fields']))
+
+
+def iter_missing_indexes(tables, baseline_tables):
+    """The missing-index report: yield (table name, kind, key) for each index of
+    the baseline tables, e.g. of the schema of a release, which the table of
+    the same name of tables, e.g. of production, lacks. kind is a key type of
+    INDEX_TYPES. The indexes are compared by their index id, so that an
+    index of another name or type on the same columns is not reported. The
+    tables missing altogether are left to the migration."""
+    for table_name in sorted(baseline_tables):
+        table = tables.get(table_name)
+        if table is None:
+            continue
+        present = set(index_id(key['fields']) for kind, name in INDEX_TYPES
+                      for key in (table.get(kind) or {}).values())
+        baseline = baseline_tables[table_name]
+        for kind, name in INDEX_TYPES:
+            keys = baseline.get(kind) or {}
+            for key_id in sorted(keys):
+                if index_id(keys[key_id]['fields']) not in present:
+                    yield table_name, kind, keys[key_id]
+
+
+# object of the change records by CHANGE_ kind, see change_record
+RECORD_OBJECTS = {CHANGE_COLUMN: 'column', CHANGE_DROP_FOREIGN_KEY: 'foreign key', CHANGE_ADD_FOREIGN_KEY: 'foreign key',
+                  CHANGE_DROP_INDEX: 'index', CHANGE_ADD_INDEX: 'index', CHANGE_DROP_PRIMARY_KEY: 'primary key',
+                  CHANGE_ADD_PRIMARY_KEY: 'primary key', CHANGE_TABLE_OPTIONS: 'table options',
+                  CHANGE_PARTITION: 'partition'}
+
+
+def json_definition(value):
+    """The JSON form of a parsed table, field, key or primary key: the
+    objects become dicts, the Fields a list and the sets sorted lists."""
+    if isinstance(value, Fields):
+        return [json_definition(field) for field in value.values()]
+    if isinstance(value, (dict, SchemaObject)):
+        return dict((key, json_definition(item)) for key, item in value.items())
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if isinstance(value, (list, tuple)):
+        return [json_definition(item) for item in value]
+    return value
+
+
+def change_record(table, object_kind, change, before, after, sql, destructive=False, ddl=None):
+    """A change of the migration, as written by the ndjson format:
+        table: name of the changed table
+        object: 'table', 'column', 'index', 'primary key', 'foreign key',
+                'table options' or 'partition'
+        change: 'create', 'add', 'modify', 'rename' or 'drop'
+        before, after: json_definition of the object in the source and in the
+                       target schema, None when it is created or dropped
+        sql: the statement of the change, commented out when it is kept from
+             running (see CompDB.set_no_removing)
+        destructive: True if the change loses data
+        algorithm, lock: of its InnoDB online DDL, see iter_table_changes"""
+    return {'table': table, 'object': object_kind, 'change': change,
+            'before': None if before is None else json_definition(before),
+            'after': None if after is None else json_definition(after),
+            'sql': sql, 'destructive': destructive,
+            'algorithm': ddl and ddl[0], 'lock': ddl and ddl[1]}
+
+
+def iter_coalesced_alter(source, target, no_loss, no_foreign_key=False, detect_renames=False, online_ddl=False):
+    """iter_compare_tables merging the changes of the table into a single
+    ALTER TABLE, so that the table is rebuilt once:
+        - the comments come first,
+        - then the foreign keys are dropped on their own, so that the
+          columns and indexes they use can change and constraints of the same
+          name be added again,
+        - then a single ALTER TABLE drops the indexes and the primary key,
+          changes the columns in the order of the table, so that the AFTER
+          columns exist when a column is added, then adds the indexes, the
+          primary key, the foreign keys and the table options,
+        - then the partitions are changed, each by a statement of its own as
+          MySQL requires.
+    The destructive clauses are commented out as statements of their own when
+    no_loss is set.
+    online_ddl - end each statement with the ALGORITHM and LOCK of its most
+                 expensive clause"""
+    clauses = []
+    dropped_foreign_keys = []
+    partitions = []
+    for kind, destructive, statement, clause, ddl in iter_table_changes(source, target, no_foreign_key,
+                                                                         detect_renames):
+        if kind == CHANGE_COMMENT:
+            yield clause
+        elif destructive and no_loss:
+            yield '%sALTER TABLE `%s` %s;' % (no_loss, source['name'],
+                                             clause + online_ddl_options(ddl) if online_ddl else clause)
+        elif kind == CHANGE_DROP_FOREIGN_KEY:
+            dropped_foreign_keys.append((clause, ddl))
+        elif kind == CHANGE_PARTITION:
+            partitions.append('ALTER TABLE `%s` %s%s;' % (source['name'], clause,
+                                                          online_ddl_options(ddl) if online_ddl else ''))
+        else:
+            clauses.append((CLAUSE_ORDER[kind], len(clauses), clause, ddl))
+    if dropped_foreign_keys:
+        options = online_ddl_options(combine_ddl(ddl for clause, ddl in dropped_foreign_keys)) if online_ddl else ''
+        yield 'ALTER TABLE `%s` %s%s;' % (source['name'], ', '.join(clause for clause, ddl in dropped_foreign_keys),
+                                          options)
+    if clauses:
+        clauses.sort()
+        options = ''
+        if online_ddl:
+            options = ',\n\t' + online_ddl_options(combine_ddl(ddl for order, i, clause, ddl in clauses))[2:]
+        yield 'ALTER TABLE `%s`\n%s%s;' % (source['name'], ',\n'.join('\t%s' % clause for order, i, clause, ddl
+                                                                      in clauses), options)
+    for statement in partitions:
+        yield statement
+
+
+# size from which the tables of the size hints are altered by OSC_COMMAND, see read_size_hints
+DEFAULT_OSC_MIN_SIZE = 1024 * 1024 * 1024
+
+# the online schema change command altering a table without a COPY, with the
+# clauses of the ALTER TABLE and the DSN of the table
+OSC_COMMAND = 'pt-online-schema-change --alter %(alter)s %(dsn)s --execute'
+
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+RE_SIZE_HINT = re.compile(r'(?i)\s*(\S+)\s+(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$')
+
+
+def read_size_hints(file_name):
+    """Read the sizes of the tables from lines '<table> <size>', e.g. 'mydb.orders 200G'.
+    The table can be qualified by its database, the size be followed by K, M, G
+    or T. Empty lines and lines starting with # are skipped.
+    Returns a dict of the sizes in bytes by (database or None, table name)."""
+    hints = {}
+    with open(file_name) as fd:
+        for line_number, line in enumerate(fd, 1):
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+            match = RE_SIZE_HINT.match(line)
+            if not match:
+                raise ValueError('%s:%d: expected <table> <size>, got %r' % (file_name, line_number, line.strip()))
+            database, dot, table_name = match.group(1).rpartition('.')
+            hints[database or None, table_name] = int(float(match.group(2)) * SIZE_UNITS[match.group(3).upper()])
+    return hints
+
+
+def needs_copy(source, target, no_foreign_key=False, detect_renames=False):
+    """True if a change from the source to the target table needs the COPY algorithm"""
+    return any(ddl is not None and ddl[0] == COPY
+               for kind, destructive, statement, clause, ddl
+               in iter_table_changes(source, target, no_foreign_key, detect_renames))
+
+
+def iter_osc_alter(source, target, no_loss, no_foreign_key=False, detect_renames=False, database=None):
+    """The changes of a large table as a single OSC_COMMAND, commented out of
+    the SQL, instead of ALTER TABLE statements which would copy it while it is
+    locked. Its destructive clauses are left out when no_loss is set, as
+    commented out statements. The changes of its partitions which do not
+    copy it are left out of the command too, as statements of their own."""
+    clauses = []
+    for kind, destructive, statement, clause, ddl in iter_table_changes(source, target, no_foreign_key,
+                                                                         detect_renames):
+        if kind == CHANGE_COMMENT:
+            yield clause
+        elif destructive and no_loss:
+            yield '%sALTER TABLE `%s` %s;' % (no_loss, source['name'], clause)
+        elif kind == CHANGE_PARTITION and ddl != DDL_COPY:
+            yield 'ALTER TABLE `%s` %s;' % (source['name'], clause)
+        else:
+            clauses.append(clause)
+    if clauses:
+        import pipes
+        dsn = 't=%s' % source['name']
+        if database:
+            dsn = 'D=%s,%s' % (database, dsn)
+        yield '-- ' + OSC_COMMAND % {'alter': pipes.quote(', '.join(clauses)), 'dsn': dsn}
+
+
+# most candidates of the same signature weighed against a dropped table, see find_table_renames
+MAX_RENAME_CANDIDATES = 64
+
+
+def field_signature(field):
+    """The definition of a field, its name aside"""
+    return field['type'], field['nn'], field['default'], field['inc']
+
+
+def table_signature(table):
+    """Hash of the structure of a table, the names of the table and of its
+    columns aside: the sequence of its column definitions and the shapes of
+    its keys, made of the positions of their columns."""
+    positions = dict((name, i) for i, name in enumerate(table['fields']))
+
+    def shape(fields):
+        return tuple(positions.get(field, field) for field in fields)
+    signature = hashlib.sha1()
+    for field in table['fields'].values():
+        signature.update('%r\n' % (field_signature(field),))
+    signature.update('%r\n' % (sorted(shape(table['pk'])),))
+    for key_type in ('uk', 'ft'):
+        signature.update('%r\n' % (sorted(shape(key['fields']) for key in table[key_type].values()),))
+    indexes = table.get('ix')
+    if indexes:
+        signature.update('%r\n' % (sorted((shape(index_field(field) for field in index['fields']), index['type'])
+                                           for index in indexes.values()),))
+    signature.update('%r\n' % (sorted((shape(key['k']), key['table'], tuple(key['fk']))
+                                      for key in table['fk'].values()),))
+    return signature.hexdigest()
+
+
+def rename_score(source, target):
+    """How alike two tables are by their names and the names of their columns"""
+    shared = len(set(source['fields']) & set(target['fields']))
+    return shared, difflib.SequenceMatcher(None, source['name'], target['name']).ratio()
+
+
+def find_table_renames(tables_source, tables_target):
+    """Pair the tables only found in tables_source with the tables only found
+    in tables_target which have the same structure. The tables are grouped by
+    fingerprint first, then by table_signature, so that a table which columns
+    were renamed too is found. Within a group the most alike tables by
+    rename_score are paired first, MAX_RENAME_CANDIDATES at a time.
+    Returns an OrderedDict of the new names by old name."""
+    dropped = [table_name for table_name in tables_source if table_name not in tables_target]
+    created = [table_name for table_name in tables_target if table_name not in tables_source]
+    renames = OrderedDict()
+    for signature in (get_fingerprint, table_signature):
+        if not dropped or not created:
+            break
+        index = {}
+        for table_name in created:
+            index.setdefault(signature(tables_target[table_name]), []).append(table_name)
+        groups = OrderedDict()
+        for table_name in dropped:
+            groups.setdefault(signature(tables_source[table_name]), []).append(table_name)
+        for key, old_names in groups.items():
+            new_names = index.get(key, [])
+            while old_names and new_names:
+                pairs = sorted(((rename_score(tables_source[old_name], tables_target[new_name]), old_name, new_name)
+                                for old_name in old_names[:MAX_RENAME_CANDIDATES]
+                                for new_name in new_names[:MAX_RENAME_CANDIDATES]), reverse=True)
+                for score, old_name, new_name in pairs:
+                    if old_name in old_names and new_name in new_names:
+                        renames[old_name] = new_name
+                        old_names.remove(old_name)
+                        new_names.remove(new_name)
+        renamed = set(renames.values())
+        dropped = [table_name for table_name in dropped if table_name not in renames]
+        created = [table_name for table_name in created if table_name not in renamed]
+    return renames
+
+
+def find_column_renames(source, target):
+    """Pair the columns only found in the source table with the columns of the
+    same definition only found in the target table, the one at the same
+    position first.
+    Returns a dict of the new column names by old name."""
+    added = [name for name in target['fields'] if name not in source['fields']]
+    if not added:
+        return {}
+    positions = dict((name, i) for i, name in enumerate(target['fields']))
+    index = {}
+    for name in added:
+        index.setdefault(field_signature(target['fields'][name]), []).append(name)
+    renames = {}
+    for position, name in enumerate(source['fields']):
+        if name in target['fields']:
+            continue
+        candidates = index.get(field_signature(source['fields'][name]))
+        if candidates:
+            best = min(candidates, key=lambda candidate: abs(positions[candidate] - position))
+            candidates.remove(best)
+            renames[name] = best
+    return renames
+
+
+def rename_foreign_keys(foreign_keys, table_renames, column_renames):
+    """The foreign keys by key id, their referenced tables and their columns being renamed"""
+    renamed = {}
+    for key in foreign_keys.values():
+        fields = [column_renames.get(field, field) for field in key['k']]
+        table_name = table_renames.get(key['table'], key['table'])
+        renamed[''.join(fields) + '->' + table_name + '.' + ''.join(key['fk'])] = \
+            ForeignKey(table_name, fields, key['fk'], key['name'])
+    return renamed
+
+
+def rename_key_columns(table, renames):
+    """A copy of table which keys are made of the renamed columns"""
+    table = copy.copy(table)
+    table['pk'] = set(renames.get(field, field) for field in table['pk'])
+    for key_type in ('uk', 'ft'):
+        keys = {}
+        for key in table[key_type].values():
+            fields = [renames.get(field, field) for field in key['fields']]
+            keys[''.join(fields)] = Key(key['name'], fields)
+        table[key_type] = keys
+    if table.get('ix'):
+        indexes = {}
+        for index in table['ix'].values():
+            fields = [renames.get(index_field(field), index_field(field)) + field[len(index_field(field)):]
+                      for field in index['fields']]
+            indexes[index_id(fields)] = Index(index['name'], fields, index['type'])
+        table['ix'] = indexes
+    table['fk'] = rename_foreign_keys(table['fk'], {}, renames)
+    table['fingerprint'] = None
+    return table
+
+
+def rename_tables(tables, renames):
+    """The dict of tables once the tables of renames are renamed, the foreign
+    keys referencing them too. The renamed tables are copies."""
+    renamed = OrderedDict()
+    for table_name, table in tables.items():
+        new_name = renames.get(table_name, table_name)
+        if new_name != table_name or any(key['table'] in renames for key in table['fk'].values()):
+            table = copy.copy(table)
+            table['name'] = new_name
+            table['fk'] = rename_foreign_keys(table['fk'], renames, {})
+            table['fingerprint'] = None
+        renamed[new_name] = table
+    return renamed
+
+
+# number of bytes of statements buffered by a FileSink before they are written
+DEFAULT_OUTPUT_BUFFER_SIZE = 64 * 1024
+
+
+class OutputSink(object):
+    """ destination of the lines of a migration, see CompDB.set_output """
+    def write(self, line):
+        """line - a line of the migration, without its end of line"""
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+
+class ListSink(OutputSink):
+    """ keeps the lines in memory, in its lines list """
+    def __init__(self):
+        self.lines = []
+
+    def write(self, line):
+        self.lines.append(line)
+
+
+class FileSink(OutputSink):
+    """ writes the lines to a file object, buffer_size bytes at a time """
+    def __init__(self, fd, buffer_size=DEFAULT_OUTPUT_BUFFER_SIZE):
+        self.fd = fd
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.size = 0
+
+    def write(self, line):
+        self.buffer.append(line)
+        self.size += len(line) + 1
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.buffer.append('')
+            self.fd.write('\n'.join(self.buffer))
+            self.buffer = []
+            self.size = 0
+        self.fd.flush()
+
+
+class StdoutSink(FileSink):
+    """ a FileSink of the standard output """
+    def __init__(self, buffer_size=DEFAULT_OUTPUT_BUFFER_SIZE):
+        FileSink.__init__(self, sys.stdout, buffer_size)
+
+
+# size of the blocks read from dump streams
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+# line prefixes of the data statements of a full dump. Those lines are skipped
+# without being parsed or copied out of the read buffer.
+DATA_STATEMENTS = (b'INSERT INTO ', b'REPLACE INTO ', b'LOCK TABLES ', b'UNLOCK TABLES',
+                   b'/*!40000 ALTER TABLE ')
+DATA_PREFIX_LENGTH = max(len(prefix) for prefix in DATA_STATEMENTS)
+
+
+def is_statement_end(line_end):
+    """True if the last bytes of a line close the statement."""
+    return line_end.rstrip(b'\r').endswith(b';')
+
+
+def iter_schema_lines(stream, buffer_size=DEFAULT_BUFFER_SIZE, head=b''):
+    """Iterate over the lines of a dump read from a binary stream in blocks
+    of buffer_size bytes.
+    head - bytes already read from the stream.
+    The lines of data statements (INSERT, LOCK TABLES...) are never copied
+    out of the buffer: an empty line is produced for each of them so that
+    the line numbers stay right.
+    """
+    buf = bytearray(max(buffer_size, len(head)))
+    buf[0:len(head)] = head
+    readinto = getattr(stream, 'readinto', None)
+    start = 0
+    end = len(head)
+    skipping = False
+    eof = False
+    while True:
+        newline = buf.find(b'\n', start, end)
+        if newline != -1:
+            if skipping or buf.startswith(DATA_STATEMENTS, start, end):
+                skipping = not is_statement_end(bytes(buf[max(start, newline - 2):newline]))
+                yield ''
+            else:
+                yield bytes(buf[start:newline + 1])
+            start = newline + 1
+            continue
+        if eof:
+            if start < end:
+                if skipping or buf.startswith(DATA_STATEMENTS, start, end):
+                    yield ''
+                else:
+                    yield bytes(buf[start:end])
+            return
+        if skipping or (end - start >= DATA_PREFIX_LENGTH and buf.startswith(DATA_STATEMENTS, start, end)):
+            # inside a data statement: only the last bytes are needed to find its end
+            skipping = True
+            start = max(start, end - 2)
+        length = end - start
+        if start:
+            buf[0:length] = buf[start:end]
+            start, end = 0, length
+        if end == len(buf):
+            # a schema line longer than the buffer
+            buf.extend(bytearray(len(buf)))
+        if readinto is not None:
+            view = memoryview(buf)[end:]
+            read = readinto(view)
+            del view
+        else:
+            block = stream.read(len(buf) - end)
+            read = len(block)
+            buf[end:end + read] = block
+        if read:
+            end += read
+        else:
+            eof = True
+
+
+def iter_mapped_schema_lines(mapped, start=0, stop=None):
+    """Iterate over the lines of a memory mapped dump, skipping the lines
+    of data statements like iter_schema_lines does.
+    start, stop - byte range of the dump to read, starting at a line."""
+    size = len(mapped) if stop is None else stop
+    skipping = False
+    while start < size:
+        newline = mapped.find(b'\n', start, size)
+        line_end = size if newline == -1 else newline
+        if skipping or mapped[start:start + DATA_PREFIX_LENGTH].startswith(DATA_STATEMENTS):
+            skipping = not is_statement_end(mapped[max(start, line_end - 2):line_end])
+            yield ''
+        else:
+            yield mapped[start:min(line_end + 1, size)]
+        start = line_end + 1
+
+
+def new_gzip_decompressor():
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+def new_xz_decompressor():
+    if lzma is None:
+        raise IOError("Reading xz compressed dumps needs the lzma module (backports.lzma on Python 2)")
+    return lzma.LZMADecompressor()
+
+
+# magic bytes of the compressed formats, and their decompressor factory
+COMPRESSIONS = ((b'\x1f\x8b', new_gzip_decompressor),
+                (b'BZh', bz2.BZ2Decompressor),
+                (b'\xfd7zXZ\x00', new_xz_decompressor))
+MAGIC_LENGTH = max(len(magic) for (magic, factory) in COMPRESSIONS)
+
+
+def detect_compression(head):
+    """Return the decompressor factory of the format starting with the bytes
+    head, or None if it is not compressed."""
+    for magic, factory in COMPRESSIONS:
+        if head.startswith(magic):
+            return factory
+    return None
+
+
+class DecompressingReader(object):
+    """ read() side of a compressed stream
+        the compressed data is read in blocks of buffer_size bytes and no read
+        returns more than it was asked for. Concatenated streams (e.g. pigz or
+        pbzip2 output) are decompressed one after the other.
+        Only zlib bounds its output: the decompressed data of a gzip block is
+        kept a read at a time, while a bzip2 or xz block is kept decompressed
+        whole, which highly compressed data can make much larger than
+        buffer_size.
+    """
+    def __init__(self, raw, new_decompressor, buffer_size=DEFAULT_BUFFER_SIZE, head=b''):
+        self.raw = raw
+        self.new_decompressor = new_decompressor
+        self.decompressor = new_decompressor()
+        self.buffer_size = buffer_size
+        self.input = head
+        self.output = b''
+        self.output_pos = 0
+
+    def read(self, size=-1):
+        if size < 0:
+            size = self.buffer_size
+        while self.output_pos >= len(self.output):
+            if not self.input:
+                self.input = self.raw.read(self.buffer_size)
+                if not self.input:
+                    return b''
+            self.output = self._decompress(size)
+            self.output_pos = 0
+        data = self.output[self.output_pos:self.output_pos + size]
+        self.output_pos += len(data)
+        return data
+
+    def _decompress(self, size):
+        decompressor = self.decompressor
+        data, self.input = self.input, b''
+        try:
+            output = self._decompress_block(decompressor, data, size)
+        except EOFError:
+            # bz2 raises EOFError instead of keeping the unused data when
+            # the previous stream ended exactly with the previous block
+            self.decompressor = decompressor = self.new_decompressor()
+            output = self._decompress_block(decompressor, data, size)
+        unused_data = getattr(decompressor, 'unused_data', b'')
+        if unused_data:
+            # end of a stream, another one follows: the rest of the input,
+            # which zlib leaves in its unconsumed_tail too
+            self.input = unused_data
+            self.decompressor = self.new_decompressor()
+        return output
+
+    def _decompress_block(self, decompressor, data, size):
+        if hasattr(decompressor, 'unconsumed_tail'):
+            # zlib can bound its output
+            output = decompressor.decompress(data, size)
+            self.input = decompressor.unconsumed_tail
+            return output
+        return decompressor.decompress(data)
+
+
+def iter_dump_stream(fd, buffer_size=DEFAULT_BUFFER_SIZE, head=None):
+    """iter_dump_file of a binary stream read in blocks, e.g. a pipe or a socket.
+    head - the first MAGIC_LENGTH bytes of the stream when already read"""
+    if head is None:
+        head = fd.read(MAGIC_LENGTH)
+    new_decompressor = detect_compression(head)
+    if new_decompressor is not None:
+        return iter_schema_lines(DecompressingReader(fd, new_decompressor, buffer_size, head), buffer_size)
+    return iter_schema_lines(fd, buffer_size, head)
+
+
+def iter_dump_file(file_name, buffer_size=DEFAULT_BUFFER_SIZE):
+    """Iterate over the schema lines of a dump file, full dumps included.
+    file_name - path of the dump, or '-' for the standard input.
+    gzip, bzip2 and xz compressed dumps are recognised by their magic bytes
+    and decompressed on the fly. Uncompressed regular files are memory mapped,
+    anything else is read in blocks of buffer_size bytes."""
+    if file_name == '-':
+        fd = io.open(sys.stdin.fileno(), 'rb', closefd=False)
+    else:
+        fd = io.open(file_name, 'rb')
+    with fd:
+        head = fd.read(MAGIC_LENGTH)
+        mapped = None
+        if detect_compression(head) is None and file_name != '-':
+            try:
+                mapped = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError):
+                # empty files, pipes and character devices can not be mapped
+                pass
+        if mapped is None:
+            for line in iter_dump_stream(fd, buffer_size, head):
+                yield line
+        else:
+            try:
+                for line in iter_mapped_schema_lines(mapped):
+                    yield line
+            finally:
+                mapped.close()
+
+
+def analyse_file(lines, table_prefix="", parser=None):
+    """Produce a dict of tables.
+    lines - an iterable of lines or IO stream. The data statements of streams
+            are skipped unparsed (see iter_schema_lines).
+    table_prefix - prefix for table names to match - filter out those that do not.
+                   Either a regular expression or a TableFilter.
+    parser - name of the parser engine, a key of PARSERS. Defaults to DEFAULT_PARSER.
+    Output Format - dict of tables:
+        <table_name>:
+            name: "<table_name>",
+            fields: (Fields, ordered dict of names)
+                <field_name>: Field
+                    'name': <field_name>,
+                    'type': <field type>,
+                    'nn': <true if not null>,
+                    'default': <default value or None>,
+                    'inc': <true if auto increment>
+            pk: [<primary key name>, <primary key name>...],
+            fk: {<ForeignKey by key id>},
+            uk: {<unique Key by key id>},
+            ft: {<fulltext Key by key id>},
+            ix: {<secondary Index by index id>},
+            options: {<table option value by name, e.g. 'ENGINE'>},
+            partitions: <Partitioning or None>,
+            fingerprint: <hash of the canonical definition, see table_fingerprint>
+    The tables, fields and keys are Table, Field, Key and ForeignKey objects
+    which attributes can be read and set like the keys of a dict.
+    """
+    parser = parser or DEFAULT_PARSER
+    if parser not in PARSERS:
+        raise ValueError("Unknown parser '%s', expected one of: %s" % (parser, ', '.join(sorted(PARSERS))))
+    if hasattr(lines, 'readinto'):
+        lines = iter_schema_lines(lines)
+    patterns = None
+    if active_stats is not None:
+        lines = active_stats.iter_read(lines)
+        patterns = active_stats.counting_patterns
+    with phase('parse'):
+        # the tables filtered out are skipped while parsing
+        tables = PARSERS[parser](lines, make_table_filter(table_prefix), patterns)
+        add_fingerprints(tables)
+
+    return tables
+
+
+def analyse_lines_legacy(lines, table_filter=None, patterns=None):
+    """The original parser: every line is tried against the whole cascade of
+    regular expressions. Kept as the reference for the tokenizer, the tables
+    of table_filter are only filtered out once parsed. The indexes are matched
+    by the patterns of the tokenizer, see iter_dump_objects."""
+    patterns = patterns or TOKENIZER_PATTERNS
+    # read the file
+    tables = OrderedDict()
+    current_table = None
+    table_options = None
+    comment = False
+    line_number = 0
+    for line in lines:
+        line_number += 1
+        detected = False
+        # the partitioning after the closing parenthesis of the table
+        if table_options is not None:
+            continued = len(table_options) > 1 or \
+                re.match(r'(?i)\s*(/\*!\d*\s*)?\(?\s*(SUB)?PARTITIONS?\b', line)
+            if continued:
+                table_options.append(line)
+                if not re.search(';\s*$', line):
+                    continue
+            tables[current_table['name']] = parse_table_options(current_table, ''.join(table_options))
+            current_table = None
+            table_options = None
+            if continued:
+                continue
+        if re.match('--', line):
+            continue
+        if re.match('/\*.*\*/', line):
+            continue
+        if re.match('\/\*\!.*\*\/\;*$',line):
+           # print "ignoring as line is commented :(%s)"%line
+            continue
+        if re.match('^\s*\/\*\!.*',line):
+           # print "comment started as line as comment start:(%s)"%line
+            comment = True
+            continue
+        if current_table is None:
+            # as it is inside the comments
+            if comment is True:
+                # check if it is comment end
+                if re.match('.*\*\/\;*$',line):
+            #        print "comment ended so making comment as False"
+                    comment = False
+             #   print "ignoring as line is inside comments :(%s)"%line
+                continue
+            # statements to ignore
+            if re.match('(?i)\s*DROP TABLE', line):
+                detected = True
+            # statements to ignore
+            if re.match('(?i)\s*SET @|\w', line):
+                detected = True
+            match = re.match('(?i)CREATE TABLE `([^`]*)`', line)
+            if (match):
+                detected = True
+                current_table = Table(match.group(1))
+            # ALTER TABLE `plays_text_sample` ADD CONSTRAINT text_id_refs_id_4aaf935 FOREIGN KEY
+            # (`text_id`) REFERENCES `plays_text` (`id`);
+            foreign_key = re.match(
+                '(?i)\s*ALTER TABLE\s+`([^`]+)`\s+ADD CONSTRAINT\s+(.+)\s+'
+                'FOREIGN KEY\s+\(([^)]+)\)\s+REFERENCES\s+`([^`]+)`\s+\(([^)]+)\)', line)
+            if foreign_key:
+                detected = True
+                # split the fields
+                key_fields = re.split(',', foreign_key.group(3))
+                source_fields = []
+                for field in key_fields:
+                    source_fields.append(field.strip(' ').strip('`'))
+                key_fields = re.split(',', foreign_key.group(5))
+                target_fields = []
+                for field in key_fields:
+                    target_fields.append(field.strip(' ').strip('`'))
+
+                fk_table = clean_field_name(foreign_key.group(4))
+                fkid = ''.join(source_fields) + '->' + fk_table + '.' + ''.join(target_fields)
+                tables[foreign_key.group(1)]['fk'][fkid] = ForeignKey(fk_table, source_fields, target_fields,
+                                                                      clean_field_name(foreign_key.group(2)))
+                #['fk'][foreign_key.group(2)] = {'table': foreign_key.group(4),
+                # 'k': source_fields, 'fk': target_fields}
+            # CREATE INDEX `plays_text_author_id` ON `plays_text` (`author_id`);
+            index = patterns['create_index'].match(line)
+            if index:
+                detected = True
+                ixid, key = parse_index(index.group(1), index.group(4), index.group(2), index.group(5))
+                tables[index.group(3)]['ix'][ixid] = key
+
+        else:
+            # remove , at the end
+            line = line.strip(",")
+            # FIELD
             match = re.match('\s*`(.*)`\s+([^\s]*)\s+(.*)$', line)
             if match:
                 detected = True
-                field = {'name': match.group(1), 'type': match.group(2), 'nn': False,
-                         'default': False, 'inc': False}
+                field = Field(match.group(1), match.group(2))
 
                 # equivalent data types
                 if field['type'] == 'integer': field['type'] = 'int(11)'
@@ -296,7 +2178,7 @@ def analyse_file(lines, table_prefix=""):
                 test_null = True
 
                 if re.search('(?i)PRIMARY KEY', match.group(3)):
-                    current_table['pk'].add(match.group(1))
+                    current_table['pk'].add(intern_value(match.group(1)))
                 if re.search('(?i)NOT NULL', match.group(3)):
                     field['nn'] = True
                     test_null = False
@@ -320,7 +2202,7 @@ def analyse_file(lines, table_prefix=""):
                 # split the fields
                 pk_fields = re.split(',', primary_key.group(1))
                 for field in pk_fields:
-                    current_table['pk'].add(field.strip(' ').strip('`'))
+                    current_table['pk'].add(intern_value(field.strip(' ').strip('`')))
 
             # UNIQUE (`location`, `text_id`) # anonymous
             unique_key = re.match('(?i)\s*UNIQUE\s+\(([^)]+)\)', line)
@@ -330,7 +2212,7 @@ def analyse_file(lines, table_prefix=""):
                 uk_fields = re.split(',', unique_key.group(1))
                 fields = [clean_field_name(field) for field in uk_fields]
                 #current_table['uk'][unique_key.group(1)] = fields
-                current_table['uk'][''.join(fields)] = {'name': '', 'fields': fields}
+                current_table['uk'][''.join(fields)] = Key('', fields)
 
             # UNIQUE KEY `location` (`location`,`text_id`),
             unique_key = re.match('(?i)\s*(?:UNIQUE|FULLTEXT) KEY\s+`([^`]+)`\s+\(([^)]+)\)', line)
@@ -345,7 +2227,7 @@ def analyse_file(lines, table_prefix=""):
                 if re.search('(?i)FULLTEXT KEY', line):
                     key_type = 'ft'
                 #current_table[key_type][unique_key.group(1)] = fields
-                current_table[key_type][''.join(fields)] = {'name': unique_key.group(1), 'fields': fields}
+                current_table[key_type][''.join(fields)] = Key(unique_key.group(1), fields)
 
             # CONSTRAINT `text_id_refs_id_4aaf935` FOREIGN KEY (`text_id`) REFERENCES `plays_text` (`id`)
             # TODO: structure the fields
@@ -365,124 +2247,2714 @@ def analyse_file(lines, table_prefix=""):
 
                 fk_table = clean_field_name(foreign_key.group(3))
                 fkid = ''.join(source_fields) + '->' + fk_table + '.' + ''.join(target_fields)
-                current_table['fk'][fkid] = {'table': fk_table, 'k': source_fields,
-                                             'fk': target_fields,
-                                             'name': clean_field_name(foreign_key.group(1))}
+                current_table['fk'][fkid] = ForeignKey(fk_table, source_fields, target_fields,
+                                                       clean_field_name(foreign_key.group(1)))
 
-            # TODO: KEY `plays_text_sample_text_id` (`text_id`),
+            # KEY `plays_text_sample_text_id` (`text_id`),
+            index = patterns['index'].match(line)
+            if index:
+                detected = True
+                ixid, key = parse_index(index.group(1), index.group(3), index.group(2), index.group(4))
+                current_table['ix'][ixid] = key
 
             # end of table
-            match = re.match('\s*\)', line)
+            match = re.match('\s*\)(.*)', line)
             if match:
                 detected = True
-                tables[current_table['name']] = current_table
-                current_table = None
+                table_options = [match.group(1)]
+                if re.search(';\s*$', line):
+                    tables[current_table['name']] = parse_table_options(current_table, table_options[0])
+                    current_table = None
+                    table_options = None
         line = line.strip("\n ")
         if not detected and len(line) > 1:
-            print "WARNING: (%d) not recognised: %s" % (line_number, line)
-
-    # filter the result
-    filter_table_dic(tables, table_prefix)
+            print_unrecognised(line_number, line)
+    if table_options is not None:
+        tables[current_table['name']] = parse_table_options(current_table, ''.join(table_options))
 
+    with phase('filter'):
+        filter_table_dic(tables, table_filter)
     return tables
 
 
-def filter_table_dic(tables, table_prefix=''):
-    if tables is None or table_prefix == '':
-        return
-    for table_name in tables.keys():
-        if not re.match(table_prefix, table_name):
-            del tables[table_name]
+# Patterns of the tokenizer parser. They are compiled once and each one is
+# only tried on the lines whose first token selects it.
+RE_CREATE_TABLE = re.compile('(?i)CREATE TABLE `([^`]*)`')
+RE_ALTER_FOREIGN_KEY = re.compile('(?i)\s*ALTER TABLE\s+`([^`]+)`\s+ADD CONSTRAINT\s+(.+)\s+'
+                                  'FOREIGN KEY\s+\(([^)]+)\)\s+REFERENCES\s+`([^`]+)`\s+\(([^)]+)\)')
+RE_FIELD = re.compile('\s*`(.*)`\s+([^\s]*)\s+(.*)$')
+RE_DEFAULT = re.compile("(?i)DEFAULT\s+(?:(\w+)|'([^']*)')")
+RE_PRIMARY_KEY = re.compile('(?i)\s*PRIMARY KEY\s+\(([^)]+)\)')
+RE_UNIQUE = re.compile('(?i)\s*UNIQUE\s+\(([^)]+)\)')
+RE_UNIQUE_KEY = re.compile('(?i)\s*(?:UNIQUE|FULLTEXT) KEY\s+`([^`]+)`\s+\(([^)]+)\)')
+RE_FULLTEXT_KEY = re.compile('(?i)FULLTEXT KEY')
+RE_CONSTRAINT = re.compile('(?i)\s*CONSTRAINT\s+`([^`]+)`\s+FOREIGN KEY\s+\(([^)]+)\)\s+'
+                           'REFERENCES\s+`([^`]+)`\s+\(([^)]+)\)')
+# KEY `title` USING HASH (`title`(10),`year`): the fields may have a prefix length
+RE_INDEX = re.compile(r'(?i)\s*(?:KEY|INDEX)\s+`([^`]+)`\s*(?:USING\s+(\w+)\s*)?\(((?:[^()]|\([^)]*\))+)\)'
+                      r'(?:\s*USING\s+(\w+))?')
+RE_CREATE_INDEX = re.compile(r'(?i)CREATE INDEX\s+`([^`]+)`\s*(?:USING\s+(\w+)\s*)?ON\s+`([^`]+)`\s*'
+                             r'\(((?:[^()]|\([^)]*\))+)\)(?:\s*USING\s+(\w+))?')
 
+# the patterns of the tokenizer by name, passed to the parsers as CountingPatterns by Stats
+TOKENIZER_PATTERNS = OrderedDict((('create_table', RE_CREATE_TABLE), ('alter_foreign_key', RE_ALTER_FOREIGN_KEY),
+                                  ('field', RE_FIELD), ('default', RE_DEFAULT), ('primary_key', RE_PRIMARY_KEY),
+                                  ('unique', RE_UNIQUE), ('unique_key', RE_UNIQUE_KEY),
+                                  ('fulltext_key', RE_FULLTEXT_KEY), ('constraint', RE_CONSTRAINT),
+                                  ('index', RE_INDEX), ('create_index', RE_CREATE_INDEX)))
 
-def get_quoted_fields(fields):
-    return u', '.join(u"`%s`" % field for field in fields)
+# first characters of a line matched by \w, i.e. statements outside of a table
+# that are recognised and ignored
+WORD_CHARS = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_')
 
+# equivalent data types
+TYPE_ALIASES = {'integer': 'int(11)', 'smallint(6)': 'smallint', 'tinyint(1)': 'bool'}
 
-def usage():
-    print "Usage: %s [OPTION]... [OLD_SCHEMA.sql NEW_SCHEMA.sql]" % sys.argv[0]
-    print """Prints all the differences between 2 DB schemas on the standard output.
 
-Options:
+def is_comment_end(line):
+    """True if the line closes a multi line /*! ... */ comment."""
+    if line[-1:] == '\n':
+        line = line[:-1]
+    return line.rstrip(';').endswith('*/')
 
-  -p TABLE_PREFIX  compare only the tables which name starts with TABLE_PREFIX
-  -a               For Django users: if you execute this command from your 
-                   project folder, the script will report the differences 
-                   between your current database and your django model.
-                   You don't need to provide OLD_SCHEMA.sql and NEW_SCHEMA.sql 
-                   arguments.
-                   -a makes -p mandatory. The -p argument must match the name 
-                   of an application installed in your Django project.
-                   e.g. python compdb.py -a -p MY_APP_NAME
-  -k               Enables detection of differences in the foreign keys.
-                   This feature is disabled by default as the constraint names 
-                   may be different between the two databases. 
-  -h               show this help screen
 
----
+def strip_field_name(field_name):
+    return field_name.strip(' ').strip('`')
 
-OLD_SCHEMA.sql and NEW_SCHEMA.sql schemas must only contain mysql DDL 
-statements either generated with 'mysql_dump -d' or django's 
-'manage.py sql'.
 
-WARNING: this script cannot detect changes in the name of an object (e.g. a 
-table or a field). For instance, if you have changed the name of a table from 
-A to B, the script will tell you to drop A and create B because it doesn't 
-know they are related. If you follow those instructions you will loose your 
-data. Please be aware of this limitation."""
-    sys.exit(2)
+def parse_foreign_key(clean, key_name, key_fields, fk_table, fk_fields):
+    """Build the (key id, key dict) of a foreign key from the groups of a FK match.
+    clean - function used to clean up the field names"""
+    source_fields = [clean(field) for field in key_fields.split(',')]
+    target_fields = [clean(field) for field in fk_fields.split(',')]
+    fk_table = clean_field_name(fk_table)
+    fkid = ''.join(source_fields) + '->' + fk_table + '.' + ''.join(target_fields)
+    return fkid, ForeignKey(fk_table, source_fields, target_fields, clean_field_name(key_name))
 
-def run_command(command):
-    import os
-    ret = os.system(command)
-    return ret
 
-def parse_cmd_line():
-    import getopt
+RE_INDEX_FIELD = re.compile(r'[^(\s]*')
 
-    try:
-        opts, args = getopt.getopt(sys.argv[1:], "ahp:nkK", ["auto", "help", "prefix=", "no-removing", "foreign-key",
-                                                             "no-foreign-key"])
-    except getopt.GetoptError:
-        usage()
-    
-    comp = CompDB()
-         
-    auto = False
-    for opt, arg in opts:
-        if opt in ("-h", "--help"): usage()
-        elif opt in ('-p', "--prefix"):
-            comp.set_table_prefix(arg)            
-        elif opt in ("-a", "--auto"):
-            auto = True
-        elif opt in ("-n", "--no-removing"):
-            comp.set_no_removing(True)
-        elif opt in ("-K", "--no-foreign-key"):
-            comp.no_foreign_key = True
-        elif opt in ("-k", "--foreign-key"):
-            comp.no_foreign_key = False
-    
-    if len(args) == 2 and not auto:
-        comp.set_files(args[0], args[1])
-    elif len(args) == 0 and auto and comp.table_prefix != '':
-        try:
-            import settings
-        except ImportError, e:
-            print e
-            print "ERROR: settings.py not found in the current directory\n"
-            usage()
+# the index type of the indexes declared without USING
+DEFAULT_INDEX_TYPE = 'BTREE'
 
-        # mysqldump of the db schema
-        host = settings.DATABASE_HOST
-        if host != '':
-            host = '-h %s' % host
-        command = 'mysqldump -u %s --single-transaction --password="%s" -d %s %s > cmpdb.sql' % (settings.DATABASE_USER, settings.DATABASE_PASSWORD, host, settings.DATABASE_NAME);
-        run_command(command)
-        command = 'python manage.py sql %s > cmpdj.sql' % comp.table_prefix
-        run_command(command)
-        
-        # django dump of the db schema
-        comp.set_files('cmpdb.sql', 'cmpdj.sql')
+
+def index_id(fields):
+    """The key of an index in the ix dict of its table: its fields in order,
+    lower case, so that the same index under another name has the same id."""
+    return ','.join(field.lower() for field in fields)
+
+
+def parse_index(key_name, key_fields, *types):
+    """Build the (index id, Index) of a secondary index from the groups of a
+    RE_INDEX or RE_CREATE_INDEX match.
+    types - the USING groups of the match, None when absent"""
+    fields = [''.join(field.split('`')).strip() for field in key_fields.split(',')]
+    index_type = None
+    for using in types:
+        if using:
+            index_type = using.upper()
+    if index_type == DEFAULT_INDEX_TYPE:
+        index_type = None
+    return index_id(fields), Index(clean_field_name(key_name), fields, index_type)
+
+
+def index_field(field):
+    """The column of the field 'title(10)' or 'year DESC' of an Index"""
+    return RE_INDEX_FIELD.match(field).group(0)
+
+
+def quote_index_field(field):
+    """`title`(10) of the field 'title(10)' of an Index"""
+    name = index_field(field)
+    return '`%s`%s' % (name, field[len(name):])
+
+
+def describe_index(index):
+    """The definition of an Index, as added by ALTER TABLE ... ADD"""
+    definition = 'INDEX `%s` (%s)' % (index['name'], ', '.join(quote_index_field(field)
+                                                               for field in index['fields']))
+    if index['type']:
+        definition += ' USING %s' % index['type']
+    return definition
+
+
+# table options kept by the parsers, with the value of an option left out of
+# SHOW CREATE TABLE, or None when it is only compared if both tables declare it
+TABLE_OPTIONS = OrderedDict([('ENGINE', None), ('ROW_FORMAT', 'DEFAULT'), ('KEY_BLOCK_SIZE', '0'),
+                             ('COMPRESSION', "'None'"), ('DEFAULT CHARSET', None), ('COLLATE', None)])
+
+RE_TABLE_OPTION = re.compile(r"(?i)\b(?:DEFAULT\s+)?(ENGINE|ROW_FORMAT|KEY_BLOCK_SIZE|COMPRESSION|CHARSET|"
+                             r"CHARACTER\s+SET|COLLATE)\s*=?\s*('[^']*'|\w+)")
+RE_TABLE_COMMENT = re.compile(r"(?i)\bCOMMENT\s*=?\s*'(?:[^'\\]|\\.|'')*'")
+RE_CONDITIONAL_COMMENT = re.compile(r'/\*!\d*|\*/')
+# the lines of the partitioning of a table, after the line closing its columns
+RE_PARTITION_LINE = re.compile(r'(?i)\s*(?:/\*!\d*\s*)?\(?\s*(?:SUB)?PARTITIONS?\b')
+RE_PARTITION_BY = re.compile(r'(?is)PARTITION\s+BY\s+((?:LINEAR\s+)?(?:RANGE|LIST|HASH|KEY)'
+                             r'(?:\s+ALGORITHM\s*=\s*\d+)?)\s*(COLUMNS)?\s*\(')
+RE_SUBPARTITION_BY = re.compile(r'(?is)\s*SUBPARTITION\s+BY\s+((?:LINEAR\s+)?(?:HASH|KEY)'
+                                r'(?:\s+ALGORITHM\s*=\s*\d+)?)\s*\(')
+RE_PARTITION_COUNT = re.compile(r'(?is)\s*(SUB)?PARTITIONS\s+(\d+)')
+RE_PARTITION = re.compile(r'(?is)\s*PARTITION\s+`?([^`\s(]+)`?(?:\s+VALUES\s+(LESS\s+THAN|IN)\s*)?')
+RE_EXPRESSION_SPACE = re.compile(r'\s*([(),=])\s*')
+
+
+def read_parenthesized(text, start):
+    """The text between the parenthesis at start and the one closing it, and
+    the position after it. The quoted strings are skipped."""
+    depth = 0
+    quote = None
+    for position in xrange(start, len(text)):
+        char = text[position]
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in '\'"':
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if not depth:
+                return text[start + 1:position], position + 1
+    return text[start + 1:], len(text)
+
+
+def split_definitions(text):
+    """The comma separated definitions of text, outside of parentheses and quotes"""
+    definitions = []
+    depth = 0
+    quote = None
+    start = 0
+    for position, char in enumerate(text):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in '\'"':
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and not depth:
+            definitions.append(text[start:position])
+            start = position + 1
+    definitions.append(text[start:])
+    return [definition for definition in definitions if definition.strip()]
+
+
+def normalise_expression(text):
+    """An expression of a partitioning without its backquotes and blanks, so
+    that the dumps of all the MySQL versions compare equal"""
+    return RE_EXPRESSION_SPACE.sub(r'\1', ' '.join(text.replace('`', '').split()))
+
+
+def parse_partitioning(text):
+    """The Partitioning of a PARTITION BY clause, or None"""
+    match = RE_PARTITION_BY.search(text)
+    if match is None:
+        return None
+    partitioning_type = ' '.join(match.group(1).upper().split())
+    if match.group(2):
+        partitioning_type += ' COLUMNS'
+    expression, end = read_parenthesized(text, match.end() - 1)
+    count = 1
+    sub = None
+    partitions = []
+    counted = RE_PARTITION_COUNT.match(text, end)
+    if counted and not counted.group(1):
+        count = int(counted.group(2))
+        end = counted.end()
+    subpartitioning = RE_SUBPARTITION_BY.match(text, end)
+    if subpartitioning:
+        sub_expression, end = read_parenthesized(text, subpartitioning.end() - 1)
+        sub = '%s (%s)' % (' '.join(subpartitioning.group(1).upper().split()), normalise_expression(sub_expression))
+        counted = RE_PARTITION_COUNT.match(text, end)
+        if counted and counted.group(1):
+            end = counted.end()
+    rest = text[end:].lstrip()
+    if rest[:1] == '(':
+        definitions = [RE_PARTITION.match(definition)
+                       for definition in split_definitions(read_parenthesized(rest, 0)[0])]
+        definitions = [partition for partition in definitions if partition]
+        count = len(definitions) or count
+        for partition in definitions:
+            if not partition.group(2):
+                # the partitions of HASH and KEY partitioning
+                continue
+            values = ' '.join(partition.group(2).upper().split())
+            bound = partition.string[partition.end():]
+            if bound[:1] == '(':
+                values += ' (%s)' % normalise_expression(read_parenthesized(bound, 0)[0])
+            else:
+                values += ' MAXVALUE'
+            partitions.append(Partition(partition.group(1), values))
+    return Partitioning(partitioning_type, normalise_expression(expression), count, sub, partitions)
+
+
+def parse_table_options(table, text):
+    """Set the options and the partitioning of a table from the end of its
+    CREATE TABLE statement, after the parenthesis closing its columns. The
+    AUTO_INCREMENT counter and the comment are left out."""
+    text = RE_CONDITIONAL_COMMENT.sub(' ', text)
+    partitioning = RE_PARTITION_BY.search(text)
+    options = text[:partitioning.start()] if partitioning else text
+    for option in RE_TABLE_OPTION.finditer(RE_TABLE_COMMENT.sub('', options)):
+        name = option.group(1).upper()
+        if name == 'CHARSET' or name.startswith('CHARACTER'):
+            name = 'DEFAULT CHARSET'
+        value = option.group(2)
+        if name == 'ROW_FORMAT':
+            value = value.upper()
+        table['options'][name] = intern_value(value)
+    if partitioning:
+        table['partitions'] = parse_partitioning(text[partitioning.start():])
+    return table
+
+
+def describe_table_options(options):
+    """The table options of a dict of TABLE_OPTIONS, e.g. 'ENGINE=InnoDB ROW_FORMAT=COMPRESSED'"""
+    return ' '.join('%s=%s' % (name, options[name]) for name in TABLE_OPTIONS if name in options)
+
+
+def describe_table_end(table):
+    """The end of the CREATE TABLE statement of a table, after its columns:
+    its options and partitioning"""
+    end = ')'
+    if table.get('options'):
+        end += ' ' + describe_table_options(table['options'])
+    if table.get('partitions'):
+        end += ' ' + describe_partitioning(table['partitions'])
+    return end + ';'
+
+
+def describe_partition(partition):
+    return 'PARTITION %s VALUES %s' % (partition['name'], partition['values'])
+
+
+def describe_partitioning(partitioning):
+    """The PARTITION BY clause of a Partitioning"""
+    clause = 'PARTITION BY %s (%s)' % (partitioning['type'], partitioning['expression'])
+    if partitioning['sub']:
+        clause += ' SUBPARTITION BY %s' % partitioning['sub']
+    if partitioning['partitions']:
+        return '%s (%s)' % (clause, ', '.join(describe_partition(partition)
+                                              for partition in partitioning['partitions']))
+    return '%s PARTITIONS %d' % (clause, partitioning['count'])
+
+
+def parse_field(match, re_default=RE_DEFAULT):
+    """Build a field dict from a RE_FIELD match, its default value matched by re_default.
+    Returns (field, in_primary_key)."""
+    field_type = match.group(2)
+    field = Field(match.group(1), TYPE_ALIASES.get(field_type, field_type))
+    options = match.group(3)
+    upper_options = options.upper()
+    test_null = True
+    if 'NOT NULL' in upper_options:
+        field['nn'] = True
+        test_null = False
+    if 'AUTO_INCREMENT' in upper_options:
+        field['inc'] = True
+    if 'DEFAULT' in upper_options:
+        default_value = re_default.search(options)
+        if default_value:
+            field['default'] = default_value.group(1) or default_value.group(2)
+            if field['default'] == 'NULL':
+                test_null = False
+    # NULL on its own means 'DEFAULT NULL'
+    if test_null:
+        field['default'] = 'NULL'
+    return field, 'PRIMARY KEY' in upper_options
+
+
+def iter_dump_objects(lines, table_filter=None, patterns=None):
+    """Parse a dump classifying each line once, by its first token.
+    lines - an iterable of lines or IO stream
+    table_filter - the TableFilter of the tables to parse: the body of the
+                   others is skipped as soon as their CREATE TABLE is seen, and
+                   their out-of-line foreign keys are ignored
+    Yields tuples as the objects are recognised:
+        ('table', <table dict>) when a CREATE TABLE statement ends
+        ('fk', <table_name>, <key id>, <key dict>) for an ALTER TABLE ... ADD CONSTRAINT
+        ('ix', <table_name>, <index id>, <Index>) for a CREATE INDEX
+        ('unrecognised', <line number>, <line>) for lines that could not be parsed
+    patterns - the patterns of TOKENIZER_PATTERNS by name, by default those
+               compiled patterns, e.g. the CountingPatterns of Stats
+    """
+    patterns = patterns or TOKENIZER_PATTERNS
+    re_create_table = patterns['create_table']
+    re_alter_foreign_key = patterns['alter_foreign_key']
+    re_field = patterns['field']
+    re_default = patterns['default']
+    re_primary_key = patterns['primary_key']
+    re_unique = patterns['unique']
+    re_unique_key = patterns['unique_key']
+    re_fulltext_key = patterns['fulltext_key']
+    re_constraint = patterns['constraint']
+    re_index = patterns['index']
+    re_create_index = patterns['create_index']
+    current_table = None
+    # the lines of the table options of current_table, from its closing parenthesis
+    table_options = None
+    skipped_table = False
+    comment = False
+    line_number = 0
+    for line in lines:
+        line_number += 1
+        if skipped_table:
+            # up to the end of the statement, its table options and partitions included
+            if line.rstrip()[-1:] == ';':
+                skipped_table = False
+            continue
+        if table_options is not None:
+            continued = len(table_options) > 1 or RE_PARTITION_LINE.match(line) is not None
+            if continued:
+                table_options.append(line)
+                if line.rstrip()[-1:] != ';':
+                    continue
+            yield 'table', parse_table_options(current_table, ''.join(table_options))
+            current_table = None
+            table_options = None
+            if continued:
+                continue
+        head = line[:2]
+        if head == '--':
+            continue
+        if head == '/*' and line.find('*/', 2) != -1:
+            continue
+        stripped = line.lstrip()
+        if stripped[:3] == '/*!':
+            comment = True
+            continue
+        detected = False
+        if current_table is None:
+            if comment:
+                if is_comment_end(line):
+                    comment = False
+                continue
+            if line[:1] in WORD_CHARS:
+                detected = True
+            token = stripped[:12].upper()
+            if token == 'CREATE TABLE' and len(stripped) == len(line):
+                match = re_create_table.match(line)
+                if match:
+                    if table_filter is None or table_filter.match(match.group(1)):
+                        current_table = Table(match.group(1))
+                    else:
+                        skipped_table = line.rstrip()[-1:] != ';'
+            elif token[:11] == 'ALTER TABLE':
+                foreign_key = re_alter_foreign_key.match(line)
+                if foreign_key:
+                    detected = True
+                    if table_filter is None or table_filter.match(foreign_key.group(1)):
+                        fkid, key = parse_foreign_key(strip_field_name, *foreign_key.groups()[1:])
+                        yield 'fk', foreign_key.group(1), fkid, key
+            elif token == 'CREATE INDEX':
+                index = re_create_index.match(line)
+                if index:
+                    detected = True
+                    if table_filter is None or table_filter.match(index.group(3)):
+                        ixid, key = parse_index(index.group(1), index.group(4), index.group(2), index.group(5))
+                        yield 'ix', index.group(3), ixid, key
+            elif token[:10] == 'DROP TABLE' or token[:5] == 'SET @':
+                detected = True
+        else:
+            # remove , at the end
+            if line[:1] == ',':
+                line = line.strip(',')
+                stripped = line.lstrip()
+            else:
+                line = line.rstrip(',')
+            token = stripped[:1]
+            if token == '`':
+                match = re_field.match(line)
+                if match:
+                    detected = True
+                    field, primary = parse_field(match, re_default)
+                    if primary:
+                        current_table['pk'].add(field['name'])
+                    current_table['fields'][field['name']] = field
+            elif token == ')':
+                detected = True
+                # the partitioning may follow on the next lines
+                table_options = [stripped[1:]]
+                if stripped.rstrip()[-1:] == ';':
+                    yield 'table', parse_table_options(current_table, table_options[0])
+                    current_table = None
+                    table_options = None
+            elif token in 'Pp':
+                primary_key = re_primary_key.match(line)
+                if primary_key:
+                    detected = True
+                    for field in primary_key.group(1).split(','):
+                        current_table['pk'].add(intern_value(strip_field_name(field)))
+            elif token in 'UuFf':
+                unique_key = re_unique.match(line)
+                if unique_key:
+                    detected = True
+                    fields = [clean_field_name(field) for field in unique_key.group(1).split(',')]
+                    current_table['uk'][''.join(fields)] = Key('', fields)
+                unique_key = re_unique_key.match(line)
+                if unique_key:
+                    detected = True
+                    fields = [strip_field_name(field) for field in unique_key.group(2).split(',')]
+                    key_type = 'uk'
+                    if re_fulltext_key.search(line):
+                        key_type = 'ft'
+                    current_table[key_type][''.join(fields)] = Key(unique_key.group(1), fields)
+            elif token in 'Cc':
+                foreign_key = re_constraint.match(line)
+                if foreign_key:
+                    detected = True
+                    fkid, key = parse_foreign_key(clean_field_name, *foreign_key.groups())
+                    current_table['fk'][fkid] = key
+            elif token in 'KkIi':
+                index = re_index.match(line)
+                if index:
+                    detected = True
+                    ixid, key = parse_index(index.group(1), index.group(3), index.group(2), index.group(4))
+                    current_table['ix'][ixid] = key
+        if not detected:
+            line = line.strip("\n ")
+            if len(line) > 1:
+                yield 'unrecognised', line_number, line
+    if table_options is not None:
+        yield 'table', parse_table_options(current_table, ''.join(table_options))
+
+
+def analyse_lines_tokenized(lines, table_filter=None, patterns=None):
+    """Build the dict of tables from the objects found by iter_dump_objects."""
+    tables = OrderedDict()
+    for parsed in iter_dump_objects(lines, table_filter, patterns):
+        if parsed[0] == 'table':
+            tables[parsed[1]['name']] = parsed[1]
+        elif parsed[0] in ('fk', 'ix'):
+            tables[parsed[1]][parsed[0]][parsed[2]] = parsed[3]
+        else:
+            print_unrecognised(parsed[1], parsed[2])
+    return tables
+
+
+PARSER_LEGACY = 'legacy'
+PARSER_TOKENIZER = 'tokenizer'
+PARSERS = {PARSER_LEGACY: analyse_lines_legacy,
+           PARSER_TOKENIZER: analyse_lines_tokenized}
+DEFAULT_PARSER = PARSER_TOKENIZER
+
+
+CONTAINERS = (dict, set, frozenset, list, tuple, SchemaObject)
+
+
+def canonical(value):
+    """Order independent form of the sets, dicts and schema objects of a table
+    definition. The order of the Fields and OrderedDicts is kept."""
+    if isinstance(value, (dict, SchemaObject)):
+        items = [(key, canonical(item) if isinstance(item, CONTAINERS) else item)
+                 for key, item in value.items()]
+        return items if isinstance(value, (Fields, OrderedDict)) else sorted(items)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    return [canonical(item) if isinstance(item, CONTAINERS) else item for item in value]
+
+
+def field_tuple(field):
+    """The attributes of a Field, or of a field dict, in the order of Field.__slots__"""
+    if type(field) is Field:
+        return field.as_tuple()
+    if len(field) == len(Field.__slots__):
+        return tuple(field[key] for key in Field.__slots__)
+    return tuple(sorted(field.items()))
+
+
+def table_fingerprint(table):
+    """Hash of the definition of a table, its name aside: two tables with the
+    same fingerprint get no migration from compare_tables."""
+    fingerprint = hashlib.sha1()
+    for key in sorted(table):
+        if key in ('name', 'fingerprint'):
+            continue
+        if key in ('ix', 'options', 'partitions') and not table[key]:
+            # the tables without secondary indexes, options or partitions keep the fingerprint they had before
+            # these were parsed
+            continue
+        fingerprint.update('%s\n' % key)
+        if key == 'fields':
+            for field in table['fields'].values():
+                fingerprint.update('%r\n' % (field_tuple(field),))
+        else:
+            fingerprint.update('%r\n' % canonical(table[key]))
+    return fingerprint.hexdigest()
+
+
+def get_fingerprint(table):
+    """The fingerprint of a table, computed if it was not parsed with it"""
+    return table.get('fingerprint') or table_fingerprint(table)
+
+
+def add_fingerprints(tables):
+    for table in tables.values():
+        table['fingerprint'] = table_fingerprint(table)
+
+
+def schema_digest(tables):
+    """Hash of a whole dict of tables, from the names and fingerprints of its tables"""
+    digest = hashlib.sha1()
+    for table_name in sorted(tables):
+        digest.update('%s %s\n' % (get_fingerprint(tables[table_name]), table_name))
+    return digest.hexdigest()
+
+
+# dumps are only split in chunks of at least that size for parallel parsing
+MIN_CHUNK_SIZE = 4 * 1024 * 1024
+
+TABLE_BOUNDARY = b'\nCREATE TABLE `'
+
+
+def print_unrecognised(line_number, line):
+    if active_stats is not None:
+        active_stats.add_unrecognised(line_number, line)
+        return
+    sys.stderr.write("WARNING: (%d) not recognised: %s\n" % (line_number, line))
+
+
+# the Stats of the run being instrumented, see Stats.__enter__
+active_stats = None
+
+# phases of a run timed by Stats
+PHASES = ('read', 'parse', 'filter', 'compare', 'emit')
+
+RE_SHAPE_STRING = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+RE_SHAPE_NAME = re.compile('`[^`]*`')
+RE_SHAPE_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+RE_SHAPE_SPACE = re.compile(r'\s+')
+SHAPE_LENGTH = 80
+
+
+def line_shape(line):
+    """The pattern of an unrecognised line: its strings, names and numbers are
+    replaced by placeholders, so that the similar lines are counted together."""
+    shape = RE_SHAPE_STRING.sub("'?'", line)
+    shape = RE_SHAPE_NAME.sub('`?`', shape)
+    shape = RE_SHAPE_NUMBER.sub('N', shape)
+    return RE_SHAPE_SPACE.sub(' ', shape).strip()[:SHAPE_LENGTH]
+
+
+def peak_memory_kb():
+    """Peak resident memory of the process, None where it is not known"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024
+    return rss
+
+
+class CountingPattern(object):
+    """ a compiled pattern counting its hits and misses in counts """
+    def __init__(self, pattern, counts):
+        self.pattern = pattern
+        self.counts = counts
+
+    def match(self, *args):
+        return self.count(self.pattern.match(*args))
+
+    def search(self, *args):
+        return self.count(self.pattern.search(*args))
+
+    def count(self, result):
+        self.counts[result is None] += 1
+        return result
+
+
+class NoPhase(object):
+    """ the phase context when no Stats are enabled """
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NO_PHASE = NoPhase()
+
+
+def phase(name):
+    """Context charging the time spent in it to the phase name of the active Stats, if any"""
+    if active_stats is None:
+        return NO_PHASE
+    return active_stats.phase(name)
+
+
+class Phase(object):
+    """ see Stats.phase """
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = self.stats.enter(self.name)
+
+    def __exit__(self, *exc_info):
+        self.stats.enter(self.previous)
+        return False
+
+
+class Stats(object):
+    """ instrumentation of the runs made while it is used as a context manager
+        phases: seconds spent in each of PHASES, nested phases pausing the outer one
+        lines: number of schema lines parsed
+        patterns: [hits, misses] of the tokenizer patterns by name, counted by
+            the counting_patterns the parsers are given in place of
+            TOKENIZER_PATTERNS
+        unrecognised: [count, first line number, first line] of the lines the
+            parser did not recognise, by line_shape. They are not printed.
+        hooks: functions called as hook(event, data) for each 'unrecognised'
+            line and for the final 'report', see report
+    Disabled, the instrumentation costs a test per parsed file. The patterns
+    are only counted in the process of the Stats, not in the -j workers.
+    """
+    def __init__(self):
+        self.phases = OrderedDict((name, 0.0) for name in PHASES)
+        self.lines = 0
+        self.patterns = OrderedDict((name, [0, 0]) for name in TOKENIZER_PATTERNS)
+        self.counting_patterns = dict((name, CountingPattern(pattern, self.patterns[name]))
+                                      for name, pattern in TOKENIZER_PATTERNS.items())
+        self.unrecognised = OrderedDict()
+        self.hooks = []
+        self.current = None
+        self.clock = None
+        self.started = None
+        self.seconds = None
+
+    def __enter__(self):
+        global active_stats
+        if active_stats is not None:
+            raise RuntimeError('Stats are already enabled')
+        active_stats = self
+        self.started = self.clock = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        global active_stats
+        self.enter(None)
+        self.seconds = time.time() - self.started
+        active_stats = None
+        report = self.report()
+        for hook in self.hooks:
+            hook('report', report)
+        return False
+
+    def enter(self, name):
+        """Charge the time elapsed to the current phase and switch to the phase
+        name. Returns the previous phase."""
+        now = time.time()
+        previous = self.current
+        if previous is not None:
+            self.phases[previous] += now - self.clock
+        self.clock = now
+        self.current = name
+        return previous
+
+    def phase(self, name):
+        """Context in the phase name"""
+        return Phase(self, name)
+
+    def iter_phase(self, name, items):
+        """Iterate over items, the time spent getting them being charged to the phase name"""
+        previous = self.enter(name)
+        for item in items:
+            self.enter(previous)
+            yield item
+            previous = self.enter(name)
+        self.enter(previous)
+
+    def iter_read(self, lines):
+        """iter_phase of the lines of a dump, counted"""
+        for line in self.iter_phase('read', lines):
+            self.lines += 1
+            yield line
+
+    def add_unrecognised(self, line_number, line):
+        shape = line_shape(line)
+        unrecognised = self.unrecognised.get(shape)
+        if unrecognised is None:
+            self.unrecognised[shape] = [1, line_number, line]
+        else:
+            unrecognised[0] += 1
+        for hook in self.hooks:
+            hook('unrecognised', {'line_number': line_number, 'line': line, 'shape': shape})
+
+    def report(self):
+        """The measures as a dict, fit for JSON:
+            seconds, phases: {phase: seconds}, lines, lines_per_second (of read and parse),
+            peak_memory_kb, patterns: {name: {hits, misses}},
+            unrecognised: [{shape, count, line_number, sample}], most frequent first"""
+        seconds = self.seconds
+        if seconds is None:
+            seconds = time.time() - self.started
+        parsing = self.phases['read'] + self.phases['parse']
+        return {'seconds': seconds,
+                'phases': dict(self.phases),
+                'lines': self.lines,
+                'lines_per_second': self.lines / parsing if parsing else None,
+                'peak_memory_kb': peak_memory_kb(),
+                'patterns': dict((name, {'hits': hits, 'misses': misses})
+                                 for name, (hits, misses) in self.patterns.items()),
+                'unrecognised': [{'shape': shape, 'count': count, 'line_number': line_number, 'sample': line}
+                                 for shape, (count, line_number, line)
+                                 in sorted(self.unrecognised.items(), key=lambda item: -item[1][0])]}
+
+
+def write_stats_report(report, fd):
+    """Write a Stats report as text"""
+    fd.write('-- %.3f s, %d lines' % (report['seconds'], report['lines']))
+    if report['lines_per_second'] is not None:
+        fd.write(', %.0f lines/s' % report['lines_per_second'])
+    if report['peak_memory_kb'] is not None:
+        fd.write(', peak memory %d KB' % report['peak_memory_kb'])
+    fd.write('\n%-20s %10s\n' % ('phase', 'seconds'))
+    for name in PHASES:
+        fd.write('%-20s %10.3f\n' % (name, report['phases'][name]))
+    fd.write('%-20s %10s %10s\n' % ('pattern', 'hits', 'misses'))
+    for name in sorted(report['patterns']):
+        fd.write('%-20s %10d %10d\n' % (name, report['patterns'][name]['hits'], report['patterns'][name]['misses']))
+    unrecognised = report['unrecognised']
+    fd.write('%d unrecognised lines of %d shapes\n' % (sum(shape['count'] for shape in unrecognised),
+                                                      len(unrecognised)))
+    for shape in unrecognised:
+        fd.write('%10d  %s\n            e.g. (%d) %s\n' % (shape['count'], shape['shape'], shape['line_number'],
+                                                         shape['sample']))
+
+
+def find_chunks(mapped, count, min_chunk_size=MIN_CHUNK_SIZE):
+    """Split a memory mapped dump in at most count byte ranges starting at
+    CREATE TABLE statements.
+    Returns a list of (start, stop) offsets covering the whole dump."""
+    size = len(mapped)
+    count = max(1, min(count, size // max(min_chunk_size, 1)))
+    starts = [0]
+    for i in range(1, count):
+        boundary = mapped.find(TABLE_BOUNDARY, max(starts[-1], size * i // count))
+        if boundary == -1:
+            break
+        starts.append(boundary + 1)
+    return zip(starts, starts[1:] + [size])
+
+
+def analyse_chunk(file_name, start, stop, table_filter=None):
+    """Parse the byte range [start, stop) of an uncompressed dump with the tokenizer,
+    skipping the tables filtered out by the TableFilter table_filter.
+    Out-of-line foreign keys and indexes may alter tables of other chunks:
+    they are returned apart as (kind, table name, key id, key), in the order
+    they were found, to be attached once the chunks are merged.
+    Returns (tables, out-of-line keys, warnings, number of lines)."""
+    with io.open(file_name, 'rb') as fd:
+        mapped = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return analyse_mapped_chunk(mapped, start, stop, table_filter)
+        finally:
+            mapped.close()
+
+
+def analyse_mapped_chunk(mapped, start, stop, table_filter=None):
+    """analyse_chunk of a memory mapped dump"""
+    tables = OrderedDict()
+    out_of_line_keys = []
+    warnings = []
+    line_count = [0]
+
+    def counted(lines):
+        for line in lines:
+            line_count[0] += 1
+            yield line
+
+    for parsed in iter_dump_objects(counted(iter_mapped_schema_lines(mapped, start, stop)), table_filter):
+        if parsed[0] == 'table':
+            tables[parsed[1]['name']] = parsed[1]
+        elif parsed[0] in ('fk', 'ix'):
+            out_of_line_keys.append(parsed)
+        else:
+            warnings.append(parsed[1:])
+    add_fingerprints(tables)
+    return tables, out_of_line_keys, warnings, line_count[0]
+
+
+def merge_chunks(chunks, first_line=0):
+    """Merge the results of analyse_chunk, in the order of the chunks, into one dict of tables.
+    first_line - number of lines of the dump before the first chunk, for the warnings"""
+    tables = OrderedDict()
+    out_of_line_keys = []
+    for chunk_tables, chunk_keys, warnings, line_count in chunks:
+        if active_stats is not None:
+            active_stats.lines += line_count
+        tables.update(chunk_tables)
+        out_of_line_keys.extend(chunk_keys)
+        for line_number, line in warnings:
+            print_unrecognised(first_line + line_number, line)
+        first_line += line_count
+    for kind, table_name, key_id, key in out_of_line_keys:
+        tables[table_name][kind][key_id] = key
+    # the chunks come with the fingerprints of their tables, without the keys added since
+    for table_name in set(key[1] for key in out_of_line_keys):
+        tables[table_name]['fingerprint'] = table_fingerprint(tables[table_name])
+    return tables
+
+
+def analyse_dump_file(file_name, table_prefix="", parser=None, buffer_size=DEFAULT_BUFFER_SIZE):
+    """analyse_file of a dump file name"""
+    return analyse_file(iter_dump_file(file_name, buffer_size), table_prefix, parser)
+
+
+INDEX_SUFFIX = '.compdb-index'
+
+
+def find_table_blocks(mapped):
+    """Split a memory mapped dump in blocks starting at each CREATE TABLE statement.
+    Returns the list of the (start, stop) offsets of the blocks."""
+    starts = [0]
+    boundary = mapped.find(TABLE_BOUNDARY)
+    while boundary != -1:
+        starts.append(boundary + 1)
+        boundary = mapped.find(TABLE_BOUNDARY, boundary + 1)
+    return [(start, stop) for start, stop in zip(starts, starts[1:] + [len(mapped)]) if start < stop]
+
+
+def read_index_entry(path):
+    """The analyse_chunk result of a block saved in the index entry path, or
+    None if it is missing. A broken entry is removed."""
+    try:
+        with io.open(path, 'rb') as fd:
+            return load_pickle(zlib.decompress(fd.read()))
+    except EnvironmentError:
+        return None
+    except Exception:
+        # truncated or corrupted entry, the block is parsed again
+        SchemaCache.remove(path)
+        return None
+
+
+def write_index_entry(path, chunk):
+    """Save the analyse_chunk result of a block, see read_index_entry. A dump
+    which directory is read only just gets no index."""
+    temp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        with io.open(temp_path, 'wb') as fd:
+            fd.write(zlib.compress(pickle.dumps(chunk, pickle.HIGHEST_PROTOCOL)))
+        os.rename(temp_path, path)
+    except EnvironmentError:
+        SchemaCache.remove(temp_path)
+
+
+def parse_indexed_blocks(file_name, index_file_name=None, table_filter=None):
+    """Parse an uncompressed dump block by block, reusing the results of the
+    blocks which content did not change since the previous run. The index is
+    a directory holding the result of each block in an entry of its own,
+    named after the content hash of the block and the PARSER_VERSION: the
+    blocks are found wherever they moved in the dump, and a run only writes
+    the entries of the changed blocks and removes the ones they replace.
+    index_file_name - defaults to the dump file name followed by INDEX_SUFFIX.
+    table_filter - the TableFilter the changed blocks are parsed with. They are
+                   kept under their hash and the filter, the blocks parsed
+                   unfiltered by a previous run being reused as they are.
+    Returns (analyse_chunk results of the blocks in order, number of blocks parsed)."""
+    if index_file_name is None:
+        index_file_name = file_name + INDEX_SUFFIX
+    if not os.path.isdir(index_file_name):
+        # the single file index of the previous versions, or anything broken
+        SchemaCache.remove(index_file_name)
+        try:
+            os.makedirs(index_file_name)
+        except EnvironmentError:
+            pass
+    filter_key = ''
+    if table_filter is not None:
+        filter_key = '-' + hashlib.sha1(str(table_filter)).hexdigest()[:16]
+    chunks = []
+    used = set()
+    reparsed = 0
+    with io.open(file_name, 'rb') as fd:
+        try:
+            mapped = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty dump
+            return [], 0
+        try:
+            for start, stop in find_table_blocks(mapped):
+                # hashed in place, the data statements of the block are not copied
+                content_hash = hashlib.sha1(buffer(mapped, start, stop - start)).hexdigest()
+                for name in ('%s%s.%d' % (content_hash, filter_key, PARSER_VERSION),
+                             '%s.%d' % (content_hash, PARSER_VERSION)):
+                    chunk = read_index_entry(os.path.join(index_file_name, name))
+                    if chunk is not None:
+                        break
+                else:
+                    name = '%s%s.%d' % (content_hash, filter_key, PARSER_VERSION)
+                    chunk = analyse_mapped_chunk(mapped, start, stop, table_filter)
+                    write_index_entry(os.path.join(index_file_name, name), chunk)
+                    reparsed += 1
+                used.add(name)
+                chunks.append(chunk)
+        finally:
+            mapped.close()
+    if reparsed:
+        # the entries of the blocks which changed, or of another PARSER_VERSION
+        try:
+            names = os.listdir(index_file_name)
+        except EnvironmentError:
+            names = []
+        for name in names:
+            if name not in used and not name.endswith('.tmp'):
+                SchemaCache.remove(os.path.join(index_file_name, name))
+    return chunks, reparsed
+
+
+def analyse_indexed_dump_file(file_name, table_prefix="", index_file_name=None):
+    """analyse_dump_file only parsing the tables changed since the previous
+    run, see parse_indexed_blocks"""
+    table_filter = make_table_filter(table_prefix)
+    with phase('parse'):
+        chunks, reparsed = parse_indexed_blocks(file_name, index_file_name, table_filter)
+        tables = merge_chunks(chunks)
+        # the blocks parsed unfiltered
+        with phase('filter'):
+            filter_table_dic(tables, table_filter)
+    return tables
+
+
+def is_splittable(file_name, parser):
+    """Only uncompressed regular files can be parsed in chunks, by the tokenizer"""
+    if (parser or DEFAULT_PARSER) != PARSER_TOKENIZER or not os.path.isfile(file_name):
+        return False
+    with io.open(file_name, 'rb') as fd:
+        return detect_compression(fd.read(MAGIC_LENGTH)) is None
+
+
+def parse_dump_files(file_names, table_prefix="", parser=None, buffer_size=DEFAULT_BUFFER_SIZE, jobs=1,
+                     min_chunk_size=MIN_CHUNK_SIZE, incremental=False):
+    """Parse several dump files at the same time in a pool of jobs processes.
+    Uncompressed dumps are split at CREATE TABLE statements into chunks parsed
+    in parallel, so that a single large dump also uses all the processes.
+    incremental - parse the uncompressed dumps with analyse_indexed_dump_file
+    Returns the list of the dicts of tables of the files."""
+    if jobs <= 1:
+        return [analyse_indexed_dump_file(file_name, table_prefix)
+                if incremental and is_splittable(file_name, parser)
+                else analyse_dump_file(file_name, table_prefix, parser, buffer_size)
+                for file_name in file_names]
+    import multiprocessing
+    pool = multiprocessing.Pool(jobs)
+    try:
+        with phase('parse'):
+            pending = []
+            for file_name in file_names:
+                if file_name == '-':
+                    # the standard input is not available in the pool
+                    pending.append(None)
+                elif incremental and is_splittable(file_name, parser):
+                    pending.append(pool.apply_async(analyse_indexed_dump_file, (file_name, table_prefix)))
+                elif is_splittable(file_name, parser):
+                    with io.open(file_name, 'rb') as fd:
+                        mapped = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+                        try:
+                            chunks = find_chunks(mapped, jobs, min_chunk_size)
+                        finally:
+                            mapped.close()
+                    pending.append([pool.apply_async(analyse_chunk, (file_name, start, stop,
+                                                                     make_table_filter(table_prefix)))
+                                    for start, stop in chunks])
+                else:
+                    pending.append(pool.apply_async(analyse_dump_file, (file_name, table_prefix, parser,
+                                                                        buffer_size)))
+            results = []
+            for file_name, result in zip(file_names, pending):
+                if result is None:
+                    tables = analyse_dump_file(file_name, table_prefix, parser, buffer_size)
+                elif isinstance(result, list):
+                    tables = merge_chunks(chunk.get() for chunk in result)
+                else:
+                    tables = result.get()
+                results.append(tables)
+            return results
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def analyse_dump_files(file_names, table_prefix="", parser=None, buffer_size=DEFAULT_BUFFER_SIZE, jobs=1,
+                       min_chunk_size=MIN_CHUNK_SIZE, cache=None, incremental=False):
+    """parse_dump_files, the tables of the files found in the SchemaCache cache
+    being loaded instead of parsed. The warnings of the parser are only
+    printed when a file is parsed.
+    Returns the list of the dicts of tables of the files."""
+    if cache is None:
+        return parse_dump_files(file_names, table_prefix, parser, buffer_size, jobs, min_chunk_size, incremental)
+    # the standard input can not be hashed before being parsed
+    keys = [None if file_name == '-' else cache.key(file_name, table_prefix, parser, buffer_size)
+            for file_name in file_names]
+    with phase('read'):
+        results = [None if key is None else cache.get(key) for key in keys]
+    missing = [i for i, tables in enumerate(results) if tables is None]
+    parsed = parse_dump_files([file_names[i] for i in missing], table_prefix, parser, buffer_size, jobs,
+                              min_chunk_size, incremental)
+    for i, tables in zip(missing, parsed):
+        results[i] = tables
+        # a file changed while it was parsed is not stored under its previous content
+        if keys[i] is not None and keys[i] == cache.key(file_names[i], table_prefix, parser, buffer_size):
+            cache.put(keys[i], tables)
+    return results
+
+
+# the statement starting the tables of a database in the dumps of several databases
+RE_USE_DATABASE = re.compile(r'USE `([^`]+)`;')
+DATABASE_BOUNDARY = b'\nUSE `'
+
+
+def iter_database_sections(lines):
+    """Split the lines of a dump of several databases, e.g. of mysqldump
+    --all-databases or --databases, at its USE `<database>`; statements.
+    Yields (database, iterator of the lines of its section), the database of
+    the lines before the first USE statement being ''. Each section has to be
+    read before the next one."""
+    database = ['']
+
+    def keyed():
+        for line in lines:
+            if line[:5] == 'USE `':
+                match = RE_USE_DATABASE.match(line)
+                if match:
+                    database[0] = match.group(1)
+            yield database[0], line
+
+    for name, section in itertools.groupby(keyed(), lambda item: item[0]):
+        yield name, (line for database_name, line in section)
+
+
+def find_database_sections(mapped):
+    """The pre-scan of iter_database_sections on a memory mapped dump: only
+    the USE statements are looked at.
+    Returns the list of the (database, start, stop) offsets of the sections."""
+    sections = []
+    database = ''
+    start = 0
+    boundary = 0 if mapped[:5] == DATABASE_BOUNDARY[1:] else mapped.find(DATABASE_BOUNDARY)
+    while boundary != -1:
+        line_start = boundary + 1 if mapped[boundary:boundary + 1] == b'\n' else boundary
+        line_end = mapped.find(b'\n', line_start)
+        match = RE_USE_DATABASE.match(mapped[line_start:len(mapped) if line_end == -1 else line_end])
+        if match:
+            if line_start > start:
+                sections.append((database, start, line_start))
+            database = match.group(1)
+            start = line_start
+        boundary = mapped.find(DATABASE_BOUNDARY, line_start)
+    if len(mapped) > start:
+        sections.append((database, start, len(mapped)))
+    return sections
+
+
+def add_database_tables(databases, database, tables):
+    """Add the tables of a section of database to the OrderedDict databases,
+    the sections before any USE statement only when they have tables."""
+    if database or tables:
+        databases.setdefault(database, OrderedDict()).update(tables)
+
+
+def analyse_database_file(file_name, table_prefix="", parser=None, buffer_size=DEFAULT_BUFFER_SIZE):
+    """analyse_dump_file of a dump of several databases: the tables are
+    kept apart by database, so that tables of the same name in different
+    databases are not merged.
+    Returns an OrderedDict of the dicts of tables by database name, in the
+    order of the dump, see iter_database_sections."""
+    databases = OrderedDict()
+    for database, lines in iter_database_sections(iter_dump_file(file_name, buffer_size)):
+        add_database_tables(databases, database, analyse_file(lines, table_prefix, parser))
+    return databases
+
+
+def parse_database_files(file_names, table_prefix="", parser=None, buffer_size=DEFAULT_BUFFER_SIZE, jobs=1):
+    """parse_dump_files of dumps of several databases: the uncompressed dumps
+    are pre-scanned for their USE statements and each database is parsed by
+    a process of the pool, see find_database_sections.
+    Returns the list of the analyse_database_file results of the files."""
+    if jobs <= 1:
+        return [analyse_database_file(file_name, table_prefix, parser, buffer_size) for file_name in file_names]
+    import multiprocessing
+    pool = multiprocessing.Pool(jobs)
+    try:
+        with phase('parse'):
+            pending = []
+            for file_name in file_names:
+                if file_name == '-':
+                    # the standard input is not available in the pool
+                    pending.append(None)
+                elif is_splittable(file_name, parser):
+                    with io.open(file_name, 'rb') as fd:
+                        try:
+                            mapped = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+                        except ValueError:
+                            # empty dump
+                            pending.append([])
+                            continue
+                        try:
+                            sections = find_database_sections(mapped)
+                        finally:
+                            mapped.close()
+                    pending.append([(database, pool.apply_async(analyse_chunk, (file_name, start, stop,
+                                                                                make_table_filter(table_prefix))))
+                                    for database, start, stop in sections])
+                else:
+                    pending.append(pool.apply_async(analyse_database_file, (file_name, table_prefix, parser,
+                                                                            buffer_size)))
+            results = []
+            for file_name, result in zip(file_names, pending):
+                if result is None:
+                    databases = analyse_database_file(file_name, table_prefix, parser, buffer_size)
+                elif isinstance(result, list):
+                    databases = OrderedDict()
+                    first_line = 0
+                    for database, section in result:
+                        chunk = section.get()
+                        add_database_tables(databases, database, merge_chunks([chunk], first_line))
+                        first_line += chunk[3]
+                else:
+                    databases = result.get()
+                results.append(databases)
+            return results
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+# bumped whenever the dicts of tables produced by the parsers change, to
+# invalidate the schemas cached by previous versions
+PARSER_VERSION = 6
+
+# default maximum size of a SchemaCache directory
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+
+CACHE_SUFFIX = '.schema'
+
+
+def load_pickle(data):
+    """pickle.loads of parsed tables. They are acyclic, the garbage collector
+    is paused instead of walking them again and again while they are created."""
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        return pickle.loads(data)
+    finally:
+        if collecting:
+            gc.enable()
+
+
+class SchemaCache(object):
+    """ on-disk cache of the dicts of tables parsed from dumps
+        entries are keyed by the content hash of the dump, the parser and its
+        version and the table prefix, so a dump modified in place is never
+        read from a stale entry. They are stored as zlib compressed pickles;
+        the least recently used ones are removed once the directory grows
+        over max_size bytes.
+    """
+    def __init__(self, directory, max_size=DEFAULT_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, file_name, table_prefix="", parser=None, buffer_size=DEFAULT_BUFFER_SIZE):
+        """Cache key of the tables of a dump file"""
+        content = hashlib.sha1()
+        with io.open(file_name, 'rb') as fd:
+            while True:
+                block = fd.read(buffer_size)
+                if not block:
+                    break
+                content.update(block)
+        key = hashlib.sha1()
+        for part in (content.hexdigest(), str(PARSER_VERSION), parser or DEFAULT_PARSER,
+                     str(make_table_filter(table_prefix) or '')):
+            key.update(part.encode('utf-8') + b'\0')
+        return key.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+    def get(self, key):
+        """Return the tables stored under key, or None"""
+        path = self.path(key)
+        try:
+            with io.open(path, 'rb') as fd:
+                tables = load_pickle(zlib.decompress(fd.read()))
+            # the entry is now the most recently used
+            os.utime(path, None)
+        except EnvironmentError:
+            return None
+        except Exception:
+            # truncated or corrupted entry
+            self.remove(path)
+            return None
+        return tables
+
+    def put(self, key, tables):
+        """Store tables under key, then evict the least recently used entries"""
+        data = zlib.compress(pickle.dumps(tables, pickle.HIGHEST_PROTOCOL))
+        path = self.path(key)
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        with io.open(temp_path, 'wb') as fd:
+            fd.write(data)
+        # readers never see a partially written entry
+        os.rename(temp_path, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(CACHE_SUFFIX):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except EnvironmentError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        size = sum(entry[1] for entry in entries)
+        for mtime, entry_size, name in sorted(entries):
+            if size <= self.max_size:
+                break
+            self.remove(os.path.join(self.directory, name))
+            size -= entry_size
+
+    @staticmethod
+    def remove(path):
+        try:
+            os.remove(path)
+        except EnvironmentError:
+            pass
+
+
+# names of the versions of a SchemaHistory, also the names of their manifest files
+RE_VERSION = re.compile(r'^[\w+-][\w.+-]*$')
+
+
+class SchemaHistory(object):
+    """ content-addressed history of the versions of a schema, in a directory
+        each table definition is stored once, under its fingerprint, as a
+        zlib compressed pickle in objects/; a version is only the manifest of
+        the fingerprints of its tables by name, in manifests/, so that the
+        history grows with the changed tables only. The versions file lists
+        the versions in the order they were added.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifests = {}
+        for name in ('objects', 'manifests'):
+            if not os.path.isdir(os.path.join(directory, name)):
+                os.makedirs(os.path.join(directory, name))
+
+    def object_path(self, fingerprint):
+        return os.path.join(self.directory, 'objects', fingerprint[:2], fingerprint[2:])
+
+    def versions(self):
+        """The names of the versions, oldest first"""
+        try:
+            with open(os.path.join(self.directory, 'versions')) as fd:
+                return [line.strip() for line in fd if line.strip()]
+        except EnvironmentError:
+            return []
+
+    def add_version(self, version, tables):
+        """Record the parsed tables as version, replacing the manifest of a
+        version of the same name.
+        Returns the number of table definitions which were not stored yet."""
+        if not RE_VERSION.match(version):
+            raise ValueError("Invalid version name '%s'" % version)
+        added = 0
+        for table in tables.values():
+            path = self.object_path(get_fingerprint(table))
+            if os.path.exists(path):
+                continue
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            temp_path = '%s.%d.tmp' % (path, os.getpid())
+            with io.open(temp_path, 'wb') as fd:
+                fd.write(zlib.compress(pickle.dumps(table, pickle.HIGHEST_PROTOCOL)))
+            os.rename(temp_path, path)
+            added += 1
+        path = os.path.join(self.directory, 'manifests', version)
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(temp_path, 'w') as fd:
+            for table_name in sorted(tables):
+                fd.write('%s %s\n' % (get_fingerprint(tables[table_name]), table_name))
+        os.rename(temp_path, path)
+        self.manifests.pop(version, None)
+        if version not in self.versions():
+            with open(os.path.join(self.directory, 'versions'), 'a') as fd:
+                fd.write(version + '\n')
+        return added
+
+    def manifest(self, version):
+        """The OrderedDict of the fingerprints of the tables of version by name, in name order"""
+        manifest = self.manifests.get(version)
+        if manifest is None:
+            if not RE_VERSION.match(version) or version not in self.versions():
+                raise ValueError("Unknown version '%s'" % version)
+            manifest = OrderedDict()
+            with open(os.path.join(self.directory, 'manifests', version)) as fd:
+                for line in fd:
+                    fingerprint, table_name = line.rstrip('\n').split(' ', 1)
+                    manifest[table_name] = fingerprint
+            self.manifests[version] = manifest
+        return manifest
+
+    def load_table(self, table_name, fingerprint):
+        """The Table of a definition of the history, named table_name"""
+        with io.open(self.object_path(fingerprint), 'rb') as fd:
+            table = load_pickle(zlib.decompress(fd.read()))
+        table['name'] = table_name
+        return table
+
+    def load_version(self, version):
+        """The dict of tables of version"""
+        return dict((table_name, self.load_table(table_name, fingerprint))
+                    for table_name, fingerprint in self.manifest(version).items())
+
+    def iter_table_versions(self, table_name):
+        """Yield (version, fingerprint) for each version where the definition
+        of the table changed, the fingerprint being None once it is dropped.
+        Only the manifests are read."""
+        previous = None
+        for version in self.versions():
+            fingerprint = self.manifest(version).get(table_name)
+            if fingerprint != previous:
+                yield version, fingerprint
+            previous = fingerprint
+
+    def first_version(self, table_name, column_name=None):
+        """The first version with the table, or with its column column_name,
+        or None. Only the definitions of the versions where the table changed
+        are read."""
+        for version, fingerprint in self.iter_table_versions(table_name):
+            if fingerprint is None:
+                continue
+            if column_name is None or column_name in self.load_table(table_name, fingerprint)['fields']:
+                return version
+        return None
+
+
+# relations of a SchemaStore: the tables in the order of the dump, their
+# columns in order, and their primary ('pk'), unique ('uk'), fulltext ('ft'),
+# secondary ('ix') and foreign ('fk') keys, the fields of a key separated by
+# commas. The ref_table of a secondary index is its type.
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tables (
+    name TEXT PRIMARY KEY, position INTEGER NOT NULL, fingerprint TEXT, stale INTEGER NOT NULL DEFAULT 0);
+CREATE INDEX IF NOT EXISTS tables_position ON tables (position);
+CREATE INDEX IF NOT EXISTS tables_stale ON tables (stale);
+CREATE TABLE IF NOT EXISTS columns (
+    table_name TEXT NOT NULL, position INTEGER NOT NULL, name TEXT NOT NULL, type TEXT NOT NULL,
+    nn INTEGER NOT NULL, has_default INTEGER NOT NULL, default_value TEXT, inc INTEGER NOT NULL,
+    PRIMARY KEY (table_name, position));
+CREATE TABLE IF NOT EXISTS keys (
+    table_name TEXT NOT NULL, kind TEXT NOT NULL, key_id TEXT NOT NULL, name TEXT NOT NULL, fields TEXT NOT NULL,
+    ref_table TEXT, ref_fields TEXT, PRIMARY KEY (table_name, kind, key_id));
+CREATE INDEX IF NOT EXISTS keys_ref_table ON keys (ref_table);
+CREATE TABLE IF NOT EXISTS options (
+    table_name TEXT NOT NULL, position INTEGER NOT NULL, kind TEXT NOT NULL, name TEXT NOT NULL, value TEXT,
+    PRIMARY KEY (table_name, position));
+"""
+
+# has_default of the columns of a SchemaStore: no default (False), a value, or None
+STORE_NO_DEFAULT = 0
+STORE_DEFAULT = 1
+STORE_NONE_DEFAULT = 2
+
+# kinds of the rows of the options relation of a SchemaStore: a table option,
+# the partitioning (type, expression), its number of partitions, its
+# subpartitioning and a partition (name, values)
+STORE_OPTION = 'option'
+STORE_PARTITION_BY = 'partition by'
+STORE_PARTITION_COUNT = 'partitions'
+STORE_SUBPARTITION_BY = 'subpartition by'
+STORE_PARTITION = 'partition'
+
+
+def option_rows(table):
+    """The rows of the options relation of a SchemaStore of a table"""
+    rows = [(STORE_OPTION, name, value) for name, value in (table.get('options') or {}).items()]
+    partitioning = table.get('partitions')
+    if partitioning:
+        rows.append((STORE_PARTITION_BY, partitioning['type'], partitioning['expression']))
+        rows.append((STORE_PARTITION_COUNT, '', str(partitioning['count'])))
+        if partitioning['sub']:
+            rows.append((STORE_SUBPARTITION_BY, '', partitioning['sub']))
+        rows.extend((STORE_PARTITION, partition['name'], partition['values'])
+                    for partition in partitioning['partitions'])
+    return [(table['name'], position) + row for position, row in enumerate(rows)]
+
+
+def key_row(table_name, kind, key_id, key):
+    """The row of the keys relation of a SchemaStore of a key of a table"""
+    if kind == 'fk':
+        return table_name, kind, key_id, key['name'], ','.join(key['k']), key['table'], ','.join(key['fk'])
+    return table_name, kind, key_id, key['name'], ','.join(key['fields']), key.get('type'), None
+
+
+class SchemaStore(object):
+    """ on-disk store of the tables of a schema, in a sqlite3 database
+        the tables are written one at a time as they are parsed and read back
+        one at a time, so that schemas larger than the memory can be compared,
+        see store_dump_file and CompDB.iter_store_migration.
+        file_name: path of the database, ':memory:' for a transient store
+    """
+    def __init__(self, file_name):
+        import sqlite3
+        self.file_name = file_name
+        self.connection = sqlite3.connect(file_name)
+        # the names and types are byte strings, as in the dicts of tables
+        self.connection.text_factory = str
+        self.connection.executescript(STORE_SCHEMA)
+        self.position = self.connection.execute('SELECT COALESCE(MAX(position) + 1, 0) FROM tables').fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    def clear(self):
+        with self.connection:
+            for relation in ('tables', 'columns', 'keys', 'options'):
+                self.connection.execute('DELETE FROM %s' % relation)
+        self.position = 0
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM tables').fetchone()[0]
+
+    def add_table(self, table):
+        """Store a Table, replacing the table of the same name"""
+        name = table['name']
+        self.remove_table(name)
+        self.connection.execute('INSERT INTO tables (name, position, fingerprint) VALUES (?, ?, ?)',
+                                (name, self.position, get_fingerprint(table)))
+        self.position += 1
+        columns = []
+        for position, field in enumerate(table['fields'].values()):
+            default = field['default']
+            if default is False:
+                has_default, default = STORE_NO_DEFAULT, None
+            elif default is None:
+                has_default = STORE_NONE_DEFAULT
+            else:
+                has_default = STORE_DEFAULT
+            columns.append((name, position, field['name'], field['type'], field['nn'], has_default, default,
+                            field['inc']))
+        self.connection.executemany('INSERT INTO columns VALUES (?, ?, ?, ?, ?, ?, ?, ?)', columns)
+        rows = [(name, 'pk', '', '', ','.join(sorted(table['pk'])), None, None)] if table['pk'] else []
+        for kind in ('uk', 'ft', 'ix', 'fk'):
+            rows.extend(key_row(name, kind, key_id, key) for key_id, key in table[kind].items())
+        self.connection.executemany('INSERT INTO keys VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        self.connection.executemany('INSERT INTO options VALUES (?, ?, ?, ?, ?)', option_rows(table))
+
+    def add_key(self, kind, table_name, key_id, key):
+        """Add an out-of-line foreign key ('fk') or secondary index ('ix') to a
+        stored table. Its fingerprint is updated by refresh_fingerprints."""
+        self.connection.execute('INSERT OR REPLACE INTO keys VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                key_row(table_name, kind, key_id, key))
+        self.connection.execute('UPDATE tables SET stale = 1 WHERE name = ?', (table_name,))
+
+    def refresh_fingerprints(self):
+        while True:
+            names = [row[0] for row in
+                     self.connection.execute('SELECT name FROM tables WHERE stale = 1 LIMIT 1000')]
+            if not names:
+                return
+            for name in names:
+                self.connection.execute('UPDATE tables SET fingerprint = ?, stale = 0 WHERE name = ?',
+                                        (table_fingerprint(self.load_table(name)), name))
+
+    def remove_table(self, name):
+        for relation, column in (('tables', 'name'), ('columns', 'table_name'), ('keys', 'table_name'),
+                                 ('options', 'table_name')):
+            self.connection.execute('DELETE FROM %s WHERE %s = ?' % (relation, column), (name,))
+
+    def load_table(self, name):
+        """The Table of a stored table, or None"""
+        row = self.connection.execute('SELECT fingerprint FROM tables WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            return None
+        table = Table(intern_value(name))
+        for field_name, field_type, nn, has_default, default, inc in self.connection.execute(
+                'SELECT name, type, nn, has_default, default_value, inc FROM columns '
+                'WHERE table_name = ? ORDER BY position', (name,)):
+            if has_default == STORE_NO_DEFAULT:
+                default = False
+            elif has_default == STORE_NONE_DEFAULT:
+                default = None
+            table['fields'][field_name] = Field(field_name, field_type, bool(nn), default, bool(inc))
+        for kind, key_id, key_name, fields, ref_table, ref_fields in self.connection.execute(
+                'SELECT kind, key_id, name, fields, ref_table, ref_fields FROM keys WHERE table_name = ?', (name,)):
+            fields = fields.split(',')
+            if kind == 'pk':
+                table['pk'] = set(intern_value(field) for field in fields)
+            elif kind == 'fk':
+                table['fk'][key_id] = ForeignKey(ref_table, fields, ref_fields.split(','), key_name)
+            elif kind == 'ix':
+                table['ix'][key_id] = Index(key_name, fields, ref_table)
+            else:
+                table[kind][key_id] = Key(key_name, fields)
+        partitioning = None
+        for kind, option_name, value in self.connection.execute(
+                'SELECT kind, name, value FROM options WHERE table_name = ? ORDER BY position', (name,)):
+            if kind == STORE_OPTION:
+                table['options'][option_name] = value
+            elif kind == STORE_PARTITION_BY:
+                partitioning = table['partitions'] = Partitioning(option_name, value)
+            elif kind == STORE_PARTITION_COUNT:
+                partitioning['count'] = int(value)
+            elif kind == STORE_SUBPARTITION_BY:
+                partitioning['sub'] = value
+            else:
+                partitioning['partitions'] += (Partition(option_name, value),)
+        table['fingerprint'] = row[0]
+        return table
+
+    def iter_tables(self):
+        """Yield the stored Tables, one at a time, in the order of the dump"""
+        for row in self.connection.execute('SELECT name FROM tables ORDER BY position').fetchall():
+            yield self.load_table(row[0])
+
+
+def store_dump_file(file_name, store_file_name, table_prefix="", buffer_size=DEFAULT_BUFFER_SIZE):
+    """Parse a dump with the tokenizer into the SchemaStore store_file_name,
+    replacing its content, one table at a time: only the table being parsed
+    is held in memory.
+    Returns the number of tables stored."""
+    store = SchemaStore(store_file_name)
+    try:
+        lines = iter_dump_file(file_name, buffer_size)
+        patterns = None
+        if active_stats is not None:
+            lines = active_stats.iter_read(lines)
+            patterns = active_stats.counting_patterns
+        with phase('parse'):
+            # a scratch database: a crash only loses the store being built
+            store.connection.execute('PRAGMA synchronous = OFF')
+            with store.connection:
+                store.clear()
+                for parsed in iter_dump_objects(lines, make_table_filter(table_prefix), patterns):
+                    if parsed[0] == 'table':
+                        store.add_table(parsed[1])
+                    elif parsed[0] in ('fk', 'ix'):
+                        store.add_key(*parsed)
+                    else:
+                        print_unrecognised(parsed[1], parsed[2])
+                store.refresh_fingerprints()
+        return len(store)
+    finally:
+        store.close()
+
+
+# connections opened by default by a ConnectionPool
+DEFAULT_POOL_SIZE = 4
+
+# placeholder of the DB-API paramstyles which take positional parameters
+PLACEHOLDERS = {'qmark': '?', 'numeric': ':1', 'format': '%s', 'pyformat': '%s'}
+
+# one set-based query per information_schema view, for all the tables of a schema
+COLUMNS_QUERY = ("SELECT TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE, COLUMN_DEFAULT, EXTRA "
+                 "FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = {0} "
+                 "ORDER BY TABLE_NAME, ORDINAL_POSITION")
+STATISTICS_QUERY = ("SELECT TABLE_NAME, INDEX_NAME, NON_UNIQUE, INDEX_TYPE, COLUMN_NAME, SUB_PART "
+                    "FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = {0} "
+                    "ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX")
+KEY_COLUMN_USAGE_QUERY = ("SELECT TABLE_NAME, CONSTRAINT_NAME, COLUMN_NAME, REFERENCED_TABLE_NAME, "
+                          "REFERENCED_COLUMN_NAME FROM information_schema.KEY_COLUMN_USAGE "
+                          "WHERE TABLE_SCHEMA = {0} AND REFERENCED_TABLE_NAME IS NOT NULL "
+                          "ORDER BY TABLE_NAME, CONSTRAINT_NAME, ORDINAL_POSITION")
+# the collations are joined to tell the default COLLATE, which dumps leave out
+TABLES_QUERY = ("SELECT TABLES.TABLE_NAME, TABLES.ENGINE, COLLATIONS.CHARACTER_SET_NAME, COLLATIONS.COLLATION_NAME, "
+                "COLLATIONS.IS_DEFAULT, TABLES.CREATE_OPTIONS FROM information_schema.TABLES "
+                "LEFT JOIN information_schema.COLLATIONS ON COLLATIONS.COLLATION_NAME = TABLES.TABLE_COLLATION "
+                "WHERE TABLES.TABLE_SCHEMA = {0} ORDER BY TABLES.TABLE_NAME")
+PARTITIONS_QUERY = ("SELECT TABLE_NAME, PARTITION_NAME, PARTITION_METHOD, PARTITION_EXPRESSION, PARTITION_DESCRIPTION, "
+                    "SUBPARTITION_METHOD, SUBPARTITION_EXPRESSION FROM information_schema.PARTITIONS "
+                    "WHERE TABLE_SCHEMA = {0} AND PARTITION_NAME IS NOT NULL "
+                    "ORDER BY TABLE_NAME, PARTITION_ORDINAL_POSITION, SUBPARTITION_ORDINAL_POSITION")
+
+
+class ConnectionPool(object):
+    """ a pool of DB-API connections, shared by the threads introspecting schemas
+        connect: function opening a new connection
+        size: maximum number of connections, opened when first needed
+        paramstyle: paramstyle of the DB-API module of the connections
+    """
+    def __init__(self, connect, size=DEFAULT_POOL_SIZE, paramstyle='format'):
+        if paramstyle not in PLACEHOLDERS:
+            raise ValueError("Unsupported paramstyle '%s', expected one of: %s"
+                             % (paramstyle, ', '.join(sorted(PLACEHOLDERS))))
+        import Queue
+        import threading
+        self.connect = connect
+        self.size = max(int(size), 1)
+        self.paramstyle = paramstyle
+        self.idle = Queue.LifoQueue()
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """An idle connection, a new one while less than size are open, else
+        waits for one to be released."""
+        with self.lock:
+            if self.idle.empty() and self.opened < self.size:
+                self.opened += 1
+                opening = True
+            else:
+                opening = False
+        if not opening:
+            return self.idle.get()
+        try:
+            return self.connect()
+        except Exception:
+            with self.lock:
+                self.opened -= 1
+            raise
+
+    def release(self, connection):
+        self.idle.put(connection)
+
+    def close(self):
+        """Close the idle connections."""
+        import Queue
+        while True:
+            try:
+                connection = self.idle.get_nowait()
+            except Queue.Empty:
+                return
+            with self.lock:
+                self.opened -= 1
+            connection.close()
+
+
+def mysql_pool(host='', user='', password='', port=None, size=DEFAULT_POOL_SIZE, database=None):
+    """A ConnectionPool of the MySQL server, through MySQLdb or else PyMySQL.
+    database - the default database of the connections"""
+    try:
+        import MySQLdb as driver
+    except ImportError:
+        try:
+            import pymysql as driver
+        except ImportError:
+            raise ImportError("connecting to a database needs the MySQLdb or PyMySQL module")
+    options = {'user': user, 'passwd': password}
+    if host:
+        options['host'] = host
+    if port:
+        options['port'] = int(port)
+    if database:
+        options['db'] = database
+    return ConnectionPool(lambda: driver.connect(**options), size, driver.paramstyle)
+
+
+# [USER[:PASSWORD]@][HOST][:PORT]/DATABASE of --execute
+RE_DSN = re.compile(r'^(?:([^:@]*)(?::([^@]*))?@)?([^:/@]*)(?::(\d+))?/([^/]+)$')
+
+
+def parse_dsn(dsn):
+    """The mysql_pool arguments of a [USER[:PASSWORD]@][HOST][:PORT]/DATABASE string"""
+    match = RE_DSN.match(dsn)
+    if match is None:
+        raise ValueError("Invalid database '%s', expected [USER[:PASSWORD]@][HOST][:PORT]/DATABASE" % dsn)
+    user, password, host, port, database = match.groups()
+    return {'user': user or '', 'password': password or '', 'host': host, 'port': port, 'database': database}
+
+
+def text_value(value):
+    """The interned byte string of a value read from a driver: the tables
+    built from the dumps hold byte strings, their fingerprints depend on it."""
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return intern_value(value)
+
+
+def fetch_rows(connection, query, schema, paramstyle):
+    cursor = connection.cursor()
+    try:
+        cursor.execute(query.format(PLACEHOLDERS[paramstyle]), (schema,))
+        return [tuple(text_value(value) for value in row) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def introspect_schema(connection, schema, table_prefix="", paramstyle='format'):
+    """Build the dict of tables of a schema from its information_schema views,
+    as analyse_dump_file builds it from its mysqldump: 5 queries whatever the
+    number of tables.
+    connection - an open DB-API connection to the server
+    paramstyle - the paramstyle of its DB-API module
+    Returns the OrderedDict of tables, in the order of their names."""
+    tables = OrderedDict()
+    for table_name, name, column_type, nullable, default, extra in fetch_rows(connection, COLUMNS_QUERY, schema,
+                                                                              paramstyle):
+        table = tables.get(table_name)
+        if table is None:
+            table = tables[table_name] = Table(table_name)
+        # the dumps parser only reads the first word of the type, e.g. not 'unsigned'
+        field_type = column_type.split()[0]
+        field = Field(name, TYPE_ALIASES.get(field_type, field_type), nn=nullable == 'NO',
+                      inc='auto_increment' in (extra or '').lower())
+        if not field['nn']:
+            field['default'] = 'NULL'
+        elif default is not None:
+            field['default'] = default
+        table['fields'][name] = field
+
+    keys = OrderedDict()
+    for table_name, index_name, non_unique, index_type, name, sub_part in fetch_rows(connection, STATISTICS_QUERY,
+                                                                                     schema, paramstyle):
+        if sub_part is not None and int(non_unique):
+            # the prefix length of the secondary index fields
+            name = '%s(%s)' % (name, sub_part)
+        keys.setdefault((table_name, index_name, int(non_unique), index_type), []).append(name)
+    for (table_name, index_name, non_unique, index_type), fields in keys.items():
+        if table_name not in tables:
+            continue
+        if index_name == 'PRIMARY':
+            tables[table_name]['pk'].update(fields)
+        elif index_type == 'FULLTEXT':
+            tables[table_name]['ft'][''.join(fields)] = Key(index_name, fields)
+        elif not non_unique:
+            tables[table_name]['uk'][''.join(fields)] = Key(index_name, fields)
+        else:
+            key_id, index = parse_index(index_name, ','.join(fields), index_type)
+            tables[table_name]['ix'][key_id] = index
+
+    foreign_keys = OrderedDict()
+    for table_name, name, field, fk_table, fk_field in fetch_rows(connection, KEY_COLUMN_USAGE_QUERY, schema,
+                                                                  paramstyle):
+        foreign_key = foreign_keys.setdefault((table_name, name), (fk_table, [], []))
+        foreign_key[1].append(field)
+        foreign_key[2].append(fk_field)
+    for (table_name, name), (fk_table, source_fields, target_fields) in foreign_keys.items():
+        if table_name in tables:
+            fkid = ''.join(source_fields) + '->' + fk_table + '.' + ''.join(target_fields)
+            tables[table_name]['fk'][fkid] = ForeignKey(fk_table, source_fields, target_fields, name)
+
+    # the table options and the partitioning, as SHOW CREATE TABLE prints them
+    for table_name, engine, charset, collation, default_collation, create_options in fetch_rows(
+            connection, TABLES_QUERY, schema, paramstyle):
+        if table_name not in tables or engine is None:
+            continue
+        options = ['ENGINE=%s' % engine, (create_options or '').replace('"', "'")]
+        if charset:
+            options.append('DEFAULT CHARSET=%s' % charset)
+        if collation and default_collation != 'Yes':
+            options.append('COLLATE=%s' % collation)
+        parse_table_options(tables[table_name], ' '.join(options))
+    partitionings = OrderedDict()
+    for table_name, name, method, expression, description, sub_method, sub_expression in fetch_rows(
+            connection, PARTITIONS_QUERY, schema, paramstyle):
+        if table_name not in tables:
+            continue
+        if table_name not in partitionings:
+            clause = 'PARTITION BY %s (%s)' % (method, expression)
+            if sub_method:
+                clause += ' SUBPARTITION BY %s (%s)' % (sub_method, sub_expression)
+            partitionings[table_name] = (clause, OrderedDict())
+        definition = 'PARTITION %s' % name
+        if description is not None:
+            if method.startswith('LIST'):
+                definition += ' VALUES IN (%s)' % description
+            elif description == 'MAXVALUE':
+                definition += ' VALUES LESS THAN MAXVALUE'
+            else:
+                definition += ' VALUES LESS THAN (%s)' % description
+        # one row per subpartition
+        partitionings[table_name][1][name] = definition
+    for table_name, (clause, definitions) in partitionings.items():
+        tables[table_name]['partitions'] = parse_partitioning('%s (%s)' % (clause, ', '.join(definitions.values())))
+
+    filter_table_dic(tables, table_prefix)
+    add_fingerprints(tables)
+    return tables
+
+
+def introspect_pooled_schema(pool, schema, table_prefix=""):
+    connection = pool.acquire()
+    try:
+        return introspect_schema(connection, schema, table_prefix, pool.paramstyle)
+    finally:
+        pool.release(connection)
+
+
+def introspect_schemas(pool, schemas, table_prefix=""):
+    """Introspect several schemas at the same time, each through a connection
+    of the ConnectionPool pool.
+    Returns the list of the dicts of tables of the schemas."""
+    if pool.size <= 1 or len(schemas) <= 1:
+        return [introspect_pooled_schema(pool, schema, table_prefix) for schema in schemas]
+    from multiprocessing.pool import ThreadPool
+    threads = ThreadPool(min(pool.size, len(schemas)))
+    try:
+        return threads.map(lambda schema: introspect_pooled_schema(pool, schema, table_prefix), schemas)
+    finally:
+        threads.close()
+        threads.join()
+
+
+class MigrationStep(object):
+    """ statements of a migration run in order through the same connection, see CompDB.migration_steps
+        kind: 'drop foreign keys', 'rename', 'alter', 'drop', 'create' or 'add foreign keys'
+        table: name of the table the statements change
+        statements: the SQL statements, without comments
+        depends: names of the steps which must succeed before
+    """
+    __slots__ = ('kind', 'table', 'name', 'statements', 'depends')
+
+    def __init__(self, kind, table, statements, depends=None):
+        self.kind = kind
+        self.table = table
+        self.name = '%s `%s`' % (kind, table)
+        self.statements = statements
+        self.depends = depends or []
+
+    def __repr__(self):
+        return '<MigrationStep %s>' % self.name
+
+
+def run_migration_step(pool, step):
+    """Run the statements of a MigrationStep through a connection of the
+    ConnectionPool pool, until one fails.
+    Returns the list of the (statement, seconds, error) of the statements run:
+    error is None unless the statement failed."""
+    results = []
+    connection = pool.acquire()
+    try:
+        cursor = connection.cursor()
+        try:
+            for statement in step.statements:
+                start = time.time()
+                try:
+                    cursor.execute(statement)
+                except Exception, e:
+                    results.append((statement, time.time() - start, e))
+                    break
+                results.append((statement, time.time() - start, None))
+        finally:
+            cursor.close()
+        if results and results[-1][2] is not None:
+            connection.rollback()
+        else:
+            connection.commit()
+    finally:
+        pool.release(connection)
+    return results
+
+
+def iter_executed_steps(pool, steps, stop_on_error=True):
+    """Run the MigrationSteps through the ConnectionPool pool: the steps which
+    dependencies succeeded are run at the same time, up to the size of pool.
+    stop_on_error - once a step failed no other one is started, else only
+                    the steps depending on it are not.
+    Yields (step, results) as each step ends, see run_migration_step, then
+    (step, None) for each step which was not run."""
+    import Queue
+    from multiprocessing.pool import ThreadPool
+    steps = OrderedDict((step.name, step) for step in steps)
+    waiting = dict((name, set(depended for depended in step.depends if depended in steps))
+                   for name, step in steps.items())
+    dependents = dict((name, []) for name in steps)
+    for name, depended_names in waiting.items():
+        for depended in depended_names:
+            dependents[depended].append(name)
+    ready = [name for name in steps if not waiting[name]]
+    ended = Queue.Queue()
+    run = set()
+    failed = False
+
+    def run_step(name):
+        try:
+            return name, run_migration_step(pool, steps[name])
+        except Exception, e:
+            # no connection
+            return name, [(None, 0.0, e)]
+
+    size = max(min(pool.size, len(steps)), 1)
+    threads = ThreadPool(size)
+    try:
+        running = 0
+        while ready or running:
+            # the steps are only started once a thread is free to run them
+            while ready and running < size and not (failed and stop_on_error):
+                name = ready.pop(0)
+                run.add(name)
+                threads.apply_async(run_step, (name,), callback=ended.put)
+                running += 1
+            if not running:
+                break
+            name, results = ended.get()
+            running -= 1
+            yield steps[name], results
+            if results and results[-1][2] is not None:
+                failed = True
+                continue
+            for dependent in dependents[name]:
+                waiting[dependent].discard(name)
+                if not waiting[dependent]:
+                    ready.append(dependent)
+    finally:
+        threads.close()
+        threads.join()
+    for name, step in steps.items():
+        if name not in run:
+            yield step, None
+
+
+# bounds of the baselines kept parsed by a DiffServer
+DEFAULT_SERVER_BASELINES = 16
+DEFAULT_SERVER_MEMORY = 512 * 1024 * 1024
+
+# memory of a parsed table and of each of its fields and keys, in bytes, as
+# measured by bench.memory: the estimate of the size of a baseline
+TABLE_MEMORY = 2048
+OBJECT_MEMORY = 256
+
+# the CompDB settings a diff request can change, see DiffServer.request_comp
+SERVER_OPTIONS = ('no_foreign_key', 'no_removing', 'detect_renames', 'coalesce', 'online_ddl', 'format')
+
+
+def estimate_tables_memory(tables):
+    """The memory of parsed tables in bytes, estimated from the number of the
+    tables and of their fields and keys"""
+    objects = 0
+    for table in tables.values():
+        objects += len(table['fields']) + len(table['fk']) + len(table['uk']) + len(table['ft']) + len(table['ix'])
+    return len(tables) * TABLE_MEMORY + objects * OBJECT_MEMORY
+
+
+class BaselineCache(object):
+    """ the parsed baselines of a DiffServer, least recently used first
+        the baselines are kept by path, size and modification time, so that a
+        changed baseline is parsed again, and dropped beyond max_count
+        baselines or max_size bytes of estimate_tables_memory.
+    """
+    def __init__(self, max_count=DEFAULT_SERVER_BASELINES, max_size=DEFAULT_SERVER_MEMORY):
+        import threading
+        self.max_count = max_count
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, file_name, parse):
+        """The tables of the baseline file_name, parsed by parse(file_name) unless kept"""
+        stat = os.stat(file_name)
+        key = (os.path.realpath(file_name), stat.st_size, stat.st_mtime)
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.entries[key] = entry
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        # parsed outside of the lock: the other baselines stay available meanwhile
+        tables = parse(file_name)
+        size = estimate_tables_memory(tables)
+        with self.lock:
+            for previous in [previous for previous in self.entries if previous[0] == key[0]]:
+                self.size -= self.entries.pop(previous)[1]
+            self.entries[key] = (tables, size)
+            self.size += size
+            while len(self.entries) > self.max_count or (self.size > self.max_size and len(self.entries) > 1):
+                self.size -= self.entries.popitem(last=False)[1][1]
+        return tables
+
+
+class DiffServer(object):
+    """ resident diff server: keeps the parsed baselines in a BaselineCache
+        and answers the diff requests of request_diff on a Unix socket, each
+        connection in a thread of its own. A request is a JSON line
+            {"baseline": <dump path>, "target": <dump path or null>,
+             "options": {<SERVER_OPTIONS name>: <value>}}
+        followed, when target is null, by the target dump itself until the
+        end of the stream. The reply is a JSON line, {"status": "ok"} or
+        {"status": "error", "error": <message>}, followed by the lines of the
+        migration bringing the target to the baseline, as --fleet prints it.
+        comp - the CompDB of the parsing settings (table filter, parser...)
+               and of the default comparison settings of the requests
+    """
+    def __init__(self, socket_path, comp=None, max_baselines=DEFAULT_SERVER_BASELINES,
+                 max_memory=DEFAULT_SERVER_MEMORY):
+        import socket
+        import stat
+        self.socket_path = socket_path
+        self.comp = comp or CompDB()
+        self.baselines = BaselineCache(max_baselines, max_memory)
+        if os.path.exists(socket_path) and stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            # left behind by a previous server
+            os.remove(socket_path)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # only the user of the server may connect: the requests name the files it parses
+        umask = os.umask(0177)
+        try:
+            self.listener.bind(socket_path)
+        finally:
+            os.umask(umask)
+        self.listener.listen(64)
+        self.stopped = False
+
+    def serve_forever(self, poll_interval=0.5):
+        """Accept the connections until shutdown is called"""
+        import select
+        import threading
+        try:
+            while not self.stopped:
+                if not select.select([self.listener], [], [], poll_interval)[0]:
+                    continue
+                connection = self.listener.accept()[0]
+                thread = threading.Thread(target=self.handle, args=(connection,))
+                thread.daemon = True
+                thread.start()
+        finally:
+            self.listener.close()
+            os.remove(self.socket_path)
+
+    def shutdown(self):
+        self.stopped = True
+
+    def parse(self, file_name):
+        return analyse_dump_file(file_name, self.comp.table_filter(), self.comp.parser, self.comp.buffer_size)
+
+    def request_comp(self, options):
+        """A copy of self.comp with the options of a request"""
+        comp = copy.copy(self.comp)
+        for name, value in options.items():
+            if name not in SERVER_OPTIONS:
+                raise ValueError("Unknown option '%s', expected one of: %s" % (name, ', '.join(SERVER_OPTIONS)))
+            if name == 'no_foreign_key':
+                comp.no_foreign_key = bool(value)
+            elif name == 'format':
+                comp.set_format(str(value))
+            else:
+                getattr(comp, 'set_' + name)(bool(value))
+        return comp
+
+    def diff(self, rfile):
+        """The lines of the migration of the request read from rfile"""
+        import json
+        request = json.loads(rfile.readline() or 'null')
+        if not isinstance(request, dict) or not request.get('baseline'):
+            raise ValueError('Invalid request: a JSON object with a baseline is expected')
+        comp = self.request_comp(request.get('options') or {})
+        baseline = self.baselines.get(request['baseline'], self.parse)
+        if request.get('target'):
+            target = self.parse(request['target'])
+        else:
+            target = analyse_file(iter_dump_stream(rfile, comp.buffer_size), comp.table_filter(), comp.parser)
+        return list(comp.iter_output(target, baseline))
+
+    def handle(self, connection):
+        import json
+        rfile = connection.makefile('rb')
+        wfile = connection.makefile('wb')
+        try:
+            try:
+                lines = self.diff(rfile)
+            except Exception, e:
+                # e.g. a corrupt compressed target: the client gets the error
+                # and the server goes on
+                wfile.write(json.dumps({'status': 'error', 'error': str(e) or e.__class__.__name__}) + '\n')
+                return
+            wfile.write(json.dumps({'status': 'ok'}) + '\n')
+            sink = FileSink(wfile)
+            for line in lines:
+                sink.write(line)
+            sink.flush()
+        finally:
+            wfile.close()
+            rfile.close()
+            connection.close()
+
+
+def request_diff(socket_path, baseline, target, options=None, output=None, stream=None):
+    """Ask the DiffServer of socket_path for the migration bringing the
+    target dump to the baseline one, written to output.
+    target - path of the target dump, '-' to send stream instead
+    options - the SERVER_OPTIONS of the comparison
+    output - file object, defaults to the standard output
+    stream - binary file object, defaults to the standard input
+    Raises ValueError with the message of the server when it failed."""
+    import json
+    import socket
+    if output is None:
+        output = sys.stdout
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path)
+    try:
+        request = {'baseline': os.path.abspath(baseline),
+                   'target': None if target == '-' else os.path.abspath(target),
+                   'options': options or {}}
+        client.sendall(json.dumps(request) + '\n')
+        if target == '-':
+            if stream is None:
+                stream = io.open(sys.stdin.fileno(), 'rb', closefd=False)
+            for block in iter(lambda: stream.read(DEFAULT_BUFFER_SIZE), b''):
+                client.sendall(block)
+        client.shutdown(socket.SHUT_WR)
+        reply = client.makefile('rb')
+        status = json.loads(reply.readline() or 'null')
+        if not isinstance(status, dict) or status.get('status') != 'ok':
+            raise ValueError(status.get('error') if isinstance(status, dict) else 'No reply from the server')
+        for block in iter(lambda: reply.read(DEFAULT_OUTPUT_BUFFER_SIZE), b''):
+            output.write(block)
+        output.flush()
+        reply.close()
+    finally:
+        client.close()
+
+
+class TableFilter(object):
+    """ the tables to compare, by name
+        include: patterns of the tables to compare, all of them when empty
+        exclude: patterns of the tables not to compare among them
+        prefix: regular expression the names must start with, see filter_table_dic
+        A pattern is a prefix, a glob when it contains *, ? or [, or a regular
+        expression after 're:'. The patterns of each list are compiled into one
+        regular expression.
+    """
+    def __init__(self, include=(), exclude=(), prefix=''):
+        self.include = tuple(include)
+        self.exclude = tuple(exclude)
+        self.prefix = prefix
+        self.include_pattern = compile_table_patterns(self.include)
+        self.exclude_pattern = compile_table_patterns(self.exclude)
+        self.prefix_pattern = re.compile(prefix) if prefix else None
+
+    def match(self, table_name):
+        """True if the table is compared"""
+        return (self.prefix_pattern is None or self.prefix_pattern.match(table_name) is not None) and \
+            (self.include_pattern is None or self.include_pattern.match(table_name) is not None) and \
+            (self.exclude_pattern is None or self.exclude_pattern.match(table_name) is None)
+
+    def __str__(self):
+        return ' '.join(['prefix=' + self.prefix] + ['include=' + pattern for pattern in self.include] +
+                        ['exclude=' + pattern for pattern in self.exclude])
+
+
+def table_pattern_regex(pattern):
+    """The regular expression of a TableFilter pattern, matched from the start of the names"""
+    if pattern.startswith('re:'):
+        return pattern[3:]
+    if any(char in pattern for char in '*?['):
+        regex = fnmatch.translate(pattern)
+        # the flags of the whole expression, which would apply to the others
+        if regex.endswith('(?ms)'):
+            regex = regex[:-len('(?ms)')]
+        return regex
+    return re.escape(pattern)
+
+
+def compile_table_patterns(patterns):
+    if not patterns:
+        return None
+    return re.compile('|'.join('(?:%s)' % table_pattern_regex(pattern) for pattern in patterns))
+
+
+def make_table_filter(table_prefix):
+    """The TableFilter of a table_prefix argument: either a TableFilter or the
+    regular expression of filter_table_dic. None when all tables are kept."""
+    if isinstance(table_prefix, TableFilter) or not table_prefix:
+        return table_prefix or None
+    return TableFilter(prefix=table_prefix)
+
+
+def filter_table_dic(tables, table_prefix=''):
+    table_filter = make_table_filter(table_prefix)
+    if tables is None or table_filter is None:
+        return
+    for table_name in tables.keys():
+        if not table_filter.match(table_name):
+            del tables[table_name]
+
+
+def get_quoted_fields(fields):
+    return u', '.join(u"`%s`" % field for field in fields)
+
+
+def usage():
+    print "Usage: %s [OPTION]... [OLD_SCHEMA.sql NEW_SCHEMA.sql]" % sys.argv[0]
+    print "       %s --fingerprints [OPTION]... SCHEMA.sql [SCHEMA.sql]" % sys.argv[0]
+    print "       %s --fleet [OPTION]... BASELINE.sql TENANT.sql..." % sys.argv[0]
+    print "       %s --serve=SOCKET [OPTION]..." % sys.argv[0]
+    print "       %s --client=SOCKET [OPTION]... BASELINE.sql TARGET.sql" % sys.argv[0]
+    print "       %s --history=DIR --add-version=VERSION [OPTION]... SCHEMA.sql" % sys.argv[0]
+    print "       %s --history=DIR [OPTION]... [OLD_VERSION NEW_VERSION]" % sys.argv[0]
+    print "       %s --history=DIR --first-version=TABLE[.COLUMN]" % sys.argv[0]
+    print """Prints all the differences between 2 DB schemas on the standard output.
+
+Options:
+
+  -p TABLE_PREFIX  compare only the tables which name starts with TABLE_PREFIX
+  --include=PATTERN
+                   compare only the tables matching PATTERN: a prefix, a glob
+                   when it contains *, ? or [ (e.g. 'shop_*_log'), or a regular
+                   expression after 're:'. Can be repeated. The other tables
+                   are skipped without being parsed.
+  --exclude=PATTERN
+                   do not compare the tables matching PATTERN, see --include.
+                   Can be repeated.
+  -a               For Django users: if you execute this command from your 
+                   project folder, the script will report the differences 
+                   between your current database and your django model.
+                   You don't need to provide OLD_SCHEMA.sql and NEW_SCHEMA.sql 
+                   arguments.
+                   -a makes -p mandatory. The -p argument must match the name 
+                   of an application installed in your Django project.
+                   e.g. python compdb.py -a -p MY_APP_NAME
+                   The database schema is read from its information_schema,
+                   through the MySQLdb or PyMySQL module.
+  -k               Enables detection of differences in the foreign keys.
+                   This feature is disabled by default as the constraint names 
+                   may be different between the two databases. 
+  --buffer-size=BYTES
+                   size of the blocks read from the schemas (default 1 MB).
+  -j JOBS          parse with JOBS processes: both schemas are parsed at the
+                   same time and large uncompressed schemas are split at
+                   their CREATE TABLE statements to be parsed in parallel.
+  --cache-dir=DIR  keep the parsed schemas in DIR: a schema which content has
+                   already been parsed is loaded from there instead.
+  --cache-size=BYTES
+                   maximum size of the cache directory, the least recently
+                   used schemas are removed beyond it (default 256 MB).
+  --store-dir=DIR  parse the schemas into sqlite databases of DIR, source.sqlite
+                   and target.sqlite, instead of memory, and compare them table
+                   by table: the memory used does not depend on the number of
+                   tables. The tables are compared in the order of the
+                   schemas, the renames are not detected.
+  --incremental    keep an index directory next to each uncompressed schema,
+                   named after it with a .compdb-index suffix, to only parse
+                   the tables which changed since the previous run.
+  --coalesce       merge the changes of each table into a single ALTER TABLE
+                   statement, so that the table is rebuilt once. Foreign keys
+                   are dropped by a statement of their own before it.
+  --online-ddl     end each ALTER TABLE with the ALGORITHM (INSTANT, INPLACE or
+                   COPY) and the LOCK its changes need with the InnoDB online
+                   DDL of MySQL 8.0.29 and later.
+  --size-hints=FILE
+                   sizes of the tables, one '<table> <size>' line each, e.g.
+                   'mydb.orders 200G'. The changes of the tables of at least
+                   --osc-min-size bytes which need a COPY are printed as a
+                   commented out pt-online-schema-change command instead.
+  --osc-min-size=BYTES
+                   size from which the tables of --size-hints are changed by
+                   pt-online-schema-change (default 1 GB).
+  --execute=[USER[:PASSWORD]@][HOST][:PORT]/DATABASE
+                   run the migration on the database, which schema must be
+                   OLD_SCHEMA.sql, instead of printing it: the statements of
+                   the tables which do not depend on each other through their
+                   foreign keys are run at the same time, through up to JOBS
+                   connections (-j). Each statement is printed after the time
+                   it took. After a failed statement no other is started and
+                   the exit status is 1. The commented out statements are not
+                   run.
+  --detect-renames rename the tables and the columns which were dropped when
+                   others of the same structure were created, instead of
+                   dropping and creating them, see the warning below.
+  --fingerprints   instead of the differences, print the fingerprint of each
+                   table of the schemas, after the digest of each schema. Only
+                   one schema is needed. Tables with the same fingerprint have
+                   the same definition.
+  --ndjson         instead of SQL, print one JSON object per change, e.g.
+                   {"table": "book", "object": "column", "change": "modify",
+                   "before": {...}, "after": {...}, "sql": "ALTER TABLE ...;",
+                   "destructive": false, "algorithm": "INSTANT", "lock": null}
+                   The object is a 'table', 'column', 'index', 'primary key',
+                   'foreign key', 'table options' or 'partition', the change
+                   'create', 'add', 'modify', 'rename' or 'drop', before and
+                   after its definitions in the schemas.
+  --missing-indexes
+                   instead of the differences, list the indexes of the tables
+                   of NEW_SCHEMA.sql, e.g. the baseline of a release, missing
+                   from the tables of OLD_SCHEMA.sql, e.g. production, one
+                   '<table>: missing INDEX `<name>` (<columns>)' line each.
+                   The indexes are compared by their columns, whatever their
+                   names.
+  --databases      the schemas are dumps of several databases, e.g. made by
+                   'mysqldump --all-databases': their tables are compared
+                   database by database, the databases of the same name
+                   together. The migration of each database starts with its
+                   USE statement. With -j the databases of the uncompressed
+                   schemas are parsed in parallel. Not with --cache-dir,
+                   --incremental or --store-dir.
+  --database-map=NEW_DB:OLD_DB[,OLD_DB...]
+                   compare the OLD_DB databases of OLD_SCHEMA.sql with the
+                   NEW_DB database of NEW_SCHEMA.sql, e.g. every tenant
+                   database of a server with the database of a release.
+                   Implies --databases. Can be repeated.
+  --fleet          compare each TENANT.sql schema with the BASELINE.sql one,
+                   parsed only once, and print the migrations bringing the
+                   tenants to the baseline. Tenants needing the same migration
+                   are listed together above it. With -j the tenants are
+                   compared in parallel. A tenant that can not be read is
+                   reported and the exit status is 1.
+  --serve=SOCKET   run a diff server listening on the Unix socket SOCKET: the
+                   baselines it is asked for stay parsed in memory, so that
+                   each diff only parses its target. The -p, --include,
+                   --exclude, --parser and --buffer-size options apply to
+                   every request.
+  --serve-baselines=COUNT
+                   number of baselines kept parsed by --serve (default 16),
+                   the least recently used ones being dropped beyond it.
+  --serve-memory=BYTES
+                   size of the baselines kept parsed by --serve, estimated
+                   from their numbers of tables, fields and keys (default
+                   512 MB).
+  --client=SOCKET  ask the server of SOCKET for the migration bringing
+                   TARGET.sql to BASELINE.sql, as --fleet prints it, instead
+                   of parsing them. TARGET.sql can be '-' to send the
+                   standard input. The -k, -n, --detect-renames, --coalesce,
+                   --online-ddl, --ndjson and --missing-indexes options are
+                   sent along.
+  --history=DIR    keep the versions of a schema in the history directory DIR:
+                   each table definition is stored once, under its
+                   fingerprint, and a version only lists the fingerprints of
+                   its tables. Without arguments, print the versions, oldest
+                   first; with OLD_VERSION and NEW_VERSION, print the
+                   migration between them, for which only the tables of
+                   different fingerprints are compared. The renames are not
+                   detected.
+  --add-version=VERSION
+                   parse SCHEMA.sql and add it to --history as VERSION, made of
+                   letters, digits, '_', '-', '+' and '.', replacing the
+                   version of the same name.
+  --first-version=TABLE[.COLUMN]
+                   print the first version of --history with the table TABLE,
+                   or with its column COLUMN. The exit status is 1 when there
+                   is none.
+  --stats          print to the standard error the time spent reading, parsing,
+                   filtering, comparing and writing the schemas, the lines
+                   parsed per second, the peak memory, the hits and misses of
+                   the patterns of the parser and the lines it did not
+                   recognise, counted by shape instead of being printed.
+  --stats-json=FILE
+                   save the same statistics as JSON in FILE.
+  --parser=NAME    parser engine used to read the schemas: 'tokenizer' (the
+                   default) or 'legacy', the original regular expression
+                   cascade.
+  -h               show this help screen
+
+---
+
+OLD_SCHEMA.sql and NEW_SCHEMA.sql schemas are generated with 'mysql_dump'
+or django's 'manage.py sql'. They can be full dumps: the data statements
+(INSERT, LOCK TABLES...) are skipped without being parsed, 'mysql_dump -d'
+is not needed. They can be gzip, bzip2 or xz compressed and either of them
+can be '-' to read it from the standard input, e.g.
+    mysqldump mydb | gzip | python compdb.py release.sql.gz -
+
+The partitions of the tables are changed by ADD, DROP, REORGANIZE and COALESCE
+PARTITION statements, which only rebuild the partitions they change; a table is
+only partitioned again when its partitioning type or expression changes. The
+ENGINE, ROW_FORMAT, KEY_BLOCK_SIZE, COMPRESSION, DEFAULT CHARSET and COLLATE
+table options are compared when both schemas declare them, e.g. not with the
+output of 'manage.py sql'.
+
+WARNING: without --detect-renames this script cannot detect changes in the
+name of an object (e.g. a table or a field). For instance, if you have changed
+the name of a table from A to B, the script will tell you to drop A and create
+B because it doesn't know they are related. If you follow those instructions
+you will loose your data. --detect-renames pairs the dropped and created
+objects by their structure: a table or a column dropped while an unrelated one
+of the same definition is created is renamed too, check the RENAME TABLE and
+CHANGE COLUMN statements before running them."""
+    sys.exit(2)
+
+def run_command(command):
+    import os
+    ret = os.system(command)
+    return ret
+
+def parse_cmd_line():
+    import getopt
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "ahp:nkKj:", ["auto", "help", "prefix=", "no-removing", "foreign-key",
+                                                             "no-foreign-key", "parser=", "buffer-size=",
+                                                             "jobs=", "cache-dir=", "cache-size=",
+                                                             "fingerprints", "fleet", "incremental", "stats",
+                                                             "stats-json=", "detect-renames", "coalesce",
+                                                             "online-ddl", "size-hints=", "osc-min-size=",
+                                                             "execute=", "include=", "exclude=", "ndjson",
+                                                             "store-dir=", "missing-indexes", "databases",
+                                                             "database-map=", "serve=", "serve-baselines=",
+                                                             "serve-memory=", "client=", "history=",
+                                                             "add-version=", "first-version="])
+    except getopt.GetoptError:
+        usage()
+    
+    comp = CompDB()
+         
+    auto = False
+    cache_dir = None
+    cache_size = DEFAULT_CACHE_SIZE
+    fleet = False
+    stats = None
+    stats_json = None
+    size_hints = None
+    osc_min_size = None
+    execute = None
+    include = []
+    exclude = []
+    store_dir = None
+    databases = False
+    database_map = {}
+    serve = None
+    serve_baselines = DEFAULT_SERVER_BASELINES
+    serve_memory = DEFAULT_SERVER_MEMORY
+    client = None
+    history = None
+    add_version = None
+    first_version = None
+    for opt, arg in opts:
+        if opt in ("-h", "--help"): usage()
+        elif opt in ('-p', "--prefix"):
+            comp.set_table_prefix(arg)            
+        elif opt in ("-a", "--auto"):
+            auto = True
+        elif opt in ("-n", "--no-removing"):
+            comp.set_no_removing(True)
+        elif opt in ("-K", "--no-foreign-key"):
+            comp.no_foreign_key = True
+        elif opt in ("-k", "--foreign-key"):
+            comp.no_foreign_key = False
+        elif opt in ("-j", "--jobs"):
+            try:
+                comp.set_jobs(arg)
+            except ValueError:
+                usage()
+        elif opt == "--buffer-size":
+            try:
+                comp.set_buffer_size(arg)
+            except ValueError:
+                usage()
+        elif opt == "--include":
+            include.append(arg)
+        elif opt == "--exclude":
+            exclude.append(arg)
+        elif opt == "--incremental":
+            comp.incremental = True
+        elif opt == "--fleet":
+            fleet = True
+        elif opt == "--detect-renames":
+            comp.set_detect_renames(True)
+        elif opt == "--coalesce":
+            comp.set_coalesce(True)
+        elif opt == "--online-ddl":
+            comp.set_online_ddl(True)
+        elif opt == "--size-hints":
+            size_hints = arg
+        elif opt == "--osc-min-size":
+            try:
+                osc_min_size = int(arg)
+            except ValueError:
+                usage()
+        elif opt == "--execute":
+            try:
+                execute = parse_dsn(arg)
+            except ValueError, e:
+                print "ERROR: %s\n" % e
+                usage()
+        elif opt == "--stats":
+            stats = stats or Stats()
+            stats.hooks.append(lambda event, data: event == 'report' and write_stats_report(data, sys.stderr))
+        elif opt == "--stats-json":
+            stats = stats or Stats()
+            stats_json = arg
+        elif opt == "--fingerprints":
+            comp.set_format('fingerprints')
+        elif opt == "--ndjson":
+            comp.set_format('ndjson')
+        elif opt == "--missing-indexes":
+            comp.set_format('missing-indexes')
+        elif opt == "--store-dir":
+            store_dir = arg
+        elif opt == "--serve":
+            serve = arg
+        elif opt in ("--serve-baselines", "--serve-memory"):
+            try:
+                if opt == "--serve-baselines":
+                    serve_baselines = max(int(arg), 1)
+                else:
+                    serve_memory = int(arg)
+            except ValueError:
+                usage()
+        elif opt == "--client":
+            client = arg
+        elif opt == "--history":
+            history = arg
+        elif opt == "--add-version":
+            add_version = arg
+        elif opt == "--first-version":
+            first_version = arg
+        elif opt == "--databases":
+            databases = True
+        elif opt == "--database-map":
+            target_database, colon, source_databases = arg.partition(':')
+            if not target_database or not source_databases:
+                usage()
+            databases = True
+            for source_database in source_databases.split(','):
+                database_map[source_database] = target_database
+        elif opt == "--cache-dir":
+            cache_dir = arg
+        elif opt == "--cache-size":
+            try:
+                cache_size = int(arg)
+            except ValueError:
+                usage()
+        elif opt == "--parser":
+            if arg not in PARSERS:
+                usage()
+            comp.set_parser(arg)
+    try:
+        comp.set_table_filter(include, exclude)
+    except ValueError, e:
+        print "ERROR: %s\n" % e
+        usage()
+    if cache_dir is not None:
+        comp.set_cache(cache_dir, cache_size)
+    if store_dir is not None:
+        comp.set_store_dir(store_dir)
+    if databases:
+        comp.set_databases(True, database_map)
+    if size_hints is not None:
+        try:
+            comp.set_size_hints(read_size_hints(size_hints), osc_min_size)
+        except (EnvironmentError, ValueError), e:
+            print "ERROR: %s\n" % e
+            usage()
+    if stats_json is not None:
+        stats.hooks.append(lambda event, data: event == 'report' and write_stats_json(data, stats_json))
+
+    with stats or NO_PHASE:
+        run_cmd_line(comp, args, auto, fleet, execute, serve, client, serve_baselines, serve_memory, history,
+                     add_version, first_version)
+
+
+def write_stats_json(report, file_name):
+    import json
+    with open(file_name, 'w') as fd:
+        json.dump(report, fd, indent=2, sort_keys=True)
+
+
+def run_cmd_line(comp, args, auto, fleet, execute=None, serve=None, client=None,
+                 serve_baselines=DEFAULT_SERVER_BASELINES, serve_memory=DEFAULT_SERVER_MEMORY, history=None,
+                 add_version=None, first_version=None):
+    # the databases are parsed afresh, neither cached nor indexed nor stored
+    if comp.databases and (execute is not None or fleet or auto or comp.format == 'fingerprints' or
+                           comp.cache is not None or comp.incremental or comp.store_dir is not None):
+        usage()
+    if (add_version is not None or first_version is not None) and history is None:
+        usage()
+    if history is not None:
+        if (auto or fleet or execute is not None or serve is not None or client is not None or comp.databases or
+                comp.format == 'fingerprints' or (add_version is not None and first_version is not None)):
+            usage()
+        history = SchemaHistory(history)
+        try:
+            if add_version is not None:
+                if len(args) != 1:
+                    usage()
+                comp.add_history_version(history, add_version, args[0])
+            elif first_version is not None:
+                if args:
+                    usage()
+                table_name, dot, column_name = first_version.partition('.')
+                version = history.first_version(table_name, column_name or None)
+                if version is None:
+                    sys.exit(1)
+                print version
+            elif len(args) == 2:
+                comp.compare_history(history, args[0], args[1])
+            elif not args:
+                for version in history.versions():
+                    print version
+            else:
+                usage()
+        except ValueError, e:
+            sys.stderr.write("ERROR: %s\n" % e)
+            sys.exit(1)
+        return
+    if serve is not None:
+        if args or auto or fleet or execute is not None or client is not None:
+            usage()
+        server = DiffServer(serve, comp, serve_baselines, serve_memory)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return
+    if client is not None:
+        if len(args) != 2 or args[0] == '-' or auto or fleet or execute is not None:
+            usage()
+        options = {'no_foreign_key': comp.no_foreign_key, 'no_removing': bool(comp.no_loss),
+                   'detect_renames': comp.detect_renames, 'coalesce': comp.coalesce,
+                   'online_ddl': comp.online_ddl, 'format': comp.format}
+        try:
+            request_diff(client, args[0], args[1], options)
+        except (EnvironmentError, ValueError), e:
+            sys.stderr.write("ERROR: %s\n" % e)
+            sys.exit(1)
+        return
+    if execute is not None:
+        if len(args) != 2 or auto or fleet or comp.format != 'sql' or args == ['-', '-']:
+            usage()
+        comp.set_files(args[0], args[1])
+        try:
+            pool = mysql_pool(size=comp.jobs, **execute)
+        except ImportError, e:
+            print "ERROR: %s\n" % e
+            usage()
+        try:
+            if comp.execute(pool):
+                sys.exit(1)
+        finally:
+            pool.close()
+        return
+    if fleet:
+        if len(args) < 2 or auto or '-' in args[1:]:
+            usage()
+        if comp.compare_fleet(args[0], args[1:]):
+            sys.exit(1)
+        return
+    if len(args) == 2 and not auto and args != ['-', '-']:
+        comp.set_files(args[0], args[1])
+    elif len(args) == 1 and not auto and comp.format == 'fingerprints':
+        comp.set_files(args[0], '')
+    elif len(args) == 0 and auto and comp.table_prefix != '':
+        try:
+            import settings
+        except ImportError, e:
+            print e
+            print "ERROR: settings.py not found in the current directory\n"
+            usage()
+
+        # the db schema is read from its information_schema
+        try:
+            pool = mysql_pool(settings.DATABASE_HOST, settings.DATABASE_USER, settings.DATABASE_PASSWORD,
+                              getattr(settings, 'DATABASE_PORT', None), size=1)
+        except ImportError, e:
+            print "ERROR: %s\n" % e
+            usage()
+        command = 'python manage.py sql %s > cmpdj.sql' % comp.table_prefix
+        run_command(command)
+
+        # django dump of the db schema
+        try:
+            comp.compare_database(pool, settings.DATABASE_NAME, 'cmpdj.sql')
+        finally:
+            pool.close()
+        return
     else:
         usage()
     
@@ -0,0 +1,34 @@
+BEGIN;
+CREATE TABLE `plays_author` (
+    `id` integer AUTO_INCREMENT NOT NULL PRIMARY KEY,
+    `name` varchar(100) NOT NULL UNIQUE,
+    `born` date,
+    `active` bool NOT NULL,
+    `biography` longtext NOT NULL
+)
+;
+CREATE TABLE `plays_text` (
+    `id` integer AUTO_INCREMENT NOT NULL PRIMARY KEY,
+    `author_id` integer NOT NULL,
+    `title` varchar(255) NOT NULL,
+    `position` smallint NOT NULL,
+    `status` varchar(10) NOT NULL,
+    `created` datetime NOT NULL,
+    `edited` datetime NULL,
+    UNIQUE (`author_id`, `title`)
+)
+;
+CREATE TABLE `plays_text_sample` (
+    `id` integer AUTO_INCREMENT NOT NULL PRIMARY KEY,
+    `text_id` integer NOT NULL,
+    `location` integer NOT NULL,
+    `sample` varchar(255),
+    `score` double precision NOT NULL,
+    UNIQUE (`location`, `text_id`)
+)
+;
+ALTER TABLE `plays_text` ADD CONSTRAINT `author_id_refs_id_5b2a1c3f` FOREIGN KEY (`author_id`) REFERENCES `plays_author` (`id`);
+ALTER TABLE `plays_text_sample` ADD CONSTRAINT `text_id_refs_id_4aaf935` FOREIGN KEY (`text_id`) REFERENCES `plays_text` (`id`);
+CREATE INDEX `plays_text_author_id` ON `plays_text` (`author_id`);
+CREATE INDEX `plays_text_sample_text_id` ON `plays_text_sample` (`text_id`);
+COMMIT;
@@ -0,0 +1,149 @@
+-- MySQL dump 10.13  Distrib 5.5.62, for debian-linux-gnu (x86_64)
+--
+-- Host: localhost    Database: plays
+-- ------------------------------------------------------
+-- Server version	5.5.62-0ubuntu0.14.04.1
+
+/*!40101 SET @OLD_CHARACTER_SET_CLIENT=@@CHARACTER_SET_CLIENT */;
+/*!40101 SET @OLD_CHARACTER_SET_RESULTS=@@CHARACTER_SET_RESULTS */;
+/*!40101 SET @OLD_COLLATION_CONNECTION=@@COLLATION_CONNECTION */;
+/*!40101 SET NAMES utf8 */;
+/*!40103 SET @OLD_TIME_ZONE=@@TIME_ZONE */;
+/*!40103 SET TIME_ZONE='+00:00' */;
+/*!40014 SET @OLD_UNIQUE_CHECKS=@@UNIQUE_CHECKS, UNIQUE_CHECKS=0 */;
+/*!40014 SET @OLD_FOREIGN_KEY_CHECKS=@@FOREIGN_KEY_CHECKS, FOREIGN_KEY_CHECKS=0 */;
+/*!40101 SET @OLD_SQL_MODE=@@SQL_MODE, SQL_MODE='NO_AUTO_VALUE_ON_ZERO' */;
+/*!40111 SET @OLD_SQL_NOTES=@@SQL_NOTES, SQL_NOTES=0 */;
+
+--
+-- Table structure for table `plays_author`
+--
+
+DROP TABLE IF EXISTS `plays_author`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8 */;
+CREATE TABLE `plays_author` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `name` varchar(100) NOT NULL,
+  `born` date DEFAULT NULL,
+  `active` tinyint(1) NOT NULL DEFAULT '1',
+  `biography` longtext,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `name` (`name`),
+  FULLTEXT KEY `plays_author_biography` (`biography`)
+) ENGINE=MyISAM AUTO_INCREMENT=42 DEFAULT CHARSET=utf8;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Dumping data for table `plays_author`
+--
+
+LOCK TABLES `plays_author` WRITE;
+/*!40000 ALTER TABLE `plays_author` DISABLE KEYS */;
+INSERT INTO `plays_author` VALUES (1,'Shakespeare','1564-04-26',1,'Poet; playwright\nand actor'),(2,'Marlowe',NULL,1,'CREATE TABLE `nope` (');
+/*!40000 ALTER TABLE `plays_author` ENABLE KEYS */;
+UNLOCK TABLES;
+
+
+--
+-- Table structure for table `plays_text`
+--
+
+DROP TABLE IF EXISTS `plays_text`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8 */;
+CREATE TABLE `plays_text` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `author_id` int(11) NOT NULL,
+  `title` varchar(255) NOT NULL DEFAULT '',
+  `position` smallint(6) NOT NULL DEFAULT '0',
+  `status` enum('draft','published') NOT NULL DEFAULT 'draft',
+  `created` datetime NOT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `plays_text_author_title` (`author_id`,`title`),
+  KEY `plays_text_author_id` (`author_id`),
+  CONSTRAINT `author_id_refs_id_5b2a1c3f` FOREIGN KEY (`author_id`) REFERENCES `plays_author` (`id`)
+) ENGINE=InnoDB AUTO_INCREMENT=1337 DEFAULT CHARSET=utf8;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Dumping data for table `plays_text`
+--
+
+LOCK TABLES `plays_text` WRITE;
+/*!40000 ALTER TABLE `plays_text` DISABLE KEYS */;
+INSERT INTO `plays_text` VALUES (1,1,'Hamlet',0,'published','1600-01-01 00:00:00'),(2,1,'Macbeth',1,'draft','1606-01-01 00:00:00');
+/*!40000 ALTER TABLE `plays_text` ENABLE KEYS */;
+UNLOCK TABLES;
+
+
+--
+-- Table structure for table `plays_text_sample`
+--
+
+DROP TABLE IF EXISTS `plays_text_sample`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8 */;
+CREATE TABLE `plays_text_sample` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `text_id` int(11) NOT NULL,
+  `location` int(11) NOT NULL,
+  `sample` varchar(255) DEFAULT NULL,
+  `score` double NOT NULL DEFAULT '0',
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `location` (`location`,`text_id`),
+  KEY `plays_text_sample_text_id` (`text_id`),
+  CONSTRAINT `text_id_refs_id_4aaf935` FOREIGN KEY (`text_id`) REFERENCES `plays_text` (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Dumping data for table `plays_text_sample`
+--
+
+LOCK TABLES `plays_text_sample` WRITE;
+/*!40000 ALTER TABLE `plays_text_sample` DISABLE KEYS */;
+INSERT INTO `plays_text_sample` VALUES (1,1,3,'To be, or not to be',0.5);
+INSERT INTO `plays_text_sample` VALUES (2,1,4,'that is the question:',0.25);
+/*!40000 ALTER TABLE `plays_text_sample` ENABLE KEYS */;
+UNLOCK TABLES;
+
+
+--
+-- Table structure for table `auth_group`
+--
+
+DROP TABLE IF EXISTS `auth_group`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8 */;
+CREATE TABLE `auth_group` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `name` varchar(80) NOT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `name` (`name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Dumping data for table `auth_group`
+--
+
+LOCK TABLES `auth_group` WRITE;
+/*!40000 ALTER TABLE `auth_group` DISABLE KEYS */;
+INSERT INTO `auth_group` VALUES (1,'editors'),
+(2,'multi-line
+row; with a raw newline');
+/*!40000 ALTER TABLE `auth_group` ENABLE KEYS */;
+UNLOCK TABLES;
+
+/*!40103 SET TIME_ZONE=@OLD_TIME_ZONE */;
+
+/*!40101 SET SQL_MODE=@OLD_SQL_MODE */;
+/*!40014 SET FOREIGN_KEY_CHECKS=@OLD_FOREIGN_KEY_CHECKS */;
+/*!40014 SET UNIQUE_CHECKS=@OLD_UNIQUE_CHECKS */;
+/*!40101 SET CHARACTER_SET_CLIENT=@OLD_CHARACTER_SET_CLIENT */;
+/*!40101 SET CHARACTER_SET_RESULTS=@OLD_CHARACTER_SET_RESULTS */;
+/*!40101 SET COLLATION_CONNECTION=@OLD_COLLATION_CONNECTION */;
+/*!40111 SET SQL_NOTES=@OLD_SQL_NOTES */;
+
+-- Dump completed on 2014-06-02 10:12:45
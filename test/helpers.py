@@ -0,0 +1,23 @@
+"""Fixtures and helpers shared by the tests."""
+import shutil
+import tempfile
+from StringIO import StringIO
+from compdb import analyse_file
+
+# the directory of the test run between make_temp_dir and remove_temp_dir,
+# used by the tests as helpers.temp_dir
+temp_dir = None
+
+
+def make_temp_dir():
+    global temp_dir
+    temp_dir = tempfile.mkdtemp()
+
+
+def remove_temp_dir():
+    shutil.rmtree(temp_dir)
+
+
+def parse(dump, parser=None):
+    """The tables parsed from the text of a dump"""
+    return analyse_file(StringIO(dump).readlines(), parser=parser)
@@ -0,0 +1,49 @@
+"""Tests for the synthetic dumps and the regression check of the benchmarks."""
+import sys
+from StringIO import StringIO
+from bench.run import find_regressions
+from bench.synthetic import generate_schema, iter_dump_lines, mutate_schema
+from compdb import analyse_file, compare_tables
+from nose.tools import eq_
+
+
+def parse(schema, rows=0):
+    stderr = sys.stderr
+    sys.stderr = StringIO()
+    try:
+        tables = analyse_file(StringIO(''.join(iter_dump_lines(schema, rows))))
+        return tables, sys.stderr.getvalue()
+    finally:
+        sys.stderr = stderr
+
+
+def test_generator_is_deterministic():
+    eq_(list(iter_dump_lines(generate_schema(20, seed=3), 2)), list(iter_dump_lines(generate_schema(20, seed=3), 2)))
+    assert generate_schema(20, seed=3) != generate_schema(20, seed=4)
+
+
+def test_synthetic_dumps_parse_cleanly():
+    """Every generated table should be parsed without warnings, data or not"""
+    schema = generate_schema(50, columns=10, index_density=0.5, fk_density=0.5)
+    tables, warnings = parse(schema, rows=3)
+    eq_(warnings, '')
+    eq_(sorted(tables), [table['name'] for table in schema])
+    eq_(sum(len(table['fk']) for table in tables.values()), sum(len(table['fks']) for table in schema))
+    eq_(parse(schema)[0], tables)
+
+
+def test_changed_tables_give_migrations():
+    """Only the tables changed by mutate_schema should need a migration"""
+    schema = generate_schema(200, columns=5)
+    mutated = mutate_schema(schema, changed=0.1)
+    changed = [table['name'] for table, other in zip(schema, mutated) if table != other]
+    assert 5 < len(changed) < 40, len(changed)
+    source = parse(schema)[0]
+    target = parse(mutated)[0]
+    eq_(sorted(name for name in source if compare_tables(source[name], target[name], '', False)), changed)
+
+
+def test_regressions_beyond_the_threshold():
+    baseline = {'phases': {'parse': {'seconds': 1.0}, 'compare': {'seconds': 1.0}}}
+    results = {'phases': {'parse': {'seconds': 1.05}, 'compare': {'seconds': 1.2}, 'end_to_end': {'seconds': 9}}}
+    eq_(find_regressions(results, baseline, 0.1), [('compare', 1.2, 1.0)])
@@ -0,0 +1,89 @@
+"""Tests for the migration merging the changes of each table into a single ALTER TABLE."""
+import os
+from compdb import CompDB, ListSink, compare_tables, iter_coalesced_alter
+from helpers import parse
+from nose.tools import eq_
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+SCHEMA_DUMP = os.path.join(FIXTURES, 'mysqldump_schema.sql')
+DJANGO_DUMP = os.path.join(FIXTURES, 'django_sql.sql')
+
+SOURCE = """CREATE TABLE `book` (
+  `id` int(11) NOT NULL,
+  `title` varchar(100) NOT NULL,
+  `isbn` varchar(13) NOT NULL,
+  `author_id` int(11) NOT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `book_isbn` (`isbn`),
+  CONSTRAINT `book_author` FOREIGN KEY (`author_id`) REFERENCES `author` (`id`)
+);
+"""
+TARGET = """CREATE TABLE `book` (
+  `id` int(11) NOT NULL,
+  `edition` int(11) NOT NULL,
+  `volume` int(11) NOT NULL,
+  `title` varchar(200) NOT NULL,
+  `author_id` int(11) NOT NULL,
+  PRIMARY KEY (`id`,`edition`),
+  UNIQUE KEY `book_title` (`title`),
+  CONSTRAINT `book_author` FOREIGN KEY (`author_id`) REFERENCES `writer` (`id`)
+);
+"""
+
+
+def coalesced(no_loss='', source=SOURCE, target=TARGET):
+    return list(iter_coalesced_alter(parse(source)['book'], parse(target)['book'], no_loss))
+
+
+def test_changes_are_merged_in_a_single_alter():
+    """The foreign key should be dropped first, then the indexes and the primary
+    key, the columns added after existing or just added ones"""
+    clauses = ['DROP INDEX `book_isbn`',
+               'DROP PRIMARY KEY',
+               'MODIFY COLUMN `title` varchar(200) NOT NULL',
+               'DROP COLUMN `isbn`',
+               'ADD COLUMN `edition` int(11) NOT NULL AFTER `id`',
+               'ADD COLUMN `volume` int(11) NOT NULL AFTER `edition`',
+               'ADD UNIQUE INDEX `book_title` (title)',
+               # the primary key fields are a set
+               'ADD PRIMARY KEY (%s)' % ', '.join(parse(TARGET)['book']['pk']),
+               'ADD CONSTRAINT `book_author` FOREIGN KEY (`author_id`) REFERENCES `writer` (`id`)']
+    eq_(coalesced(), ['-- UNIQUE INDEX (isbn) ',
+                      'ALTER TABLE `book` DROP FOREIGN KEY `book_author`;',
+                      'ALTER TABLE `book`\n%s;' % ',\n'.join('\t' + clause for clause in clauses)])
+
+
+def test_destructive_clauses_are_commented_out_apart():
+    statements = coalesced('-- ')
+    eq_(sorted(statement for statement in statements if statement.startswith('-- ALTER')),
+        ['-- ALTER TABLE `book` DROP COLUMN `isbn`;',
+         '-- ALTER TABLE `book` DROP FOREIGN KEY `book_author`;',
+         '-- ALTER TABLE `book` DROP INDEX `book_isbn`;'])
+    assert 'DROP' not in statements[-1].replace('DROP PRIMARY KEY', ''), statements[-1]
+
+
+def test_unchanged_table_gives_nothing():
+    eq_(coalesced(target=SOURCE), [])
+
+
+def test_same_clauses_as_the_separate_statements():
+    """Coalescing should only regroup the statements of compare_tables"""
+    separate = compare_tables(parse(SOURCE)['book'], parse(TARGET)['book'], '').splitlines()
+    clauses = [line.split(' ', 3)[-1].rstrip(';') for line in separate if line.startswith('ALTER')]
+    merged = '\n'.join(coalesced())
+    for clause in clauses:
+        # the replaced primary key is dropped by the statement adding the new one
+        for part in clause.replace('DROP PRIMARY KEY, ', 'DROP PRIMARY KEY\n').splitlines():
+            assert part in merged, part
+
+
+def test_coalesced_migration():
+    comp = CompDB()
+    comp.set_files(DJANGO_DUMP, SCHEMA_DUMP)
+    comp.set_coalesce(True)
+    sink = ListSink()
+    comp.set_output(sink)
+    comp.compare()
+    alters = [line for line in sink.lines if line.startswith('ALTER TABLE `plays_')]
+    eq_(sorted(alter.split('\n')[0] for alter in alters),
+        ['ALTER TABLE `plays_author`', 'ALTER TABLE `plays_text_sample`', 'ALTER TABLE `plays_text`'])
@@ -0,0 +1,104 @@
+"""Tests for reading compressed dumps and dumps from the standard input."""
+import bz2
+import gzip
+import os
+import sys
+from io import BytesIO
+from compdb import MAGIC_LENGTH, analyse_file, iter_dump_file, lzma
+import helpers
+from helpers import make_temp_dir, remove_temp_dir
+from nose.plugins.skip import SkipTest
+from nose.tools import eq_, with_setup
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+FULL_DUMP = os.path.join(FIXTURES, 'mysqldump_full.sql')
+
+
+def read_fixture():
+    with open(FULL_DUMP, 'rb') as fd:
+        return fd.read()
+
+
+def expected_lines():
+    return list(iter_dump_file(FULL_DUMP))
+
+
+def gzip_compress(data):
+    output = BytesIO()
+    member = gzip.GzipFile(fileobj=output, mode='wb')
+    member.write(data)
+    member.close()
+    return output.getvalue()
+
+
+def write_temp_file(name, data):
+    file_name = os.path.join(helpers.temp_dir, name)
+    with open(file_name, 'wb') as fd:
+        fd.write(data)
+    return file_name
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_gzip_dump_is_decompressed():
+    """A gzip dump, made of several concatenated members, should give
+    the lines of the uncompressed dump whatever the buffer size"""
+    data = read_fixture()
+    file_name = os.path.join(helpers.temp_dir, 'dump.sql.gz')
+    for part in (data[:1000], data[1000:]):
+        member = gzip.GzipFile(file_name, 'ab')
+        member.write(part)
+        member.close()
+    for buffer_size in (7, 64, 1024 * 1024):
+        eq_(list(iter_dump_file(file_name, buffer_size)), expected_lines())
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_bz2_dump_is_decompressed():
+    """A bzip2 dump should give the lines of the uncompressed dump"""
+    file_name = write_temp_file('dump.sql.bz2', bz2.compress(read_fixture()))
+    for buffer_size in (7, 1024 * 1024):
+        eq_(list(iter_dump_file(file_name, buffer_size)), expected_lines())
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_streams_ending_with_a_block_are_decompressed():
+    """A stream of concatenated ones (e.g. pbzip2 output) may end exactly
+    where a block of the compressed data ends"""
+    data = read_fixture()
+    compressions = [bz2.compress, gzip_compress]
+    if lzma is not None:
+        compressions.append(lzma.compress)
+    for compress in compressions:
+        first = compress(data[:1000])
+        file_name = write_temp_file('dump.sql.compressed', first + compress(data[1000:]))
+        # the blocks are read after the magic bytes
+        for buffer_size in (len(first) - MAGIC_LENGTH, len(first)):
+            eq_(list(iter_dump_file(file_name, buffer_size)), expected_lines())
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_xz_dump_is_decompressed():
+    """An xz dump should give the lines of the uncompressed dump"""
+    if lzma is None:
+        raise SkipTest("no lzma module")
+    file_name = write_temp_file('dump.sql.xz', lzma.compress(read_fixture()))
+    eq_(list(iter_dump_file(file_name, 64)), expected_lines())
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_compression_is_detected_from_the_content():
+    """The file name extension should not matter"""
+    file_name = write_temp_file('dump.sql', bz2.compress(read_fixture()))
+    eq_(analyse_file(iter_dump_file(file_name)), analyse_file(iter_dump_file(FULL_DUMP)))
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_dash_reads_the_standard_input():
+    """'-' should read the dump, compressed or not, from the standard input"""
+    stdin = sys.stdin
+    try:
+        for data in (read_fixture(), bz2.compress(read_fixture())):
+            with open(write_temp_file('stdin', data), 'rb') as sys.stdin:
+                eq_(list(iter_dump_file('-', 64)), expected_lines())
+    finally:
+        sys.stdin = stdin
@@ -0,0 +1,145 @@
+"""Tests for the dumps of several databases, compared database by database."""
+import json
+import mmap
+import os
+import sys
+from StringIO import StringIO
+import compdb
+from compdb import CompDB, ListSink, analyse_database_file, analyse_dump_file, find_database_sections, \
+    iter_database_sections, parse_database_files
+import helpers
+from helpers import make_temp_dir, remove_temp_dir
+from nose.tools import eq_, raises, with_setup
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+SCHEMA_DUMP = os.path.join(FIXTURES, 'mysqldump_schema.sql')
+DJANGO_DUMP = os.path.join(FIXTURES, 'django_sql.sql')
+
+AUTHOR = """CREATE TABLE `author` (
+  `id` int(11) NOT NULL,
+  PRIMARY KEY (`id`)
+);
+"""
+
+
+def database_dump(name, *sections):
+    """A dump of the databases of sections, (database, file name or dump) pairs, as mysqldump --databases does"""
+    file_name = os.path.join(helpers.temp_dir, name)
+    with open(file_name, 'w') as fd:
+        fd.write('-- MySQL dump\n/*!40101 SET NAMES utf8 */;\n')
+        for database, dump in sections:
+            fd.write('\n--\n-- Current Database: `%s`\n--\n\n' % database)
+            fd.write('CREATE DATABASE /*!32312 IF NOT EXISTS*/ `%s` /*!40100 DEFAULT CHARACTER SET utf8 */;\n\n'
+                     % database)
+            fd.write('USE `%s`;\n' % database)
+            fd.write(open(dump).read() if os.path.isfile(dump) else dump)
+    return file_name
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_tables_are_kept_by_database():
+    """The tables of the same name in two databases should not be merged"""
+    file_name = database_dump('server.sql', ('plays', SCHEMA_DUMP), ('django', DJANGO_DUMP), ('library', AUTHOR))
+    databases = analyse_database_file(file_name)
+    eq_(list(databases), ['plays', 'django', 'library'])
+    eq_(databases['plays'], analyse_dump_file(SCHEMA_DUMP))
+    eq_(databases['django'], analyse_dump_file(DJANGO_DUMP))
+    eq_(list(databases['library']), ['author'])
+    eq_(parse_database_files([file_name, file_name], 'plays_text', jobs=2),
+        [analyse_database_file(file_name, 'plays_text')] * 2)
+    eq_([database for database, lines in iter_database_sections(['SET @a=1;\n', 'USE `x`;\n', 'USE `y`;\n'])],
+        ['', 'x', 'y'])
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_sections_are_found_by_their_use_statement():
+    file_name = database_dump('server.sql', ('plays', AUTHOR), ('library', AUTHOR))
+    content = open(file_name).read()
+    with open(file_name, 'rb') as fd:
+        mapped = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            sections = find_database_sections(mapped)
+        finally:
+            mapped.close()
+    eq_([database for database, start, stop in sections], ['', 'plays', 'library'])
+    eq_(''.join(content[start:stop] for database, start, stop in sections), content)
+    assert content[sections[2][1]:].startswith('USE `library`;\n')
+
+
+def migration(source, target, database_map=None, data_format='sql'):
+    comp = CompDB()
+    comp.set_files(source, target)
+    comp.set_databases(True, database_map)
+    comp.set_format(data_format)
+    sink = ListSink()
+    comp.set_output(sink)
+    comp.compare()
+    return sink.lines
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_databases_are_compared_by_name():
+    source = database_dump('source.sql', ('plays', DJANGO_DUMP), ('library', AUTHOR), ('old', AUTHOR))
+    target = database_dump('target.sql', ('library', AUTHOR), ('plays', SCHEMA_DUMP), ('new', AUTHOR))
+    lines = migration(source, target)
+    comp = CompDB()
+    sink = ListSink()
+    comp.set_output(sink)
+    comp._write(comp.iter_migration(analyse_dump_file(DJANGO_DUMP), analyse_dump_file(SCHEMA_DUMP)))
+    eq_(lines, ['USE `plays`;'] + sink.lines + ['DROP DATABASE `old`;', 'CREATE DATABASE `new`;', 'USE `new`;',
+                                                  'CREATE TABLE `author` (', '\t`id` int(11) NOT NULL,\n'
+                                                  '\tPRIMARY KEY (`id`)', ');'])
+    eq_(migration(source, source), [])
+    records = [json.loads(line) for line in migration(source, target, data_format='ndjson')]
+    eq_(sorted((record['change'], record['database'], record['table']) for record in records
+               if record['object'] == 'table'), [('create', 'new', 'author'), ('create', 'plays', 'auth_group'),
+                                                 ('drop', 'old', 'author')])
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_one_database_mapped_to_several():
+    """Each tenant database should get the migration to the release database"""
+    source = database_dump('source.sql', ('tenant_1', DJANGO_DUMP), ('tenant_2', SCHEMA_DUMP),
+                           ('tenant_3', DJANGO_DUMP))
+    target = database_dump('target.sql', ('release', SCHEMA_DUMP))
+    lines = migration(source, target, {'tenant_1': 'release', 'tenant_2': 'release', 'tenant_3': 'release'})
+    uses = [line for line in lines if line.startswith('USE ')]
+    eq_(uses, ['USE `tenant_1`;', 'USE `tenant_3`;'])
+    eq_(lines[lines.index('USE `tenant_3`;'):][1:], lines[1:lines.index('USE `tenant_3`;')])
+    assert 'DATABASE' not in ''.join(lines)
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_command_line_database_map():
+    source = database_dump('source.sql', ('tenant_1', DJANGO_DUMP), ('tenant_2', DJANGO_DUMP))
+    target = database_dump('target.sql', ('release', SCHEMA_DUMP))
+    argv = sys.argv
+    stdout = sys.stdout
+    try:
+        sys.argv = ['compdb.py', '-j', '2', '--database-map=release:tenant_1,tenant_2', source, target]
+        sys.stdout = StringIO()
+        compdb.parse_cmd_line()
+        output = sys.stdout.getvalue()
+    finally:
+        sys.argv = argv
+        sys.stdout = stdout
+    eq_([line for line in output.splitlines() if line.startswith('USE ')], ['USE `tenant_1`;', 'USE `tenant_2`;'])
+
+
+def run(*args):
+    argv = sys.argv
+    stdout = sys.stdout
+    try:
+        sys.argv = ['compdb.py', '--databases'] + list(args)
+        sys.stdout = StringIO()
+        compdb.parse_cmd_line()
+    finally:
+        sys.argv = argv
+        sys.stdout = stdout
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_databases_are_neither_cached_nor_indexed_nor_stored():
+    for option in ('--cache-dir=%s' % os.path.join(helpers.temp_dir, 'cache'), '--incremental',
+                   '--store-dir=%s' % os.path.join(helpers.temp_dir, 'stores')):
+        raises(SystemExit)(run)(option, DJANGO_DUMP, SCHEMA_DUMP)
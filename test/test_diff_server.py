@@ -0,0 +1,143 @@
+"""Tests for the resident diff server keeping the parsed baselines, and its client."""
+import gzip
+import os
+import shutil
+import stat
+import sys
+import threading
+from StringIO import StringIO
+import compdb
+from compdb import BaselineCache, CompDB, DiffServer, ListSink, request_diff
+import helpers
+from helpers import make_temp_dir, remove_temp_dir
+from nose.tools import assert_raises_regexp, eq_, raises, with_setup
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+SCHEMA_DUMP = os.path.join(FIXTURES, 'mysqldump_schema.sql')
+DJANGO_DUMP = os.path.join(FIXTURES, 'django_sql.sql')
+FULL_DUMP = os.path.join(FIXTURES, 'mysqldump_full.sql')
+
+server = None
+thread = None
+
+
+def start_server():
+    global server, thread
+    make_temp_dir()
+    server = DiffServer(os.path.join(helpers.temp_dir, 'socket'))
+    thread = threading.Thread(target=server.serve_forever, args=(0.01,))
+    thread.start()
+
+
+def stop_server():
+    server.shutdown()
+    thread.join()
+    remove_temp_dir()
+
+
+def fleet_migration(baseline, target, **options):
+    """The migration of compdb.py --fleet BASELINE TARGET"""
+    comp = CompDB()
+    for name, value in options.items():
+        getattr(comp, 'set_' + name)(value)
+    comp.set_files(target, baseline)
+    sink = ListSink()
+    comp.set_output(sink)
+    comp.compare()
+    return ''.join(line + '\n' for line in sink.lines)
+
+
+def diff(baseline, target, options=None, stream=None):
+    output = StringIO()
+    request_diff(server.socket_path, baseline, target, options, output, stream)
+    return output.getvalue()
+
+
+@with_setup(start_server, stop_server)
+def test_only_the_user_may_connect():
+    eq_(stat.S_IMODE(os.stat(server.socket_path).st_mode), 0600)
+
+
+@with_setup(start_server, stop_server)
+def test_the_baseline_is_parsed_once():
+    eq_(diff(SCHEMA_DUMP, DJANGO_DUMP), fleet_migration(SCHEMA_DUMP, DJANGO_DUMP))
+    eq_(diff(SCHEMA_DUMP, FULL_DUMP), '')
+    eq_((server.baselines.hits, server.baselines.misses), (1, 1))
+    eq_(diff(SCHEMA_DUMP, DJANGO_DUMP, {'no_removing': True, 'coalesce': True}),
+        fleet_migration(SCHEMA_DUMP, DJANGO_DUMP, no_removing=True, coalesce=True))
+    # requests at the same time
+    outputs = []
+    threads = [threading.Thread(target=lambda: outputs.append(diff(DJANGO_DUMP, SCHEMA_DUMP))) for i in range(8)]
+    for client in threads:
+        client.start()
+    for client in threads:
+        client.join()
+    eq_(outputs, [fleet_migration(DJANGO_DUMP, SCHEMA_DUMP)] * 8)
+    eq_(len(server.baselines), 2)
+
+
+@with_setup(start_server, stop_server)
+def test_streamed_targets():
+    compressed = StringIO()
+    with gzip.GzipFile(fileobj=compressed, mode='wb') as fd:
+        fd.write(open(DJANGO_DUMP).read())
+    for content in (open(DJANGO_DUMP).read(), compressed.getvalue()):
+        eq_(diff(SCHEMA_DUMP, '-', stream=StringIO(content)), fleet_migration(SCHEMA_DUMP, DJANGO_DUMP))
+
+
+@with_setup(start_server, stop_server)
+def test_errors_are_replied():
+    raises(ValueError)(diff)(os.path.join(helpers.temp_dir, 'missing.sql'), DJANGO_DUMP)
+    raises(ValueError)(diff)(SCHEMA_DUMP, DJANGO_DUMP, {'table_prefix': 'plays'})
+    # a corrupt gzip target, replied the error of zlib
+    assert_raises_regexp(ValueError, 'Error -3 while decompressing', diff, SCHEMA_DUMP, '-',
+                         stream=StringIO('\x1f\x8b\x08' + '\x00' * 6 + '\x03garbage'))
+    # the server is still serving
+    eq_(diff(SCHEMA_DUMP, FULL_DUMP), '')
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_least_recently_used_baselines_are_dropped():
+    parsed = []
+
+    def parse(file_name):
+        parsed.append(os.path.basename(file_name))
+        return compdb.analyse_dump_file(file_name)
+
+    cache = BaselineCache(max_count=2)
+    for file_name in (SCHEMA_DUMP, DJANGO_DUMP, SCHEMA_DUMP, FULL_DUMP, DJANGO_DUMP):
+        cache.get(file_name, parse)
+    eq_(parsed, ['mysqldump_schema.sql', 'django_sql.sql', 'mysqldump_full.sql', 'django_sql.sql'])
+    cache = BaselineCache(max_size=cache.size // 2)
+    cache.get(SCHEMA_DUMP, parse)
+    cache.get(DJANGO_DUMP, parse)
+    eq_(len(cache), 1)
+    # a changed baseline is parsed again, in place of the previous one
+    file_name = os.path.join(helpers.temp_dir, 'baseline.sql')
+    shutil.copy(SCHEMA_DUMP, file_name)
+    cache = BaselineCache()
+    eq_(sorted(cache.get(file_name, parse)), sorted(compdb.analyse_dump_file(SCHEMA_DUMP)))
+    shutil.copy(DJANGO_DUMP, file_name)
+    eq_(sorted(cache.get(file_name, parse)), sorted(compdb.analyse_dump_file(DJANGO_DUMP)))
+    eq_(len(cache), 1)
+
+
+@with_setup(start_server, stop_server)
+def test_command_line_client():
+    argv = sys.argv
+    stdout = sys.stdout
+    try:
+        sys.argv = ['compdb.py', '--client=%s' % server.socket_path, '-k', SCHEMA_DUMP, DJANGO_DUMP]
+        sys.stdout = StringIO()
+        compdb.parse_cmd_line()
+        output = sys.stdout.getvalue()
+    finally:
+        sys.argv = argv
+        sys.stdout = stdout
+    comp = CompDB()
+    comp.no_foreign_key = False
+    comp.set_files(DJANGO_DUMP, SCHEMA_DUMP)
+    sink = ListSink()
+    comp.set_output(sink)
+    comp.compare()
+    eq_(output, ''.join(line + '\n' for line in sink.lines))
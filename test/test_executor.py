@@ -0,0 +1,183 @@
+"""Tests for the execution of the migrations, table by table in the order of their foreign keys."""
+import os
+import sqlite3
+import threading
+import time
+from compdb import CompDB, ConnectionPool, ListSink, MigrationStep, iter_executed_steps, parse_dsn
+import helpers
+from helpers import make_temp_dir, parse, remove_temp_dir
+from nose.tools import eq_, raises, with_setup
+
+AUTHOR = """CREATE TABLE `author` (
+  `id` int(11) NOT NULL,
+  `name` varchar(100) NOT NULL,
+  PRIMARY KEY (`id`)
+);
+"""
+BOOK = """CREATE TABLE `book` (
+  `id` int(11) NOT NULL,
+  `author_id` int(11) NOT NULL,
+  PRIMARY KEY (`id`),
+  CONSTRAINT `book_author` FOREIGN KEY (`author_id`) REFERENCES `%s` (`id`)
+);
+"""
+WRITER = AUTHOR.replace('`author`', '`writer`')
+TAG = """CREATE TABLE `tag` (
+  `id` int(11) NOT NULL,
+  PRIMARY KEY (`id`)
+);
+"""
+
+
+def steps(source, target):
+    comp = CompDB()
+    comp.no_foreign_key = False
+    return dict((step.name, step) for step in comp.migration_steps(parse(source), parse(target)))
+
+
+def test_foreign_keys_wait_for_the_tables_they_reference():
+    """The foreign key should be dropped before its table is changed and added
+    back once the referenced table is created"""
+    migration = steps(AUTHOR + BOOK % 'author' + TAG,
+                      AUTHOR.replace('`name`', '`full_name`') + BOOK.replace('NOT NULL,\n  PRIMARY', 'NOT NULL,\n'
+                                                                             '  `year` int(11) NOT NULL,\n  PRIMARY')
+                      % 'writer' + WRITER)
+    eq_(sorted(migration), ['add foreign keys `book`', 'alter `author`', 'alter `book`', 'create `writer`',
+                            'drop `tag`', 'drop foreign keys `book`'])
+    eq_(migration['drop foreign keys `book`'].statements, ['ALTER TABLE `book` DROP FOREIGN KEY `book_author`;'])
+    eq_(migration['alter `author`'].depends, ['drop foreign keys `book`'])
+    eq_(migration['alter `book`'].depends, ['drop foreign keys `book`'])
+    eq_(migration['add foreign keys `book`'].depends, ['drop foreign keys `book`', 'alter `book`', 'create `writer`'])
+    eq_(migration['create `writer`'].depends, [])
+    assert 'FOREIGN KEY' not in ''.join(migration['alter `book`'].statements)
+
+
+def test_dropped_tables_wait_for_the_tables_referencing_them():
+    migration = steps(AUTHOR + BOOK % 'author', '')
+    eq_(migration['drop `author`'].depends, ['drop `book`'])
+    migration = steps(AUTHOR + BOOK % 'author', BOOK.replace('  CONSTRAINT', '  KEY `author_id` (`author_id`)')
+                      .replace('(`id`),\n  KEY', '(`id`)\n  KEY').split('  KEY')[0] + ');\n')
+    eq_(migration['drop `author`'].depends, ['drop foreign keys `book`'])
+
+
+def test_commented_out_statements_are_not_run():
+    comp = CompDB()
+    comp.set_no_removing(True)
+    eq_(comp.migration_steps(parse(AUTHOR + TAG), parse(AUTHOR)), [])
+
+
+class Server(object):
+    """ stand-in of a database recording when each statement ran """
+    def __init__(self, duration=0.05):
+        self.duration = duration
+        self.runs = []
+        self.lock = threading.Lock()
+        self.connections = 0
+
+    def connect(self):
+        with self.lock:
+            self.connections += 1
+        return Connection(self)
+
+
+class Connection(object):
+    def __init__(self, server):
+        self.server = server
+        self.committed = 0
+
+    def cursor(self):
+        return self
+
+    def execute(self, statement):
+        start = time.time()
+        time.sleep(self.server.duration)
+        if 'FAIL' in statement:
+            raise ValueError('failed')
+        with self.server.lock:
+            self.server.runs.append((statement, start, time.time()))
+
+    def commit(self):
+        self.committed += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def run(server, migration, size=4, stop_on_error=True):
+    return list(iter_executed_steps(ConnectionPool(server.connect, size), migration, stop_on_error))
+
+
+def test_independent_steps_run_at_the_same_time():
+    server = Server()
+    migration = [MigrationStep('alter', 'table_%d' % i, ['A%d' % i]) for i in range(8)]
+    start = time.time()
+    results = run(server, migration)
+    eq_(sorted(step.name for step, step_results in results), sorted(step.name for step in migration))
+    assert all(error is None and seconds > 0 for step, step_results in results
+               for statement, seconds, error in step_results)
+    # 2 rounds of 4 connections
+    assert time.time() - start < 8 * server.duration, time.time() - start
+    eq_(server.connections, 4)
+
+
+def test_steps_wait_for_their_dependencies():
+    server = Server()
+    first = MigrationStep('drop foreign keys', 'book', ['first'])
+    second = MigrationStep('alter', 'author', ['second', 'third'], [first.name])
+    last = MigrationStep('add foreign keys', 'book', ['last'], [first.name, second.name])
+    other = MigrationStep('create', 'tag', ['other'])
+    run(server, [last, second, first, other])
+    ends = dict((statement, (start, end)) for statement, start, end in server.runs)
+    assert ends['first'][1] <= ends['second'][0] <= ends['third'][0] <= ends['last'][0]
+    assert ends['other'][0] < ends['first'][1]
+
+
+def test_no_step_is_started_after_an_error():
+    server = Server()
+    failing = MigrationStep('alter', 'book', ['ok', 'FAIL', 'never'])
+    dependent = MigrationStep('add foreign keys', 'book', ['dependent'], [failing.name])
+    later = [MigrationStep('create', 'table_%d' % i, ['later']) for i in range(3)]
+    results = run(server, [failing, dependent] + later, size=1)
+    eq_([(step.name, [statement for statement, seconds, error in step_results or ()])
+         for step, step_results in results],
+        [('alter `book`', ['ok', 'FAIL']), ('add foreign keys `book`', []), ('create `table_0`', []),
+         ('create `table_1`', []), ('create `table_2`', [])])
+    assert isinstance(results[0][1][1][2], ValueError)
+    # only the dependent steps of the failed one are left out
+    results = run(server, [failing, dependent] + later, size=1, stop_on_error=False)
+    eq_([step.name for step, step_results in results if step_results is None], ['add foreign keys `book`'])
+
+
+def test_dsn():
+    eq_(parse_dsn('root:secret@db1:3307/shop'),
+        {'user': 'root', 'password': 'secret', 'host': 'db1', 'port': '3307', 'database': 'shop'})
+    eq_(parse_dsn('/shop'), {'user': '', 'password': '', 'host': '', 'port': None, 'database': 'shop'})
+    raises(ValueError)(parse_dsn)('db1:3307')
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_migration_run_on_a_sqlite_database():
+    """The tables created and dropped by the migration should be in the database afterwards"""
+    database = os.path.join(helpers.temp_dir, 'database')
+    connection = sqlite3.connect(database)
+    connection.execute('CREATE TABLE tag (id int)')
+    connection.close()
+    for name, dump in (('source', TAG), ('target', AUTHOR + WRITER)):
+        with open(os.path.join(helpers.temp_dir, name), 'w') as fd:
+            fd.write(dump)
+    comp = CompDB()
+    comp.set_files(os.path.join(helpers.temp_dir, 'source'), os.path.join(helpers.temp_dir, 'target'))
+    sink = ListSink()
+    comp.set_output(sink)
+    pool = ConnectionPool(lambda: sqlite3.connect(database, check_same_thread=False), 2, 'qmark')
+    eq_(comp.execute(pool), [])
+    pool.close()
+    connection = sqlite3.connect(database)
+    eq_(sorted(row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")),
+        ['author', 'writer'])
+    connection.close()
+    eq_(len([line for line in sink.lines if line.startswith('-- ') and line.endswith(' s')]), 3)
+    assert 'DROP TABLE `tag`;' in sink.lines
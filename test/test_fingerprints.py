@@ -0,0 +1,80 @@
+"""Tests for the fingerprints of the parsed tables and schemas."""
+import copy
+import os
+import sys
+from StringIO import StringIO
+from compdb import CompDB, analyse_dump_file, schema_digest, table_fingerprint
+from nose.tools import eq_
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+FULL_DUMP = os.path.join(FIXTURES, 'mysqldump_full.sql')
+SCHEMA_DUMP = os.path.join(FIXTURES, 'mysqldump_schema.sql')
+DJANGO_DUMP = os.path.join(FIXTURES, 'django_sql.sql')
+
+
+def compare_output(source_file_name, target_file_name, data_format='sql'):
+    comp = CompDB()
+    comp.set_files(source_file_name, target_file_name)
+    comp.set_format(data_format)
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        comp.compare()
+        return sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+
+
+def test_parsed_tables_carry_their_fingerprint():
+    """The fingerprint computed while parsing should be the one of the table definition"""
+    for table in analyse_dump_file(SCHEMA_DUMP).values():
+        eq_(table['fingerprint'], table_fingerprint(table))
+
+
+def test_fingerprint_follows_the_definition():
+    """The fingerprint should ignore the table name and the order of sets and
+    dicts, but not the order of the fields nor any of their attributes"""
+    tables = analyse_dump_file(SCHEMA_DUMP)
+    table = tables['plays_text']
+    fingerprint = table['fingerprint']
+    renamed = copy.deepcopy(table)
+    renamed['name'] = 'other'
+    eq_(table_fingerprint(renamed), fingerprint)
+    reordered = copy.deepcopy(table)
+    reordered['uk'] = dict(reversed(list(table['uk'].items())))
+    eq_(table_fingerprint(reordered), fingerprint)
+    modified = copy.deepcopy(table)
+    modified['fields']['title']['nn'] = not table['fields']['title']['nn']
+    assert table_fingerprint(modified) != fingerprint
+    moved = copy.deepcopy(table)
+    field = moved['fields'].popitem(last=False)
+    moved['fields'][field[0]] = field[1]
+    assert table_fingerprint(moved) != fingerprint
+
+
+def test_schema_digest():
+    """Full and schema only dumps of a database should have the same digest"""
+    eq_(schema_digest(analyse_dump_file(FULL_DUMP)), schema_digest(analyse_dump_file(SCHEMA_DUMP)))
+    assert schema_digest(analyse_dump_file(DJANGO_DUMP)) != schema_digest(analyse_dump_file(SCHEMA_DUMP))
+
+
+def test_identical_schemas_give_no_migration():
+    eq_(compare_output(FULL_DUMP, SCHEMA_DUMP), '')
+
+
+def test_unchanged_tables_are_skipped():
+    """Only the tables which fingerprints differ should be compared"""
+    output = compare_output(SCHEMA_DUMP, DJANGO_DUMP)
+    source = analyse_dump_file(SCHEMA_DUMP)
+    target = analyse_dump_file(DJANGO_DUMP)
+    for table_name in source:
+        if table_name in target and source[table_name]['fingerprint'] == target[table_name]['fingerprint']:
+            assert '`%s`' % table_name not in output, table_name
+
+
+def test_fingerprints_output():
+    """The fingerprints format should list the digest then the tables of each schema"""
+    tables = analyse_dump_file(DJANGO_DUMP)
+    expected = ['-- %s %s' % (schema_digest(tables), DJANGO_DUMP)]
+    expected += ['%s %s' % (tables[name]['fingerprint'], name) for name in sorted(tables)]
+    eq_(compare_output(DJANGO_DUMP, '', 'fingerprints').splitlines(), expected)
@@ -0,0 +1,89 @@
+"""Tests for the comparison of a fleet of schemas with a single baseline."""
+import copy
+import os
+from bench.synthetic import generate_schema, write_dump
+from compdb import CompDB, ListSink, group_fleet_diffs
+import helpers
+from helpers import make_temp_dir, remove_temp_dir
+from nose.tools import eq_, with_setup
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+FULL_DUMP = os.path.join(FIXTURES, 'mysqldump_full.sql')
+SCHEMA_DUMP = os.path.join(FIXTURES, 'mysqldump_schema.sql')
+DJANGO_DUMP = os.path.join(FIXTURES, 'django_sql.sql')
+MISSING_DUMP = os.path.join(FIXTURES, 'missing.sql')
+TARGETS = [DJANGO_DUMP, FULL_DUMP, MISSING_DUMP, DJANGO_DUMP]
+
+
+def migration(source_file_name, target_file_name):
+    comp = CompDB()
+    comp.set_files(source_file_name, target_file_name)
+    sink = ListSink()
+    comp.set_output(sink)
+    comp.compare()
+    return ''.join(line + '\n' for line in sink.lines)
+
+
+def fleet_diffs(jobs):
+    comp = CompDB()
+    comp.set_jobs(jobs)
+    return list(comp.iter_fleet_diffs(SCHEMA_DUMP, TARGETS))
+
+
+def test_each_target_gets_its_migration_to_the_baseline():
+    """Targets should be compared in order, a missing one failing on its own"""
+    for jobs in (1, 3):
+        diffs = fleet_diffs(jobs)
+        eq_([diff[0] for diff in diffs], TARGETS)
+        eq_(diffs[0], (DJANGO_DUMP, migration(DJANGO_DUMP, SCHEMA_DUMP), None))
+        eq_(diffs[1], (FULL_DUMP, '', None))
+        eq_(diffs[2][1], None)
+        assert diffs[2][2].startswith('IOError'), diffs[2][2]
+        eq_(diffs[3], diffs[0])
+
+
+def test_targets_are_grouped_by_migration():
+    patterns, failures = group_fleet_diffs(fleet_diffs(1))
+    eq_(patterns.values(), [[DJANGO_DUMP, DJANGO_DUMP], [FULL_DUMP]])
+    eq_([failure[0] for failure in failures], [MISSING_DUMP])
+
+
+def test_fleet_report():
+    """The report should list the up to date targets, each migration once after
+    its targets, then the failures"""
+    comp = CompDB()
+    sink = ListSink()
+    comp.set_output(sink)
+    eq_(comp.compare_fleet(SCHEMA_DUMP, TARGETS), 1)
+    expected = ['-- Up to date: 1 schemas', '--   %s' % FULL_DUMP, '',
+                '-- Drift 1: 2 schemas', '--   %s' % DJANGO_DUMP, '--   %s' % DJANGO_DUMP]
+    expected += migration(DJANGO_DUMP, SCHEMA_DUMP).splitlines()
+    expected += ['', '-- Failed: 1 schemas']
+    eq_(sink.lines[:-1], expected)
+    assert sink.lines[-1].startswith('--   %s: IOError' % MISSING_DUMP)
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_cached_and_parsed_targets_share_their_migration():
+    """A target read from the cache should get the same migration text as
+    the same schema parsed from another dump"""
+    schema = generate_schema(300, columns=4, seed=7)
+    baseline = copy.deepcopy(schema)
+    for table in baseline[::3]:
+        table['columns'].append(('extra', 'int(11)', 'NOT NULL'))
+    baseline_file_name, cached, parsed = [os.path.join(helpers.temp_dir, name)
+                                          for name in ('b.sql', 'ta.sql', 'tb.sql')]
+    write_dump(baseline, baseline_file_name)
+    write_dump(schema, cached)
+    with open(parsed, 'w') as fd:
+        fd.write('-- another tenant\n' + open(cached).read())
+    comp = CompDB()
+    comp.set_cache(os.path.join(helpers.temp_dir, 'cache'))
+    comp.set_output(ListSink())
+    eq_(comp.compare_fleet(baseline_file_name, [cached]), 0)
+    sink = ListSink()
+    comp.set_output(sink)
+    eq_(comp.compare_fleet(baseline_file_name, [cached, parsed]), 0)
+    eq_(sink.lines[:5], ['-- Up to date: 0 schemas', '', '-- Drift 1: 2 schemas', '--   %s' % cached,
+                         '--   %s' % parsed])
+    assert '-- Drift 2' not in '\n'.join(sink.lines[5:])
@@ -0,0 +1,44 @@
+"""Tests for reading full dumps: the data statements must be skipped
+and the schema parsed as if the dump had been made with 'mysqldump -d'."""
+import io
+import os
+from compdb import analyse_file, iter_dump_file, iter_schema_lines
+from nose.tools import eq_
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+FULL_DUMP = os.path.join(FIXTURES, 'mysqldump_full.sql')
+SCHEMA_DUMP = os.path.join(FIXTURES, 'mysqldump_schema.sql')
+
+
+def test_full_dump_gives_the_same_tables_as_schema_only_dump():
+    """Parsing a full dump should give the tables of the schema only
+    dump of the same database"""
+    with open(SCHEMA_DUMP, 'r') as fd:
+        expected = analyse_file(fd.readlines())
+    eq_(analyse_file(iter_dump_file(FULL_DUMP)), expected)
+    with io.open(FULL_DUMP, 'rb') as fd:
+        eq_(analyse_file(fd), expected)
+
+
+def test_data_lines_are_not_produced():
+    """INSERT statements, including those spanning several lines, should be
+    replaced with empty lines so the line numbers are kept"""
+    with open(FULL_DUMP, 'r') as fd:
+        line_count = len(fd.readlines())
+    lines = list(iter_dump_file(FULL_DUMP))
+    eq_(len(lines), line_count)
+    eq_([line for line in lines if 'INSERT' in line or 'LOCK TABLES' in line or 'raw newline' in line], [])
+
+
+def test_buffer_smaller_than_the_lines_gives_the_same_lines():
+    """Lines longer than the read buffer, data or not, should be handled"""
+    expected = list(iter_dump_file(FULL_DUMP))
+    for buffer_size in (1, 16, 100):
+        with io.open(FULL_DUMP, 'rb') as fd:
+            eq_(list(iter_schema_lines(fd, buffer_size)), expected)
+
+
+def test_last_line_without_line_ending():
+    """A dump not terminated by a line ending should still give its last line"""
+    stream = io.BytesIO(b'DROP TABLE `a`;\nINSERT INTO `a` VALUES (1);\nUNLOCK TABLES;')
+    eq_(list(iter_schema_lines(stream, 8)), ['DROP TABLE `a`;\n', '', ''])
@@ -0,0 +1,99 @@
+"""Tests for the incremental parsing of dumps through their table index."""
+import os
+import shutil
+from compdb import INDEX_SUFFIX, analyse_dump_file, analyse_indexed_dump_file, parse_indexed_blocks
+import helpers
+from helpers import make_temp_dir, remove_temp_dir
+from nose.tools import eq_, with_setup
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def copy_fixture(name):
+    file_name = os.path.join(helpers.temp_dir, name)
+    shutil.copyfile(os.path.join(FIXTURES, name), file_name)
+    return file_name
+
+
+def edit(file_name, old, new):
+    with open(file_name, 'rb') as fd:
+        data = fd.read()
+    assert old in data
+    with open(file_name, 'wb') as fd:
+        fd.write(data.replace(old, new, 1))
+
+
+def reparsed(file_name):
+    return parse_indexed_blocks(file_name)[1]
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_unchanged_dump_is_not_parsed_again():
+    """The second run should reuse every block and give the same tables"""
+    for name in ('mysqldump_full.sql', 'django_sql.sql'):
+        file_name = copy_fixture(name)
+        expected = analyse_dump_file(file_name)
+        eq_(analyse_indexed_dump_file(file_name), expected)
+        assert os.path.exists(file_name + INDEX_SUFFIX)
+        eq_(reparsed(file_name), 0)
+        # the out-of-line foreign keys are not stored in the indexed tables
+        eq_(analyse_indexed_dump_file(file_name), expected)
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_only_changed_tables_are_parsed_again():
+    """A table growing moves the following ones, which should still be reused"""
+    file_name = copy_fixture('mysqldump_full.sql')
+    analyse_indexed_dump_file(file_name)
+    edit(file_name, "`name` varchar(100) NOT NULL,",
+         "`name` varchar(100) NOT NULL,\n  `alias` varchar(100) DEFAULT NULL,")
+    eq_(reparsed(file_name), 1)
+    eq_(analyse_indexed_dump_file(file_name), analyse_dump_file(file_name))
+    eq_(analyse_indexed_dump_file(file_name)['plays_author']['fields']['alias']['type'], 'varchar(100)')
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_new_tables_shift_the_others():
+    file_name = copy_fixture('mysqldump_schema.sql')
+    analyse_indexed_dump_file(file_name)
+    edit(file_name, "CREATE TABLE `plays_author` (",
+         "CREATE TABLE `first` (\n  `id` int(11) NOT NULL\n);\nCREATE TABLE `plays_author` (")
+    eq_(reparsed(file_name), 1)
+    eq_(reparsed(file_name), 0)
+    tables = analyse_indexed_dump_file(file_name, 'first')
+    eq_(tables.keys(), ['first'])
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_only_the_entries_of_changed_tables_are_written():
+    file_name = copy_fixture('mysqldump_full.sql')
+    index = file_name + INDEX_SUFFIX
+    analyse_indexed_dump_file(file_name)
+    entries = dict((name, os.stat(os.path.join(index, name)).st_mtime) for name in os.listdir(index))
+    for name in entries:
+        os.utime(os.path.join(index, name), (0, 0))
+    edit(file_name, "`name` varchar(100) NOT NULL,", "`name` varchar(200) NOT NULL,")
+    eq_(reparsed(file_name), 1)
+    changed = dict((name, os.stat(os.path.join(index, name)).st_mtime) for name in os.listdir(index))
+    eq_(len(changed), len(entries))
+    # the entry of the changed block replaces the previous one, the others are left alone
+    eq_(len(set(changed) - set(entries)), 1)
+    eq_(sorted(mtime for mtime in changed.values() if mtime == 0), [0] * (len(entries) - 1))
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_broken_index_is_rebuilt():
+    file_name = copy_fixture('mysqldump_schema.sql')
+    index = file_name + INDEX_SUFFIX
+    blocks = reparsed(file_name)
+    broken = sorted(os.listdir(index))[0]
+    with open(os.path.join(index, broken), 'wb') as fd:
+        fd.write(b'broken')
+    eq_(reparsed(file_name), 1)
+    eq_(reparsed(file_name), 0)
+    # an index file of the previous versions
+    shutil.rmtree(index)
+    with open(index, 'wb') as fd:
+        fd.write(b'broken')
+    eq_(reparsed(file_name), blocks)
+    eq_(reparsed(file_name), 0)
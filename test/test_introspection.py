@@ -0,0 +1,202 @@
+"""Tests for the introspection of live schemas, against an in-process sqlite stand-in of information_schema."""
+import os
+import sqlite3
+import threading
+from StringIO import StringIO
+from compdb import CompDB, ConnectionPool, ListSink, analyse_dump_file, analyse_file, introspect_schema, \
+    introspect_schemas
+import helpers
+from helpers import make_temp_dir, remove_temp_dir
+from nose.tools import eq_, with_setup
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+SCHEMA_DUMP = os.path.join(FIXTURES, 'mysqldump_schema.sql')
+
+# the plays_text, plays_text_sample and auth_group tables of SCHEMA_DUMP, as
+# MySQL describes them
+COLUMNS = [
+    ('plays', 'plays_text', 'id', 1, 'int(11)', 'NO', None, 'auto_increment'),
+    ('plays', 'plays_text', 'author_id', 2, 'int(11)', 'NO', None, ''),
+    ('plays', 'plays_text', 'title', 3, 'varchar(255)', 'NO', '', ''),
+    ('plays', 'plays_text', 'position', 4, 'smallint(6)', 'NO', '0', ''),
+    ('plays', 'plays_text', 'status', 5, "enum('draft','published')", 'NO', 'draft', ''),
+    ('plays', 'plays_text', 'created', 6, 'datetime', 'NO', None, ''),
+    ('plays', 'plays_text_sample', 'id', 1, 'int(11)', 'NO', None, 'auto_increment'),
+    ('plays', 'plays_text_sample', 'text_id', 2, 'int(11)', 'NO', None, ''),
+    ('plays', 'plays_text_sample', 'location', 3, 'int(11)', 'NO', None, ''),
+    ('plays', 'plays_text_sample', 'sample', 4, 'varchar(255)', 'YES', None, ''),
+    ('plays', 'plays_text_sample', 'score', 5, 'double', 'NO', '0', ''),
+    ('plays', 'auth_group', 'id', 1, 'int(11)', 'NO', None, 'auto_increment'),
+    ('plays', 'auth_group', 'name', 2, 'varchar(80)', 'NO', None, ''),
+    ('other', 'auth_group', 'id', 1, 'int(10) unsigned', 'NO', None, 'auto_increment'),
+    ('logs', 'event', 'id', 1, 'int(11)', 'NO', None, ''),
+    ('logs', 'event', 'created', 2, 'date', 'NO', None, ''),
+]
+STATISTICS = [
+    ('plays', 'plays_text', 'PRIMARY', 0, 'BTREE', 'id', 1, None),
+    ('plays', 'plays_text', 'plays_text_author_title', 0, 'BTREE', 'title', 2, None),
+    ('plays', 'plays_text', 'plays_text_author_title', 0, 'BTREE', 'author_id', 1, None),
+    ('plays', 'plays_text', 'plays_text_author_id', 1, 'BTREE', 'author_id', 1, None),
+    ('plays', 'plays_text_sample', 'PRIMARY', 0, 'BTREE', 'id', 1, None),
+    ('plays', 'plays_text_sample', 'location', 0, 'BTREE', 'location', 1, None),
+    ('plays', 'plays_text_sample', 'location', 0, 'BTREE', 'text_id', 2, None),
+    ('plays', 'plays_text_sample', 'plays_text_sample_text_id', 1, 'BTREE', 'text_id', 1, None),
+    ('plays', 'auth_group', 'PRIMARY', 0, 'BTREE', 'id', 1, None),
+    ('plays', 'auth_group', 'name', 0, 'BTREE', 'name', 1, None),
+    ('other', 'auth_group', 'PRIMARY', 0, 'BTREE', 'id', 1, None),
+]
+KEY_COLUMN_USAGE = [
+    ('plays', 'plays_text', 'PRIMARY', 'id', 1, None, None),
+    ('plays', 'plays_text', 'author_id_refs_id_5b2a1c3f', 'author_id', 1, 'plays_author', 'id'),
+    ('plays', 'plays_text_sample', 'text_id_refs_id_4aaf935', 'text_id', 1, 'plays_text', 'id'),
+]
+TABLES = [
+    ('plays', 'plays_text', 'InnoDB', 'utf8_general_ci', ''),
+    ('plays', 'plays_text_sample', 'InnoDB', 'utf8_general_ci', ''),
+    ('plays', 'auth_group', 'InnoDB', 'utf8_general_ci', ''),
+    ('other', 'auth_group', 'MyISAM', 'latin1_swedish_ci', ''),
+    ('logs', 'event', 'InnoDB', 'utf8mb4_bin', 'row_format=COMPRESSED KEY_BLOCK_SIZE=8 partitioned'),
+]
+COLLATIONS = [
+    ('utf8_general_ci', 'utf8', 'Yes'),
+    ('latin1_swedish_ci', 'latin1', 'Yes'),
+    ('utf8mb4_bin', 'utf8mb4', ''),
+]
+PARTITIONS = [
+    ('logs', 'event', 'p2019', 1, 'RANGE', 'year(`created`)', '2020', None, None, None),
+    ('logs', 'event', 'pmax', 2, 'RANGE', 'year(`created`)', 'MAXVALUE', None, None, None),
+    ('plays', 'plays_text', None, None, None, None, None, None, None, None),
+]
+EVENT = """CREATE TABLE `event` (
+  `id` int(11) NOT NULL,
+  `created` date NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8
+/*!50100 PARTITION BY RANGE (year(`created`))
+(PARTITION p2019 VALUES LESS THAN (2020) ENGINE = InnoDB,
+ PARTITION pmax VALUES LESS THAN MAXVALUE ENGINE = InnoDB) */;
+"""
+
+
+def make_fake_server():
+    """A sqlite database with the information_schema views used by introspect_schema"""
+    make_temp_dir()
+    connection = sqlite3.connect(os.path.join(helpers.temp_dir, 'information_schema'))
+    connection.execute('CREATE TABLE COLUMNS (TABLE_SCHEMA, TABLE_NAME, COLUMN_NAME, ORDINAL_POSITION, '
+                       'COLUMN_TYPE, IS_NULLABLE, COLUMN_DEFAULT, EXTRA)')
+    connection.execute('CREATE TABLE STATISTICS (TABLE_SCHEMA, TABLE_NAME, INDEX_NAME, NON_UNIQUE, INDEX_TYPE, '
+                       'COLUMN_NAME, SEQ_IN_INDEX, SUB_PART)')
+    connection.execute('CREATE TABLE KEY_COLUMN_USAGE (TABLE_SCHEMA, TABLE_NAME, CONSTRAINT_NAME, COLUMN_NAME, '
+                       'ORDINAL_POSITION, REFERENCED_TABLE_NAME, REFERENCED_COLUMN_NAME)')
+    connection.executemany('INSERT INTO COLUMNS VALUES (?, ?, ?, ?, ?, ?, ?, ?)', COLUMNS)
+    connection.executemany('INSERT INTO STATISTICS VALUES (?, ?, ?, ?, ?, ?, ?, ?)', STATISTICS)
+    connection.execute('CREATE TABLE TABLES (TABLE_SCHEMA, TABLE_NAME, ENGINE, TABLE_COLLATION, CREATE_OPTIONS)')
+    connection.execute('CREATE TABLE COLLATIONS (COLLATION_NAME, CHARACTER_SET_NAME, IS_DEFAULT)')
+    connection.execute('CREATE TABLE PARTITIONS (TABLE_SCHEMA, TABLE_NAME, PARTITION_NAME, PARTITION_ORDINAL_POSITION, '
+                       'PARTITION_METHOD, PARTITION_EXPRESSION, PARTITION_DESCRIPTION, SUBPARTITION_METHOD, '
+                       'SUBPARTITION_EXPRESSION, SUBPARTITION_ORDINAL_POSITION)')
+    connection.executemany('INSERT INTO KEY_COLUMN_USAGE VALUES (?, ?, ?, ?, ?, ?, ?)', KEY_COLUMN_USAGE)
+    connection.executemany('INSERT INTO TABLES VALUES (?, ?, ?, ?, ?)', TABLES)
+    connection.executemany('INSERT INTO COLLATIONS VALUES (?, ?, ?)', COLLATIONS)
+    connection.executemany('INSERT INTO PARTITIONS VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', PARTITIONS)
+    connection.commit()
+    connection.close()
+
+
+def remove_fake_server():
+    remove_temp_dir()
+
+
+class CountingConnection(object):
+    """ a connection to the fake server counting the queries run through it """
+    def __init__(self, counts):
+        self.connection = sqlite3.connect(':memory:', check_same_thread=False)
+        self.connection.execute("ATTACH DATABASE ? AS information_schema",
+                                (os.path.join(helpers.temp_dir, 'information_schema'),))
+        self.counts = counts
+
+    def cursor(self):
+        self.counts['queries'] = self.counts.get('queries', 0) + 1
+        return self.connection.cursor()
+
+    def close(self):
+        self.connection.close()
+
+
+def new_pool(size, counts):
+    def connect():
+        counts['connections'] = counts.get('connections', 0) + 1
+        return CountingConnection(counts)
+    return ConnectionPool(connect, size, 'qmark')
+
+
+@with_setup(make_fake_server, remove_fake_server)
+def test_introspected_tables_match_the_dump():
+    """The tables should be built as the parser builds them from the dump, fingerprints included"""
+    counts = {}
+    tables = introspect_schema(CountingConnection(counts), 'plays', paramstyle='qmark')
+    expected = analyse_dump_file(SCHEMA_DUMP)
+    del expected['plays_author']
+    # in the order of the names rather than of the dump
+    eq_(tables.keys(), sorted(expected))
+    eq_(dict(tables), dict(expected))
+    eq_(dict((name, table['fingerprint']) for name, table in tables.items()),
+        dict((name, table['fingerprint']) for name, table in expected.items()))
+    eq_(type(tables['plays_text']['fields']['status']['type']), str)
+    # set-based: one query per view, whatever the number of tables
+    eq_(counts['queries'], 5)
+
+
+@with_setup(make_fake_server, remove_fake_server)
+def test_introspected_options_and_partitions_match_the_dump():
+    tables = introspect_schema(CountingConnection({}), 'logs', paramstyle='qmark')
+    expected = analyse_file(StringIO(EVENT).readlines())
+    eq_(tables, expected)
+    eq_(tables['event']['options']['ROW_FORMAT'], 'COMPRESSED')
+    eq_([partition['name'] for partition in tables['event']['partitions']['partitions']], ['p2019', 'pmax'])
+
+
+@with_setup(make_fake_server, remove_fake_server)
+def test_introspection_is_filtered_by_prefix():
+    tables = introspect_schema(CountingConnection({}), 'plays', 'plays_text', paramstyle='qmark')
+    eq_(sorted(tables), ['plays_text', 'plays_text_sample'])
+    eq_(introspect_schema(CountingConnection({}), 'other', paramstyle='qmark')['auth_group']['fields']['id']['type'],
+        'int(10)')
+    eq_(introspect_schema(CountingConnection({}), 'missing', paramstyle='qmark'), {})
+
+
+@with_setup(make_fake_server, remove_fake_server)
+def test_schemas_share_the_pooled_connections():
+    """Many schemas should be introspected at once without opening more connections than the pool size"""
+    counts = {}
+    pool = new_pool(2, counts)
+    schemas = ['plays', 'other'] * 5
+    results = introspect_schemas(pool, schemas)
+    eq_([sorted(tables) for tables in results], [['auth_group', 'plays_text', 'plays_text_sample'], ['auth_group']] * 5)
+    assert counts['connections'] <= 2, counts
+    eq_(counts['queries'], 5 * len(schemas))
+    pool.close()
+    eq_(pool.opened, 0)
+
+
+def test_pool_waits_for_a_released_connection():
+    pool = ConnectionPool(object, 1)
+    connection = pool.acquire()
+    acquired = []
+    waiting = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+    waiting.start()
+    waiting.join(0.1)
+    eq_(acquired, [])
+    pool.release(connection)
+    waiting.join()
+    assert acquired[0] is connection
+
+
+@with_setup(make_fake_server, remove_fake_server)
+def test_database_compared_with_a_dump():
+    """The migration should bring the live schema to the dump"""
+    comp = CompDB()
+    sink = ListSink()
+    comp.set_output(sink)
+    comp.compare_database(new_pool(1, {}), 'plays', SCHEMA_DUMP)
+    eq_(sink.lines[0], 'CREATE TABLE `plays_author` (')
+    eq_(len([line for line in sink.lines if line.startswith('ALTER TABLE')]), 2)
@@ -0,0 +1,107 @@
+"""Tests for the ndjson format: one JSON change record per line."""
+import json
+import os
+import sys
+from StringIO import StringIO
+import compdb
+from compdb import CompDB, ListSink, analyse_file
+from nose.tools import eq_
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+SCHEMA_DUMP = os.path.join(FIXTURES, 'mysqldump_schema.sql')
+DJANGO_DUMP = os.path.join(FIXTURES, 'django_sql.sql')
+
+SOURCE = """CREATE TABLE `book` (
+  `id` int(11) NOT NULL,
+  `title` varchar(100) NOT NULL,
+  `isbn` varchar(13) NOT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `book_isbn` (`isbn`)
+);
+CREATE TABLE `tag` (
+  `id` int(11) NOT NULL,
+  PRIMARY KEY (`id`)
+);
+"""
+TARGET = """CREATE TABLE `book` (
+  `id` int(11) NOT NULL,
+  `title` varchar(200) NOT NULL,
+  `year` int(11) NOT NULL,
+  PRIMARY KEY (`id`)
+);
+CREATE TABLE `author` (
+  `id` int(11) NOT NULL,
+  PRIMARY KEY (`id`)
+);
+"""
+
+
+def records(source=SOURCE, target=TARGET, **options):
+    comp = CompDB()
+    for name, value in options.items():
+        getattr(comp, 'set_' + name)(value)
+    return list(comp.iter_change_records(analyse_file(StringIO(source).readlines()),
+                                         analyse_file(StringIO(target).readlines())))
+
+
+def test_records_of_the_changes():
+    eq_([(record['table'], record['object'], record['change'], record['destructive']) for record in records()],
+        [('book', 'column', 'modify', False), ('book', 'column', 'drop', True), ('book', 'column', 'add', False),
+         ('book', 'index', 'drop', True), ('tag', 'table', 'drop', True), ('author', 'table', 'create', False)])
+    modify, drop, add, index, dropped, created = records()
+    eq_(modify['before'], {'name': 'title', 'type': 'varchar(100)', 'nn': True, 'default': False, 'inc': False})
+    eq_(modify['after']['type'], 'varchar(200)')
+    eq_(modify['sql'], 'ALTER TABLE `book` MODIFY COLUMN `title` varchar(200) NOT NULL;')
+    eq_((drop['after'], add['before']), (None, None))
+    eq_(index['before'], {'name': 'book_isbn', 'fields': ['isbn']})
+    eq_((add['algorithm'], add['lock']), ('INSTANT', None))
+    eq_(dropped['before']['pk'], ['id'])
+    eq_([field['name'] for field in dropped['before']['fields']], ['id'])
+    assert created['sql'].startswith('CREATE TABLE `author` (\n') and created['sql'].endswith(');')
+
+
+def test_records_follow_the_options():
+    statements = [record['sql'] for record in records(no_removing=True) if record['destructive']]
+    assert all(statement.startswith('-- ') for statement in statements), statements
+    eq_(records(online_ddl=True)[0]['sql'],
+        'ALTER TABLE `book` MODIFY COLUMN `title` varchar(200) NOT NULL, ALGORITHM=COPY, LOCK=SHARED;')
+    renamed = records(SOURCE, SOURCE.replace('`tag`', '`label`'), detect_renames=True)
+    eq_([(record['change'], record['before']['name'], record['after']['name']) for record in renamed],
+        [('rename', 'tag', 'label')])
+    eq_(records(SOURCE, SOURCE), [])
+
+
+def test_one_json_object_per_line():
+    comp = CompDB()
+    comp.set_files(DJANGO_DUMP, SCHEMA_DUMP)
+    comp.set_format('ndjson')
+    sink = ListSink()
+    comp.set_output(sink)
+    comp.compare()
+    changes = [json.loads(line) for line in sink.lines]
+    assert changes
+    sql = CompDB()
+    sql.set_files(DJANGO_DUMP, SCHEMA_DUMP)
+    sql_sink = ListSink()
+    sql.set_output(sql_sink)
+    sql.compare()
+    # every statement of the SQL migration is in a record
+    statements = '\n'.join(change['sql'] for change in changes)
+    for line in sql_sink.lines:
+        if line and not line.startswith('--'):
+            assert line in statements, line
+
+
+def test_command_line_format():
+    argv = sys.argv
+    stdout = sys.stdout
+    try:
+        sys.argv = ['compdb.py', '--ndjson', DJANGO_DUMP, SCHEMA_DUMP]
+        sys.stdout = StringIO()
+        compdb.parse_cmd_line()
+        lines = sys.stdout.getvalue().splitlines()
+    finally:
+        sys.argv = argv
+        sys.stdout = stdout
+    eq_(sorted(set(json.loads(line)['table'] for line in lines)),
+        ['auth_group', 'plays_author', 'plays_text', 'plays_text_sample'])
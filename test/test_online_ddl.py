@@ -0,0 +1,140 @@
+"""Tests for the classification of the changes by InnoDB online DDL algorithm and the online schema changes."""
+import os
+from collections import OrderedDict
+from compdb import COPY, INPLACE, INSTANT, CompDB, Field, column_ddl, combine_ddl, compare_tables, \
+    iter_coalesced_alter, read_size_hints
+import helpers
+from helpers import make_temp_dir, parse, remove_temp_dir
+from nose.tools import eq_, raises, with_setup
+
+SOURCE = """CREATE TABLE `book` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `title` varchar(40) NOT NULL,
+  `status` enum('draft','published') NOT NULL,
+  PRIMARY KEY (`id`)
+);
+"""
+
+
+def algorithm(source_type, target_type, source_nn=True, target_nn=True):
+    return column_ddl(Field('a', source_type, source_nn), Field('a', target_type, target_nn))[0]
+
+
+def test_column_changes():
+    eq_(algorithm('int(11)', 'int(11)'), INSTANT)
+    eq_(algorithm("enum('a','b')", "enum('a','b','c')"), INSTANT)
+    eq_(algorithm("enum('a','b')", "enum('b','a','c')"), COPY)
+    eq_(algorithm("set('a')", "enum('a','b')"), COPY)
+    eq_(algorithm('varchar(20)', 'varchar(60)'), INPLACE)
+    eq_(algorithm('varchar(300)', 'varchar(1000)'), INPLACE)
+    # the length of the values no longer fits in a byte
+    eq_(algorithm('varchar(40)', 'varchar(100)'), COPY)
+    # in some character sets only, e.g. utf8, latin1 or ucs2: the character set of the column is not known
+    eq_(algorithm('varchar(70)', 'varchar(100)'), COPY)
+    eq_(algorithm('varchar(100)', 'varchar(255)'), COPY)
+    eq_(algorithm('varchar(100)', 'varchar(300)'), COPY)
+    eq_(algorithm('varchar(100)', 'varchar(200)'), COPY)
+    eq_(algorithm('varchar(60)', 'varchar(20)'), COPY)
+    eq_(algorithm('int(11)', 'bigint(20)'), COPY)
+    eq_(algorithm('int(11)', 'int(11)', source_nn=False), INPLACE)
+    eq_(column_ddl(Field('a', 'int(11)'), Field('a', 'int(11)', default='1')), (INSTANT, None))
+    eq_(column_ddl(Field('a', 'int(11)'), Field('a', 'int(11)', inc=True)), (COPY, 'SHARED'))
+
+
+def test_combined_changes():
+    eq_(combine_ddl([(INSTANT, None), (INSTANT, None)]), (INSTANT, None))
+    eq_(combine_ddl([(INSTANT, None), (INPLACE, 'NONE')]), (INPLACE, 'NONE'))
+    eq_(combine_ddl([(INPLACE, 'SHARED'), (INPLACE, 'NONE')]), (INPLACE, 'SHARED'))
+    eq_(combine_ddl([(COPY, 'SHARED'), (INSTANT, None)]), (COPY, 'SHARED'))
+
+
+def test_statements_end_with_their_algorithm():
+    source = parse(SOURCE)['book']
+    target = parse(SOURCE.replace("'published')", "'published','archived')")
+                   .replace('PRIMARY KEY', '`summary` text NOT NULL,\n  FULLTEXT KEY `book_summary` (`summary`),\n'
+                                           '  PRIMARY KEY'))['book']
+    eq_(compare_tables(source, target, '', online_ddl=True).splitlines(), [
+        "ALTER TABLE `book` MODIFY COLUMN `status` enum('draft','published','archived') NOT NULL, ALGORITHM=INSTANT;",
+        "ALTER TABLE `book` ADD COLUMN `summary` text NOT NULL AFTER `status`, ALGORITHM=INSTANT;",
+        "ALTER TABLE book ADD FULLTEXT KEY `book_summary` (summary), ALGORITHM=INPLACE, LOCK=SHARED;"])
+    eq_(list(iter_coalesced_alter(source, target, '', online_ddl=True))[-1].splitlines()[-1],
+        '\tALGORITHM=INPLACE, LOCK=SHARED;')
+    assert 'ALGORITHM' not in compare_tables(source, target, '')
+
+
+def test_longer_varchar_of_more_length_bytes_is_copied():
+    """A utf8 varchar(70) of 210 bytes has 1 length byte, a varchar(100) of 300 bytes 2"""
+    utf8 = SOURCE.replace('varchar(40)', 'varchar(70)').replace(');\n', ') ENGINE=InnoDB DEFAULT CHARSET=utf8;\n')
+    source = parse(utf8)['book']
+    target = parse(utf8.replace('varchar(70)', 'varchar(100)'))['book']
+    eq_(compare_tables(source, target, '', online_ddl=True).splitlines(),
+        ['ALTER TABLE `book` MODIFY COLUMN `title` varchar(100) NOT NULL, ALGORITHM=COPY, LOCK=SHARED;'])
+    eq_(list(iter_coalesced_alter(source, target, '', online_ddl=True))[-1].splitlines()[-1],
+        '\tALGORITHM=COPY, LOCK=SHARED;')
+
+
+def test_primary_key_changes():
+    source = parse(SOURCE)['book']
+    replaced = parse(SOURCE.replace('PRIMARY KEY (`id`)', 'PRIMARY KEY (`id`,`title`)'))['book']
+    # dropped in the same statement as its replacement, without a copy
+    eq_(compare_tables(source, replaced, '', online_ddl=True).splitlines(), [
+        'ALTER TABLE book DROP PRIMARY KEY, ADD PRIMARY KEY (%s), ALGORITHM=INPLACE, LOCK=NONE;' %
+        ', '.join(replaced['pk'])])
+    eq_(list(iter_coalesced_alter(source, replaced, '', online_ddl=True))[-1].splitlines()[-1],
+        '\tALGORITHM=INPLACE, LOCK=NONE;')
+    without = parse(SOURCE.replace(',\n  PRIMARY KEY (`id`)', ''))['book']
+    eq_(compare_tables(source, without, '', online_ddl=True).splitlines(),
+        ['ALTER TABLE book DROP PRIMARY KEY, ALGORITHM=COPY, LOCK=SHARED;'])
+    eq_(compare_tables(without, source, '', online_ddl=True).splitlines(),
+        ['ALTER TABLE book ADD PRIMARY KEY (id), ALGORITHM=INPLACE, LOCK=NONE;'])
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_size_hints():
+    file_name = os.path.join(helpers.temp_dir, 'sizes')
+    with open(file_name, 'w') as fd:
+        fd.write('# table sizes\n\nbook 200G\nshop.orders 1.5M\nlog 512\n')
+    eq_(read_size_hints(file_name), {(None, 'book'): 200 * 1024 ** 3, ('shop', 'orders'): 1572864,
+                                     (None, 'log'): 512})
+    with open(file_name, 'w') as fd:
+        fd.write('book\n')
+    raises(ValueError)(read_size_hints)(file_name)
+
+
+def test_copies_of_large_tables_use_an_online_schema_change():
+    """Only the changes of large tables which need a COPY should be left to the external tool"""
+    source = parse(SOURCE)
+    comp = CompDB()
+    comp.set_size_hints({('shop', 'book'): 10 * 1024 ** 3})
+    copied = parse(SOURCE.replace('varchar(40)', 'varchar(400)'))
+    eq_(list(comp.iter_migration(source, copied)), [
+        "-- pt-online-schema-change --alter 'MODIFY COLUMN `title` varchar(400) NOT NULL' D=shop,t=book --execute",
+        ''])
+    instant = parse(SOURCE.replace("'published')", "'published','archived')"))
+    assert list(comp.iter_migration(source, instant))[0].startswith('ALTER TABLE `book` MODIFY COLUMN `status`')
+    comp.set_size_hints({('shop', 'book'): 10 * 1024 ** 2})
+    assert list(comp.iter_migration(source, copied))[0].startswith('ALTER TABLE `book` MODIFY COLUMN `title`')
+
+
+def test_size_hints_of_each_database():
+    """The hints of the tables of the same name in two databases should apply to their database only"""
+    source = parse(SOURCE)
+    copied = parse(SOURCE.replace('varchar(40)', 'varchar(400)'))
+    comp = CompDB()
+    comp.set_size_hints({('shop', 'book'): 200 * 1024 ** 3, ('blog', 'book'): 1024})
+    databases = ('shop', 'blog', 'wiki')
+    migration = list(comp.iter_database_migration(OrderedDict((database, source) for database in databases),
+                                                  OrderedDict((database, copied) for database in databases)))
+    eq_(migration[:3], [
+        'USE `shop`;',
+        "-- pt-online-schema-change --alter 'MODIFY COLUMN `title` varchar(400) NOT NULL' D=shop,t=book --execute",
+        ''])
+    eq_(migration[3:5], ['USE `blog`;', 'ALTER TABLE `book` MODIFY COLUMN `title` varchar(400) NOT NULL;'])
+    assert 'pt-online-schema-change' not in '\n'.join(migration[3:])
+    # the hints without database apply to the tables of every database
+    comp.set_size_hints({(None, 'book'): 200 * 1024 ** 3, ('blog', 'book'): 1024})
+    databases = ('blog', 'wiki')
+    migration = list(comp.iter_database_migration(OrderedDict((database, source) for database in databases),
+                                                  OrderedDict((database, copied) for database in databases)))
+    assert 'pt-online-schema-change' not in migration[1]
+    assert 'D=wiki,t=book' in migration[-2]
@@ -0,0 +1,88 @@
+"""Tests for the streaming of the migration statements to the output sinks."""
+import os
+import sys
+import types
+from StringIO import StringIO
+from compdb import CompDB, FileSink, ListSink, StdoutSink, analyse_dump_file, compare_tables, \
+    iter_compare_tables
+from nose.tools import eq_
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+SCHEMA_DUMP = os.path.join(FIXTURES, 'mysqldump_schema.sql')
+DJANGO_DUMP = os.path.join(FIXTURES, 'django_sql.sql')
+
+
+def new_comp(source_file_name, target_file_name):
+    comp = CompDB()
+    comp.set_files(source_file_name, target_file_name)
+    comp.no_foreign_key = False
+    return comp
+
+
+class CountingFile(StringIO):
+    def __init__(self):
+        StringIO.__init__(self)
+        self.writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        StringIO.write(self, data)
+
+
+def test_compare_tables_joins_the_streamed_statements():
+    """compare_tables should give the lines of iter_compare_tables, which yields them lazily"""
+    source = analyse_dump_file(SCHEMA_DUMP)['plays_text']
+    target = analyse_dump_file(DJANGO_DUMP)['plays_text']
+    statements = iter_compare_tables(source, target, '')
+    assert isinstance(statements, types.GeneratorType)
+    first = next(statements)
+    lines = [first] + list(statements)
+    eq_(compare_tables(source, target, ''), ''.join(line + '\n' for line in lines))
+
+
+def test_sinks_receive_the_printed_output():
+    """The list and file sinks should get the lines written to the standard output"""
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        new_comp(SCHEMA_DUMP, DJANGO_DUMP).compare()
+        printed = sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+    assert printed
+    comp = new_comp(SCHEMA_DUMP, DJANGO_DUMP)
+    sink = ListSink()
+    comp.set_output(sink)
+    comp.compare()
+    eq_(''.join(line + '\n' for line in sink.lines), printed)
+    fd = StringIO()
+    comp.set_output(FileSink(fd, buffer_size=1))
+    comp.compare()
+    eq_(fd.getvalue(), printed)
+
+
+def test_file_sink_buffers_its_writes():
+    """Lines should only be written once buffer_size bytes are pending, or on flush"""
+    fd = CountingFile()
+    sink = FileSink(fd, buffer_size=12)
+    sink.write('12345')
+    sink.write('123')
+    eq_(fd.writes, 0)
+    sink.write('1')
+    eq_(fd.writes, 1)
+    sink.write('last')
+    sink.flush()
+    eq_(fd.writes, 2)
+    eq_(fd.getvalue(), '12345\n123\n1\nlast\n')
+
+
+def test_stdout_sink_writes_to_the_current_standard_output():
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        sink = StdoutSink()
+        sink.write('SELECT 1;')
+        sink.flush()
+        eq_(sys.stdout.getvalue(), 'SELECT 1;\n')
+    finally:
+        sys.stdout = stdout
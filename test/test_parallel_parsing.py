@@ -0,0 +1,54 @@
+"""Tests for the parallel parsing of dumps, split in chunks at their CREATE TABLE statements."""
+import io
+import mmap
+import os
+from compdb import analyse_chunk, analyse_dump_file, analyse_dump_files, find_chunks, merge_chunks
+from nose.tools import eq_
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+FIXTURE_FILES = [os.path.join(FIXTURES, name)
+                 for name in ('mysqldump_schema.sql', 'mysqldump_full.sql', 'django_sql.sql')]
+
+
+def chunks_of(file_name, count):
+    with io.open(file_name, 'rb') as fd:
+        mapped = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return find_chunks(mapped, count, 1), mapped[:]
+        finally:
+            mapped.close()
+
+
+def test_chunks_start_at_create_table_statements():
+    """Chunks should cover the whole dump, every one but the first
+    starting with a CREATE TABLE statement"""
+    chunks, data = chunks_of(FIXTURE_FILES[0], 3)
+    eq_(len(chunks), 3)
+    eq_(chunks[0][0], 0)
+    eq_(chunks[-1][1], len(data))
+    for (start, stop), (next_start, next_stop) in zip(chunks, chunks[1:]):
+        eq_(stop, next_start)
+        assert data[next_start:].startswith('CREATE TABLE `'), data[next_start:next_start + 20]
+
+
+def check_merged_chunks(file_name, count):
+    chunks, data = chunks_of(file_name, count)
+    merged = merge_chunks(analyse_chunk(file_name, start, stop) for start, stop in chunks)
+    eq_(merged, analyse_dump_file(file_name))
+
+
+def test_merged_chunks_give_the_tables_of_the_whole_dump():
+    """Whatever the number of chunks, the merged tables should be the ones of
+    the dump parsed in one go, out-of-line foreign keys of the django output
+    being attached to tables of the previous chunks"""
+    for file_name in FIXTURE_FILES:
+        for count in (1, 2, 4, 10):
+            yield check_merged_chunks, file_name, count
+
+
+def test_files_are_parsed_in_a_pool():
+    """Parsing the files with several processes should give the same tables"""
+    expected = [analyse_dump_file(file_name) for file_name in FIXTURE_FILES]
+    eq_(analyse_dump_files(FIXTURE_FILES, jobs=3, min_chunk_size=1), expected)
+    eq_(analyse_dump_files(FIXTURE_FILES, table_prefix='plays_text', jobs=2, min_chunk_size=1),
+        [analyse_dump_file(file_name, 'plays_text') for file_name in FIXTURE_FILES])
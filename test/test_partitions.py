@@ -0,0 +1,157 @@
+"""Tests for the table options and the partitions, parsed and changed partition by partition."""
+import json
+import os
+from compdb import CompDB, ListSink, Partition, Partitioning, SchemaStore, compare_tables, \
+    parse_dump_files, store_dump_file
+import helpers
+from helpers import make_temp_dir, parse, remove_temp_dir
+from nose.tools import eq_, with_setup
+
+EVENT = """CREATE TABLE `event` (
+  `id` int(11) NOT NULL,
+  `created` date NOT NULL,
+  PRIMARY KEY (`id`,`created`)
+) ENGINE=InnoDB AUTO_INCREMENT=42 DEFAULT CHARSET=utf8mb4 COMMENT='ENGINE=MyISAM'
+/*!50100 PARTITION BY RANGE (year(`created`))
+(PARTITION p2019 VALUES LESS THAN (2020) ENGINE = InnoDB,
+ PARTITION p2020 VALUES LESS THAN (2021) ENGINE = InnoDB,
+ PARTITION pmax VALUES LESS THAN MAXVALUE ENGINE = InnoDB) */;
+CREATE TABLE `session` (
+  `id` int(11) NOT NULL,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+/*!50100 PARTITION BY HASH (`id`)
+PARTITIONS 4 */;
+"""
+
+P2021 = " PARTITION p2021 VALUES LESS THAN (2022) ENGINE = InnoDB,\n"
+
+
+def changes(source, target, table_name='event', **options):
+    return compare_tables(parse(source)[table_name], parse(target)[table_name], '-- ', **options).splitlines()
+
+
+def test_partitions_and_options_are_parsed():
+    for parser in ('tokenizer', 'legacy'):
+        tables = parse(EVENT, parser)
+        eq_(tables['event']['options'], {'ENGINE': 'InnoDB', 'DEFAULT CHARSET': 'utf8mb4'})
+        eq_(tables['event']['partitions'], Partitioning('RANGE', 'year(created)', 3, None, [
+            Partition('p2019', 'LESS THAN (2020)'), Partition('p2020', 'LESS THAN (2021)'),
+            Partition('pmax', 'LESS THAN MAXVALUE')]))
+        eq_(tables['session']['partitions'], Partitioning('HASH', 'id', 4))
+        eq_(sorted(tables['event']['fields']), ['created', 'id'])
+    # on the line of the closing parenthesis, without the version comment
+    one_line = parse("CREATE TABLE `t` (\n  `id` int(11) NOT NULL\n) ENGINE=InnoDB ROW_FORMAT=compressed "
+                     "KEY_BLOCK_SIZE=8 PARTITION BY LIST COLUMNS(`id`) (PARTITION a VALUES IN (1, 2), "
+                     "PARTITION b VALUES IN (3));\n")['t']
+    eq_(one_line['options'], {'ENGINE': 'InnoDB', 'ROW_FORMAT': 'COMPRESSED', 'KEY_BLOCK_SIZE': '8'})
+    eq_(one_line['partitions'], Partitioning('LIST COLUMNS', 'id', 2, None, [
+        Partition('a', 'IN (1,2)'), Partition('b', 'IN (3)')]))
+    # the AUTO_INCREMENT counter is not part of the definition
+    eq_(parse(EVENT.replace('AUTO_INCREMENT=42', 'AUTO_INCREMENT=1337'))['event']['fingerprint'],
+        parse(EVENT)['event']['fingerprint'])
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_partitions_of_the_chunks_and_stores():
+    file_name = os.path.join(helpers.temp_dir, 'events.sql')
+    with open(file_name, 'w') as fd:
+        fd.write(EVENT + EVENT.replace('`event`', '`event_2`').replace('`session`', '`session_2`'))
+    expected = parse(open(file_name).read())
+    eq_(parse_dump_files([file_name], jobs=2, min_chunk_size=1), [expected])
+    store_dump_file(file_name, os.path.join(helpers.temp_dir, 'store'))
+    store = SchemaStore(os.path.join(helpers.temp_dir, 'store'))
+    eq_(dict((table['name'], table) for table in store.iter_tables()), expected)
+    store.close()
+
+
+def test_partitions_are_changed_one_by_one():
+    # a new year splits the MAXVALUE partition
+    eq_(changes(EVENT, EVENT.replace(" PARTITION pmax", P2021 + " PARTITION pmax")),
+        ['ALTER TABLE `event` REORGANIZE PARTITION pmax INTO (PARTITION p2021 VALUES LESS THAN (2022), '
+         'PARTITION pmax VALUES LESS THAN MAXVALUE);'])
+    without_maxvalue = EVENT.replace(",\n PARTITION pmax VALUES LESS THAN MAXVALUE ENGINE = InnoDB", '')
+    eq_(changes(without_maxvalue, without_maxvalue.replace(" ENGINE = InnoDB) */", " ENGINE = InnoDB,\n" + P2021 +
+                                                           ") */")),
+        ['ALTER TABLE `event` ADD PARTITION (PARTITION p2021 VALUES LESS THAN (2022));'])
+    # the oldest year is dropped, commented out as it loses its rows
+    eq_(changes(EVENT, EVENT.replace("(PARTITION p2019 VALUES LESS THAN (2020) ENGINE = InnoDB,\n PARTITION",
+                                     "(PARTITION")),
+        ['-- ALTER TABLE `event` DROP PARTITION p2019;'])
+    eq_(changes(EVENT, EVENT.replace('PARTITIONS 4', 'PARTITIONS 6'), 'session'),
+        ['ALTER TABLE `session` ADD PARTITION PARTITIONS 2;'])
+    eq_(changes(EVENT, EVENT.replace('PARTITIONS 4', 'PARTITIONS 3'), 'session', online_ddl=True),
+        ['ALTER TABLE `session` COALESCE PARTITION 1, ALGORITHM=INPLACE, LOCK=SHARED;'])
+
+
+def test_reorganized_partitions_keep_their_range():
+    # a moved bound is reorganized with the partitions up to the next bound in both tables
+    eq_(changes(EVENT, EVENT.replace('p2020 VALUES LESS THAN (2021)', 'p2020 VALUES LESS THAN (2022)')),
+        ['ALTER TABLE `event` REORGANIZE PARTITION p2020, pmax INTO (PARTITION p2020 VALUES LESS THAN (2022), '
+         'PARTITION pmax VALUES LESS THAN MAXVALUE);'])
+    eq_(changes(EVENT, EVENT.replace('p2019 VALUES LESS THAN (2020)', 'p2019 VALUES LESS THAN (2019)')),
+        ['ALTER TABLE `event` REORGANIZE PARTITION p2019, p2020 INTO (PARTITION p2019 VALUES LESS THAN (2019), '
+         'PARTITION p2020 VALUES LESS THAN (2021));'])
+    # the last partition can change its range on its own
+    without_maxvalue = EVENT.replace(",\n PARTITION pmax VALUES LESS THAN MAXVALUE ENGINE = InnoDB", '')
+    eq_(changes(without_maxvalue, without_maxvalue.replace('LESS THAN (2021)', 'LESS THAN (2022)')),
+        ['ALTER TABLE `event` REORGANIZE PARTITION p2020 INTO (PARTITION p2020 VALUES LESS THAN (2022));'])
+    # LIST partitions up to the same values
+    listed = without_maxvalue.replace('RANGE (', 'LIST (').replace('LESS THAN (2020)', 'IN (2019,2020)') \
+        .replace('LESS THAN (2021)', 'IN (2021)')
+    eq_(changes(listed, listed.replace('IN (2019,2020)', 'IN (2019)').replace('IN (2021)', 'IN (2020,2021)')),
+        ['ALTER TABLE `event` REORGANIZE PARTITION p2019, p2020 INTO (PARTITION p2019 VALUES IN (2019), '
+         'PARTITION p2020 VALUES IN (2020,2021));'])
+
+
+def test_whole_table_repartitions():
+    unpartitioned = EVENT.replace(EVENT[EVENT.index('\n/*!50100'):EVENT.index(' */;')], '').replace(' */;', ';', 1)
+    eq_(changes(EVENT, unpartitioned), ['ALTER TABLE `event` REMOVE PARTITIONING;'])
+    eq_(changes(unpartitioned, EVENT), [
+        'ALTER TABLE `event` PARTITION BY RANGE (year(created)) (PARTITION p2019 VALUES LESS THAN (2020), '
+        'PARTITION p2020 VALUES LESS THAN (2021), PARTITION pmax VALUES LESS THAN MAXVALUE);'])
+    eq_(changes(EVENT, EVENT.replace('HASH (`id`)', 'KEY (`id`)'), 'session'),
+        ['ALTER TABLE `session` PARTITION BY KEY (id) PARTITIONS 4;'])
+    # the same partitioning in the dumps of other MySQL versions
+    eq_(changes(EVENT, EVENT.replace('/*!50100 PARTITION BY RANGE (year(`created`))',
+                                     '/*!50100 PARTITION BY RANGE  (year(created))')), [])
+
+
+def test_storage_format_drift():
+    compressed = EVENT.replace('DEFAULT CHARSET=utf8mb4 COMMENT',
+                               'DEFAULT CHARSET=utf8mb4 ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8 COMMENT')
+    eq_(changes(EVENT, compressed), ['ALTER TABLE `event` ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8;'])
+    eq_(changes(compressed, EVENT), ['ALTER TABLE `event` ROW_FORMAT=DEFAULT KEY_BLOCK_SIZE=0;'])
+    eq_(changes(EVENT, EVENT.replace('ENGINE=InnoDB AUTO', 'ENGINE=MyISAM AUTO'), online_ddl=True),
+        ['ALTER TABLE `event` ENGINE=MyISAM, ALGORITHM=COPY, LOCK=SHARED;'])
+    # the options are only compared when both tables declare theirs, e.g. not with Django
+    django = EVENT[:EVENT.index(') ENGINE')] + ');\n'
+    eq_(changes(django, compressed), changes(django, EVENT))
+
+
+def migration(source, target, **options):
+    comp = CompDB()
+    for name, value in options.items():
+        getattr(comp, 'set_' + name)(value)
+    sink = ListSink()
+    comp.set_output(sink)
+    comp._write(comp.iter_output(parse(source), parse(target)))
+    return sink.lines
+
+
+def test_migration_formats():
+    target = EVENT.replace('`id` int(11) NOT NULL,\n  `created`', '`id` bigint NOT NULL,\n  `created`') \
+        .replace('DEFAULT CHARSET=utf8mb4 COMMENT', 'DEFAULT CHARSET=utf8mb4 ROW_FORMAT=DYNAMIC COMMENT') \
+        .replace(" PARTITION pmax", P2021 + " PARTITION pmax")
+    # the partitions are changed by statements of their own
+    eq_(migration(EVENT, target, coalesce=True), [
+        'ALTER TABLE `event`\n\tMODIFY COLUMN `id` bigint NOT NULL,\n\tROW_FORMAT=DYNAMIC;',
+        'ALTER TABLE `event` REORGANIZE PARTITION pmax INTO (PARTITION p2021 VALUES LESS THAN (2022), '
+        'PARTITION pmax VALUES LESS THAN MAXVALUE);', ''])
+    records = [json.loads(line) for line in migration(EVENT, target, format='ndjson')]
+    eq_([(record['object'], record['change']) for record in records],
+        [('column', 'modify'), ('table options', 'modify'), ('partition', 'modify')])
+    eq_([partition['name'] for partition in records[-1]['after']], ['p2021', 'pmax'])
+    # created with their options and partitions
+    created = migration('', EVENT)
+    assert ') ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 PARTITION BY HASH (id) PARTITIONS 4;' in created, created
@@ -0,0 +1,91 @@
+"""Tests for the detection of the renamed tables and columns."""
+import time
+from StringIO import StringIO
+from bench.synthetic import generate_schema, iter_dump_lines
+from compdb import CompDB, analyse_file, compare_tables, find_table_renames
+from helpers import parse
+from nose.tools import eq_
+
+AUTHOR = """CREATE TABLE `%s` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `%s` varchar(100) NOT NULL,
+  `born` date DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `author_name` (`%s`)
+);
+"""
+BOOK = """CREATE TABLE `book` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `author_id` int(11) NOT NULL,
+  PRIMARY KEY (`id`),
+  CONSTRAINT `book_author` FOREIGN KEY (`author_id`) REFERENCES `%s` (`id`)
+);
+"""
+TAG = """CREATE TABLE `%s` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `%s` varchar(20) NOT NULL,
+  PRIMARY KEY (`id`)
+);
+"""
+
+
+def migration(source_dump, target_dump, detect_renames=True):
+    comp = CompDB()
+    comp.no_foreign_key = False
+    comp.set_detect_renames(detect_renames)
+    return list(comp.iter_migration(parse(source_dump), parse(target_dump)))
+
+
+def test_renamed_table_is_not_dropped():
+    """The foreign keys referencing the renamed table should not be recreated either"""
+    source = AUTHOR % ('author', 'name', 'name') + BOOK % 'author'
+    target = AUTHOR % ('writer', 'name', 'name') + BOOK % 'writer'
+    eq_(migration(source, target), ['RENAME TABLE `author` TO `writer`;'])
+    statements = migration(source, target, detect_renames=False)
+    assert 'DROP TABLE `author`;' in statements, statements
+
+
+def test_renamed_table_with_a_renamed_column():
+    source = AUTHOR % ('author', 'name', 'name')
+    target = AUTHOR % ('writer', 'full_name', 'full_name')
+    eq_(migration(source, target), ['RENAME TABLE `author` TO `writer`;',
+                                    'ALTER TABLE `writer` CHANGE COLUMN `name` `full_name` varchar(100) NOT NULL;',
+                                    ''])
+
+
+def test_renamed_column_keeps_its_keys():
+    """The unique key should follow the renamed column instead of being rebuilt"""
+    source = parse(AUTHOR % ('author', 'name', 'name'))['author']
+    target = parse(AUTHOR % ('author', 'full_name', 'full_name'))['author']
+    eq_(compare_tables(source, target, '', detect_renames=True),
+        'ALTER TABLE `author` CHANGE COLUMN `name` `full_name` varchar(100) NOT NULL;\n')
+    assert 'DROP COLUMN `name`' in compare_tables(source, target, '')
+
+
+def test_columns_of_other_definitions_are_not_renamed():
+    source = parse(TAG % ('tag', 'label'))['tag']
+    target = parse((TAG % ('tag', 'title')).replace('varchar(20)', 'varchar(40)'))['tag']
+    eq_(compare_tables(source, target, '', detect_renames=True),
+        'ALTER TABLE `tag` DROP COLUMN `label`;\n'
+        'ALTER TABLE `tag` ADD COLUMN `title` varchar(40) NOT NULL AFTER `id`;\n')
+
+
+def test_alike_tables_are_paired_by_name():
+    """Tables of the same structure should be paired with the closest ones"""
+    source = parse(TAG % ('tag', 'name') + TAG % ('label', 'name') + TAG % ('category', 'name'))
+    target = parse(TAG % ('blog_label', 'name') + TAG % ('blog_tag', 'name') + TAG % ('other', 'title'))
+    eq_(dict(find_table_renames(source, target)), {'tag': 'blog_tag', 'label': 'blog_label', 'category': 'other'})
+
+
+def test_renames_are_found_in_large_schemas():
+    """The candidates are indexed: thousands of renamed tables should be paired quickly"""
+    schema = generate_schema(3000, columns=8, seed=5)
+    source = analyse_file(StringIO(''.join(iter_dump_lines(schema))))
+    target = dict((name.replace('table_', 'renamed_'), table) for name, table in source.items())
+    for name, table in target.items():
+        table['name'] = name
+    start = time.time()
+    renames = find_table_renames(source, target)
+    assert time.time() - start < 10
+    eq_(len(renames), 3000)
+    eq_(len([old for old, new in renames.items() if new != old.replace('table_', 'renamed_')]), 0)
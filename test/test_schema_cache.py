@@ -0,0 +1,119 @@
+"""Tests for the on-disk cache of the parsed schemas."""
+import copy
+import os
+import shutil
+from bench.synthetic import generate_schema, write_dump
+from compdb import CompDB, ListSink, SchemaCache, analyse_dump_file, analyse_dump_files
+import helpers
+from helpers import make_temp_dir, remove_temp_dir
+from nose.tools import eq_, with_setup
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+SCHEMA_DUMP = os.path.join(FIXTURES, 'mysqldump_schema.sql')
+
+
+def copy_fixture(name):
+    file_name = os.path.join(helpers.temp_dir, name)
+    shutil.copyfile(SCHEMA_DUMP, file_name)
+    return file_name
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_cached_tables_are_the_parsed_ones():
+    """A cache miss should parse and store the tables, a hit return them unchanged"""
+    cache = SchemaCache(os.path.join(helpers.temp_dir, 'cache'))
+    key = cache.key(SCHEMA_DUMP)
+    eq_(cache.get(key), None)
+    expected = analyse_dump_file(SCHEMA_DUMP)
+    eq_(analyse_dump_files([SCHEMA_DUMP], cache=cache), [expected])
+    eq_(cache.get(key), expected)
+    eq_(analyse_dump_files([SCHEMA_DUMP], cache=cache), [expected])
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_cache_hit_skips_parsing():
+    """The stored tables should be returned without reading the dump again"""
+    cache = SchemaCache(os.path.join(helpers.temp_dir, 'cache'))
+    cache.put(cache.key(SCHEMA_DUMP), {'cached': True})
+    eq_(analyse_dump_files([SCHEMA_DUMP], cache=cache), [{'cached': True}])
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_key_follows_content_parser_and_prefix():
+    """Files with the same content share their key, which changes with
+    the content, the parser and the table prefix"""
+    cache = SchemaCache(os.path.join(helpers.temp_dir, 'cache'))
+    file_name = copy_fixture('copy.sql')
+    key = cache.key(file_name)
+    eq_(key, cache.key(SCHEMA_DUMP))
+    assert cache.key(file_name, 'plays_') != key
+    assert cache.key(file_name, parser='legacy') != key
+    # modified in place, with the same size and modification time
+    stat = os.stat(file_name)
+    with open(file_name, 'r+b') as fd:
+        fd.write(b'/* */')
+    os.utime(file_name, (stat.st_atime, stat.st_mtime))
+    assert cache.key(file_name) != key
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_least_recently_used_entries_are_evicted():
+    """Once over its maximum size, the cache should drop its oldest entries first"""
+    cache = SchemaCache(os.path.join(helpers.temp_dir, 'cache'))
+    cache.put('old', {})
+    entry_size = os.path.getsize(cache.path('old'))
+    cache.max_size = 0
+    cache.evict()
+    eq_(cache.get('old'), None)
+    cache.max_size = 2 * entry_size
+    cache.put('first', {})
+    cache.put('second', {})
+    os.utime(cache.path('first'), (0, 0))
+    os.utime(cache.path('second'), (1, 1))
+    eq_(cache.get('first'), {})
+    cache.put('third', {})
+    eq_(cache.get('second'), None)
+    eq_(cache.get('first'), {})
+    eq_(cache.get('third'), {})
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_corrupted_entries_are_misses():
+    """A truncated entry should be removed and reported as missing"""
+    cache = SchemaCache(os.path.join(helpers.temp_dir, 'cache'))
+    with open(cache.path('broken'), 'wb') as fd:
+        fd.write(b'not a schema')
+    eq_(cache.get('broken'), None)
+    assert not os.path.exists(cache.path('broken'))
+
+
+def compared(source_file_name, target_file_name, incremental=False, **options):
+    comp = CompDB()
+    comp.set_files(source_file_name, target_file_name)
+    comp.incremental = incremental
+    for name, value in options.items():
+        getattr(comp, 'set_' + name)(value)
+    sink = ListSink()
+    comp.set_output(sink)
+    comp.compare()
+    return sink.lines
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_every_mode_gives_the_same_migration():
+    """The tables should keep the order of the dump through the cache, the
+    chunks, the index and the store, and the migration be the same text"""
+    schema = generate_schema(300, columns=4, seed=5)
+    changed = copy.deepcopy(schema)
+    for table in changed[::7]:
+        table['columns'].append(('extra', 'int(11)', 'NOT NULL'))
+    del changed[3]
+    source, target = [os.path.join(helpers.temp_dir, name) for name in ('source.sql', 'target.sql')]
+    write_dump(schema, source)
+    write_dump(changed, target)
+    expected = compared(source, target)
+    eq_(len(expected), 2 * len(changed[::7]) + 1)
+    cache = os.path.join(helpers.temp_dir, 'cache')
+    for options in ({'cache': cache}, {'cache': cache}, {'jobs': 2}, {'incremental': True}, {'incremental': True},
+                    {'store_dir': os.path.join(helpers.temp_dir, 'stores')}):
+        eq_(compared(source, target, **options), expected)
@@ -0,0 +1,140 @@
+"""Tests for the content-addressed SchemaHistory of the versions of a schema."""
+import os
+import sys
+from StringIO import StringIO
+import compdb
+from compdb import CompDB, ListSink, SchemaHistory, analyse_dump_file
+import helpers
+from helpers import make_temp_dir, parse, remove_temp_dir
+from nose.tools import eq_, raises, with_setup
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+SCHEMA_DUMP = os.path.join(FIXTURES, 'mysqldump_schema.sql')
+DJANGO_DUMP = os.path.join(FIXTURES, 'django_sql.sql')
+FULL_DUMP = os.path.join(FIXTURES, 'mysqldump_full.sql')
+
+BOOK = """CREATE TABLE `book` (
+  `id` int(11) NOT NULL,
+  `title` varchar(200) NOT NULL,
+  PRIMARY KEY (`id`)
+);
+"""
+AUTHOR = """CREATE TABLE `author` (
+  `id` int(11) NOT NULL,
+  PRIMARY KEY (`id`)
+);
+"""
+
+
+def object_count(history):
+    return sum(len(files) for path, directories, files in os.walk(os.path.join(history.directory, 'objects')))
+
+
+class CountingHistory(SchemaHistory):
+    loaded = 0
+
+    def load_table(self, table_name, fingerprint):
+        CountingHistory.loaded += 1
+        return SchemaHistory.load_table(self, table_name, fingerprint)
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_table_definitions_are_stored_once():
+    history = SchemaHistory(helpers.temp_dir)
+    eq_(history.add_version('1.0', parse(BOOK)), 1)
+    # the same definition under another name is the same object
+    eq_(history.add_version('1.1', parse(BOOK + AUTHOR.replace('`id`', '`book_id`'))), 1)
+    eq_(history.add_version('1.2', parse(BOOK + AUTHOR)), 1)
+    eq_(history.add_version('1.3', parse(BOOK.replace('`title`', '`name`') + AUTHOR)), 1)
+    eq_(object_count(history), 4)
+    eq_(history.versions(), ['1.0', '1.1', '1.2', '1.3'])
+    eq_(list(history.manifest('1.2')), ['author', 'book'])
+    eq_(history.manifest('1.2')['book'], history.manifest('1.0')['book'])
+    for file_name in (SCHEMA_DUMP, DJANGO_DUMP):
+        history.add_version('dump', analyse_dump_file(file_name))
+        eq_(SchemaHistory(helpers.temp_dir).load_version('dump'), analyse_dump_file(file_name))
+    eq_(SchemaHistory(helpers.temp_dir).versions(), ['1.0', '1.1', '1.2', '1.3', 'dump'])
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_only_the_changed_tables_are_compared():
+    history = CountingHistory(helpers.temp_dir)
+    history.add_version('django', analyse_dump_file(DJANGO_DUMP))
+    history.add_version('schema', analyse_dump_file(SCHEMA_DUMP))
+    history.add_version('full', analyse_dump_file(FULL_DUMP))
+    for source, target, old_version, new_version in ((DJANGO_DUMP, SCHEMA_DUMP, 'django', 'schema'),
+                                                     (SCHEMA_DUMP, DJANGO_DUMP, 'schema', 'django')):
+        comp = CompDB()
+        eq_(sorted(comp.iter_history_migration(history, old_version, new_version)),
+            sorted(comp.iter_migration(analyse_dump_file(source), analyse_dump_file(target))))
+    CountingHistory.loaded = 0
+    eq_(list(CompDB().iter_history_migration(history, 'schema', 'full')), [])
+    eq_(CountingHistory.loaded, 0)
+    history.add_version('book', parse(BOOK + AUTHOR))
+    history.add_version('title', parse(BOOK.replace('200', '300') + AUTHOR))
+    eq_(list(CompDB().iter_history_migration(history, 'book', 'title')),
+        ['ALTER TABLE `book` MODIFY COLUMN `title` varchar(300) NOT NULL;', ''])
+    eq_(CountingHistory.loaded, 2)
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_first_version_of_a_column():
+    history = CountingHistory(helpers.temp_dir)
+    history.add_version('1', parse(AUTHOR))
+    history.add_version('2', parse(AUTHOR + BOOK.replace("  `title` varchar(200) NOT NULL,\n", '')))
+    history.add_version('3', parse(AUTHOR + BOOK.replace("  `title` varchar(200) NOT NULL,\n", '')))
+    history.add_version('4', parse(AUTHOR + BOOK))
+    history.add_version('5', parse(AUTHOR))
+    history.add_version('6', parse(AUTHOR + BOOK))
+    eq_(list(history.iter_table_versions('book')), [('2', history.manifest('2')['book']),
+                                                    ('4', history.manifest('4')['book']), ('5', None),
+                                                    ('6', history.manifest('4')['book'])])
+    CountingHistory.loaded = 0
+    eq_(history.first_version('book'), '2')
+    eq_(CountingHistory.loaded, 0)
+    eq_(history.first_version('book', 'title'), '4')
+    eq_(CountingHistory.loaded, 2)
+    eq_(history.first_version('author', 'name'), None)
+    eq_(history.first_version('tag'), None)
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_version_names():
+    history = SchemaHistory(helpers.temp_dir)
+    raises(ValueError)(history.add_version)('../1.0', parse(BOOK))
+    raises(ValueError)(history.add_version)('.hidden', parse(BOOK))
+    raises(ValueError)(history.manifest)('1.0')
+    history.add_version('v1.0-rc+1', parse(BOOK))
+    history.add_version('v1.0-rc+1', parse(AUTHOR))
+    eq_(history.versions(), ['v1.0-rc+1'])
+    eq_(list(history.load_version('v1.0-rc+1')), ['author'])
+
+
+def run(*args):
+    argv = sys.argv
+    stdout = sys.stdout
+    try:
+        sys.argv = ['compdb.py', '--history=%s' % helpers.temp_dir] + list(args)
+        sys.stdout = StringIO()
+        compdb.parse_cmd_line()
+        return sys.stdout.getvalue()
+    finally:
+        sys.argv = argv
+        sys.stdout = stdout
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_command_line_history():
+    eq_(run('--add-version=1.0', DJANGO_DUMP), '')
+    eq_(run('-j', '2', '--add-version=2.0', SCHEMA_DUMP), '')
+    eq_(run(), '1.0\n2.0\n')
+    output = run('1.0', '2.0')
+    comp = CompDB()
+    comp.set_files(DJANGO_DUMP, SCHEMA_DUMP)
+    sink = ListSink()
+    comp.set_output(sink)
+    comp.compare()
+    eq_(sorted(output.splitlines()), sorted('\n'.join(sink.lines).splitlines()))
+    eq_(run('--first-version=plays_author.biography'), '1.0\n')
+    raises(SystemExit)(run)('--first-version=plays_author.missing')
+    raises(SystemExit)(run)('1.0', '3.0')
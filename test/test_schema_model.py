@@ -0,0 +1,123 @@
+"""Tests for the slotted Table, Field and Key objects produced by the parsers."""
+import os
+import pickle
+from collections import OrderedDict
+from bench.memory import load_tables
+from bench.synthetic import generate_schema, write_dump
+from compdb import Field, Fields, ForeignKey, Key, Table, analyse_dump_file, analyse_file, compare_tables
+import helpers
+from helpers import make_temp_dir, remove_temp_dir
+from nose.tools import eq_, raises, with_setup
+
+SAMPLE_TABLES = """CREATE TABLE `first` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `label` varchar(255) NOT NULL DEFAULT 'none',
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `label` (`label`)
+) ENGINE=InnoDB;
+CREATE TABLE `second` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `label` varchar(255) NOT NULL DEFAULT 'none',
+  `first_id` int(11) NOT NULL,
+  PRIMARY KEY (`id`),
+  CONSTRAINT `second_first` FOREIGN KEY (`first_id`) REFERENCES `first` (`id`)
+) ENGINE=InnoDB;
+"""
+
+
+def test_repeated_strings_are_shared():
+    """Type strings, default values and field names should be held once for all the tables"""
+    tables = analyse_file(SAMPLE_TABLES.splitlines(True))
+    first = tables['first']['fields']
+    second = tables['second']['fields']
+    assert first['id']['type'] is second['first_id']['type']
+    assert first['label']['default'] is second['label']['default']
+    assert first.keys()[1] is second.keys()[1]
+
+
+def test_objects_read_like_dicts():
+    """The parsed objects should be read and compared like the dicts they replace"""
+    tables = analyse_file(SAMPLE_TABLES.splitlines(True))
+    table = tables['second']
+    assert isinstance(table, Table)
+    eq_(table['fields']['first_id'], {'name': 'first_id', 'type': 'int(11)', 'nn': True,
+                                      'default': False, 'inc': False})
+    eq_(table['fk'].values(), [{'table': 'first', 'k': ['first_id'], 'fk': ['id'], 'name': 'second_first'}])
+    eq_(tables['first']['uk'], {'label': Key('label', ['label'])})
+    eq_(sorted(table['pk']), ['id'])
+    eq_(table.get('missing'), None)
+    field = table['fields']['label']
+    field['nn'] = True
+    eq_(field.nn, True)
+
+
+@raises(KeyError)
+def test_unknown_attributes_are_refused():
+    Field('id', 'int(11)')['size'] = 11
+
+
+def test_fields_keep_their_order():
+    """Fields should iterate and compare like an OrderedDict"""
+    fields = Fields()
+    for name in ('c', 'a', 'b'):
+        fields[name] = Field(name, 'text')
+    eq_(fields.keys(), ['c', 'a', 'b'])
+    eq_(list(fields), ['c', 'a', 'b'])
+    eq_(fields, OrderedDict(fields.items()))
+    assert fields != Fields(reversed(fields.items()))
+    del fields['a']
+    eq_(fields.popitem(last=False), ('c', Field('c', 'text')))
+    eq_(fields.items(), [('b', Field('b', 'text'))])
+
+
+def test_fields_mutators_keep_the_order():
+    fields = Fields((name, Field(name, 'text')) for name in ('c', 'a', 'b'))
+    eq_(fields.pop('a'), Field('a', 'text'))
+    eq_(fields.pop('a', None), None)
+    raises(KeyError)(fields.pop)('a')
+    eq_(fields.values(), [Field('c', 'text'), Field('b', 'text')])
+    eq_(fields.setdefault('d', Field('d', 'int(11)')), Field('d', 'int(11)'))
+    eq_(fields.setdefault('c', Field('c', 'int(11)')), Field('c', 'text'))
+    fields.update([('e', Field('e', 'text')), ('b', Field('b', 'int(11)'))], f=Field('f', 'text'))
+    eq_(fields.keys(), ['c', 'b', 'd', 'e', 'f'])
+    eq_(fields['b'], Field('b', 'int(11)'))
+    eq_(len(fields.items()), len(fields))
+    fields.clear()
+    eq_((fields.items(), len(fields)), ([], 0))
+    fields.update({'g': Field('g', 'text')})
+    eq_(fields.items(), [('g', Field('g', 'text'))])
+
+
+def test_objects_survive_pickling():
+    """The objects are pickled by the schema cache and the parsing processes"""
+    tables = analyse_file(SAMPLE_TABLES.splitlines(True))
+    copy = pickle.loads(pickle.dumps(tables, pickle.HIGHEST_PROTOCOL))
+    eq_(copy, tables)
+    eq_(copy['second']['fields'].keys(), ['id', 'label', 'first_id'])
+    assert isinstance(copy['second']['fk'].values()[0], ForeignKey)
+
+
+def test_compare_tables_accepts_objects():
+    """compare_tables should produce the same migration from objects as from dicts"""
+    tables = analyse_file(SAMPLE_TABLES.splitlines(True))
+    source = tables['first']
+    target = analyse_file(SAMPLE_TABLES.replace("`label` varchar(255)", "`label` varchar(64)")
+                          .splitlines(True))['first']
+    eq_(compare_tables(source, target, ''),
+        "ALTER TABLE `first` MODIFY COLUMN `label` varchar(64) NOT NULL DEFAULT `none`;\n")
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_nested_dicts_of_the_memory_benchmark():
+    """bench.memory should compare the objects with the same tables as nested dicts"""
+    file_name = os.path.join(helpers.temp_dir, 'dump.sql')
+    write_dump(generate_schema(20, columns=5, seed=4), file_name)
+    tables = load_tables(file_name, 'slots')
+    nested = load_tables(file_name, 'dicts')
+    eq_(sorted(nested), sorted(tables))
+    eq_(sorted(tables), sorted(analyse_dump_file(file_name)))
+    for name, table in tables.items():
+        eq_(table, nested[name])
+        eq_(type(nested[name]['fields']), OrderedDict)
+        eq_(nested[name]['fields'].keys(), table['fields'].keys())
+        assert all(type(field) is dict for field in nested[name]['fields'].values())
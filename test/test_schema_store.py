@@ -0,0 +1,108 @@
+"""Tests for the on-disk SchemaStore of the parsed tables and the comparison of two stores."""
+import copy
+import os
+import sys
+from StringIO import StringIO
+import compdb
+from bench.synthetic import generate_schema, write_dump
+from compdb import CompDB, ListSink, SchemaStore, TableFilter, analyse_dump_file, store_dump_file
+import helpers
+from helpers import make_temp_dir, remove_temp_dir
+from nose.tools import eq_, with_setup
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+SCHEMA_DUMP = os.path.join(FIXTURES, 'mysqldump_schema.sql')
+DJANGO_DUMP = os.path.join(FIXTURES, 'django_sql.sql')
+FULL_DUMP = os.path.join(FIXTURES, 'mysqldump_full.sql')
+
+
+def store(file_name, name='store', table_prefix=''):
+    store_file_name = os.path.join(helpers.temp_dir, name)
+    store_dump_file(file_name, store_file_name, table_prefix)
+    return SchemaStore(store_file_name)
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_stored_tables_are_the_parsed_ones():
+    """The out-of-line foreign keys should be stored with their table, its fingerprint updated"""
+    for file_name in (SCHEMA_DUMP, DJANGO_DUMP, FULL_DUMP):
+        schema_store = store(file_name)
+        expected = analyse_dump_file(file_name)
+        tables = dict((table['name'], table) for table in schema_store.iter_tables())
+        eq_(tables, expected)
+        eq_([tables[name]['fingerprint'] for name in sorted(tables)],
+            [expected[name]['fingerprint'] for name in sorted(expected)])
+        schema_store.close()
+    schema_store = store(SCHEMA_DUMP, table_prefix=TableFilter(exclude=['plays_*']))
+    eq_([table['name'] for table in schema_store.iter_tables()], ['auth_group'])
+    eq_(schema_store.load_table('plays_text'), None)
+
+
+def stored_migration(source_file_name, target_file_name, comp):
+    return list(comp.iter_store_migration(store(source_file_name, 'source'), store(target_file_name, 'target')))
+
+
+def parsed_migration(source_file_name, target_file_name, comp):
+    return list(comp.iter_migration(analyse_dump_file(source_file_name), analyse_dump_file(target_file_name)))
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_same_statements_as_the_parsed_schemas():
+    for no_foreign_key in (True, False):
+        for source, target in ((DJANGO_DUMP, SCHEMA_DUMP), (SCHEMA_DUMP, DJANGO_DUMP)):
+            comp = CompDB()
+            comp.no_foreign_key = no_foreign_key
+            eq_(stored_migration(source, target, comp), parsed_migration(source, target, comp))
+    eq_(stored_migration(SCHEMA_DUMP, FULL_DUMP, CompDB()), [])
+
+
+class CountingStore(SchemaStore):
+    loaded = 0
+
+    def load_table(self, name):
+        CountingStore.loaded += 1
+        return SchemaStore.load_table(self, name)
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_only_the_changed_tables_are_loaded():
+    schema = generate_schema(2000, columns=6, seed=3)
+    write_dump(schema, os.path.join(helpers.temp_dir, 'source.sql'))
+    changed = copy.deepcopy(schema)
+    changed[1500]['columns'].append(('extra', 'int(11)', 'NOT NULL'))
+    del changed[10]
+    write_dump(changed, os.path.join(helpers.temp_dir, 'target.sql'))
+    stores = []
+    for name in ('source', 'target'):
+        store_dump_file(os.path.join(helpers.temp_dir, name + '.sql'), os.path.join(helpers.temp_dir, name))
+        stores.append(CountingStore(os.path.join(helpers.temp_dir, name)))
+    migration = list(CompDB().iter_store_migration(*stores))
+    eq_(migration, ['DROP TABLE `table_00010`;',
+                    'ALTER TABLE `table_01500` ADD COLUMN `extra` int(11) NOT NULL AFTER `%s`;'
+                    % schema[1500]['columns'][-1][0], ''])
+    eq_(CountingStore.loaded, 2)
+
+
+def test_command_line_store():
+    make_temp_dir()
+    argv = sys.argv
+    stdout = sys.stdout
+    try:
+        sys.argv = ['compdb.py', '--store-dir=%s' % os.path.join(helpers.temp_dir, 'stores'), '-j', '2', DJANGO_DUMP,
+                    SCHEMA_DUMP]
+        sys.stdout = StringIO()
+        compdb.parse_cmd_line()
+        output = sys.stdout.getvalue()
+    finally:
+        sys.argv = argv
+        sys.stdout = stdout
+    try:
+        eq_(sorted(os.listdir(os.path.join(helpers.temp_dir, 'stores'))), ['source.sqlite', 'target.sqlite'])
+        comp = CompDB()
+        comp.set_files(DJANGO_DUMP, SCHEMA_DUMP)
+        sink = ListSink()
+        comp.set_output(sink)
+        comp.compare()
+        eq_(output.splitlines(), '\n'.join(sink.lines).splitlines())
+    finally:
+        remove_temp_dir()
@@ -0,0 +1,120 @@
+"""Tests for the secondary indexes (KEY), compared by their columns whatever their names."""
+import os
+import sys
+from StringIO import StringIO
+import compdb
+from compdb import CompDB, Index, ListSink, SchemaStore, compare_tables, iter_missing_indexes, \
+    parse_dump_files, store_dump_file
+import helpers
+from helpers import make_temp_dir, parse, remove_temp_dir
+from nose.tools import eq_, with_setup
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+SCHEMA_DUMP = os.path.join(FIXTURES, 'mysqldump_schema.sql')
+DJANGO_DUMP = os.path.join(FIXTURES, 'django_sql.sql')
+FULL_DUMP = os.path.join(FIXTURES, 'mysqldump_full.sql')
+
+BOOK = """CREATE TABLE `book` (
+  `id` int(11) NOT NULL,
+  `title` varchar(200) NOT NULL,
+  `year` int(11) NOT NULL,
+  `isbn` varchar(13) NOT NULL,
+  PRIMARY KEY (`id`),
+  KEY `book_title` (`title`(10),`year`),
+  KEY `book_isbn` (`isbn`) USING HASH,
+  INDEX `book_year` USING BTREE (`year`)
+);
+"""
+
+
+def test_indexes_are_parsed():
+    for parser in ('tokenizer', 'legacy'):
+        indexes = parse(BOOK, parser)['book']['ix']
+        eq_(indexes, {'title(10),year': Index('book_title', ['title(10)', 'year']),
+                      'isbn': Index('book_isbn', ['isbn'], 'HASH'),
+                      'year': Index('book_year', ['year'])})
+    created = parse(BOOK.replace("  KEY `book_isbn` (`isbn`) USING HASH,\n", '') +
+                    'CREATE INDEX `isbn_hash` USING HASH ON `book` (`isbn`);\n')
+    eq_(created['book']['ix']['isbn'], Index('isbn_hash', ['isbn'], 'HASH'))
+
+
+def test_renamed_indexes_are_equivalent():
+    """An index of another name on the same columns, in the same order, is the same index"""
+    source = parse(BOOK)['book']
+    eq_(compare_tables(source, parse(BOOK.replace('`book_title`', '`title_year`')
+                                     .replace('`book_isbn`', '`ISBN`'))['book'], ''), '')
+    # the dumps of Django declare them apart, mysqldump within the table
+    sink = ListSink()
+    comp = CompDB()
+    comp.set_files(DJANGO_DUMP, SCHEMA_DUMP)
+    comp.set_output(sink)
+    comp.compare()
+    assert not [line for line in sink.lines if 'plays_text_author_id' in line], sink.lines
+
+
+def test_index_changes():
+    source = parse(BOOK)['book']
+    target = parse(BOOK.replace('(`title`(10),`year`)', '(`year`,`title`(10))')
+                   .replace(') USING HASH', ')'))['book']
+    eq_(compare_tables(source, target, '').splitlines(), [
+        'ALTER TABLE `book` DROP INDEX `book_isbn`;',
+        'ALTER TABLE `book` DROP INDEX `book_title`;',
+        'ALTER TABLE `book` ADD INDEX `book_isbn` (`isbn`);',
+        'ALTER TABLE `book` ADD INDEX `book_title` (`year`, `title`(10));'])
+    # the indexes of the dropped columns go with them
+    dropped = parse(BOOK.replace('  `isbn` varchar(13) NOT NULL,\n', '')
+                    .replace('  KEY `book_isbn` (`isbn`) USING HASH,\n', ''))['book']
+    eq_(compare_tables(source, dropped, '').splitlines(), ['ALTER TABLE `book` DROP COLUMN `isbn`;'])
+
+
+def test_created_tables_come_with_their_indexes():
+    sink = ListSink()
+    comp = CompDB()
+    comp.set_output(sink)
+    comp._write(comp.iter_migration({}, parse(BOOK)))
+    eq_(sink.lines[-3:], ['ALTER TABLE `book` ADD INDEX `book_isbn` (`isbn`) USING HASH;',
+                          'ALTER TABLE `book` ADD INDEX `book_title` (`title`(10), `year`);',
+                          'ALTER TABLE `book` ADD INDEX `book_year` (`year`);'])
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_indexes_of_the_chunks_and_stores():
+    """The out-of-line indexes should be attached to tables parsed elsewhere"""
+    expected = compdb.analyse_dump_file(DJANGO_DUMP)
+    eq_(sorted(expected['plays_text']['ix']), ['author_id'])
+    eq_(parse_dump_files([DJANGO_DUMP], jobs=2, min_chunk_size=1), [expected])
+    for file_name in (DJANGO_DUMP, SCHEMA_DUMP):
+        store_file_name = os.path.join(helpers.temp_dir, os.path.basename(file_name))
+        store_dump_file(file_name, store_file_name)
+        store = SchemaStore(store_file_name)
+        eq_(dict((table['name'], table) for table in store.iter_tables()), compdb.analyse_dump_file(file_name))
+        store.close()
+    table = parse(BOOK)['book']
+    store = SchemaStore(os.path.join(helpers.temp_dir, 'book'))
+    store.add_table(table)
+    eq_(store.load_table('book'), table)
+    store.close()
+
+
+def test_missing_index_report():
+    production = parse(BOOK.replace('  KEY `book_title` (`title`(10),`year`),\n', '')
+                       .replace('  INDEX `book_year` USING BTREE (`year`)', '  UNIQUE KEY `year` (`year`)'))
+    eq_([(table_name, kind, key['name']) for table_name, kind, key in iter_missing_indexes(production, parse(BOOK))],
+        [('book', 'ix', 'book_title')])
+    eq_(list(iter_missing_indexes(parse(BOOK), production)), [])
+    argv = sys.argv
+    stdout = sys.stdout
+    try:
+        sys.argv = ['compdb.py', '--missing-indexes', FULL_DUMP, DJANGO_DUMP]
+        sys.stdout = StringIO()
+        compdb.parse_cmd_line()
+        eq_(sys.stdout.getvalue(), '')
+        sys.argv = ['compdb.py', '--missing-indexes', DJANGO_DUMP, SCHEMA_DUMP]
+        sys.stdout = StringIO()
+        compdb.parse_cmd_line()
+        output = sys.stdout.getvalue()
+    finally:
+        sys.argv = argv
+        sys.stdout = stdout
+    eq_(output.splitlines(), ['plays_author: missing UNIQUE INDEX `name` (`name`)',
+                              'plays_author: missing FULLTEXT KEY `plays_author_biography` (`biography`)'])
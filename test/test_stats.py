@@ -0,0 +1,120 @@
+"""Tests for the instrumentation of the runs and the aggregation of the parser warnings."""
+import json
+import os
+import re
+import sys
+from StringIO import StringIO
+import compdb
+from compdb import CompDB, ListSink, Stats, analyse_file, line_shape, parse_dump_files
+import helpers
+from helpers import make_temp_dir, remove_temp_dir
+from nose.tools import eq_, with_setup
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+SCHEMA_DUMP = os.path.join(FIXTURES, 'mysqldump_schema.sql')
+DJANGO_DUMP = os.path.join(FIXTURES, 'django_sql.sql')
+
+MESSY_DUMP = """CREATE TABLE `test` (
+  `id` int(11) NOT NULL,
+  SPATIAL KEY `geo_1` (`id`),
+  SPATIAL KEY `geo_22` (`id`),
+  PRIMARY KEY (`id`)
+);
+# host 'db1', 12 tables
+# host 'db22', 3 tables
+"""
+
+
+def parse(lines, parser=None):
+    stderr = sys.stderr
+    sys.stderr = StringIO()
+    try:
+        return analyse_file(lines, parser=parser), sys.stderr.getvalue()
+    finally:
+        sys.stderr = stderr
+
+
+def test_line_shapes():
+    eq_(line_shape("SPATIAL KEY `geo_1` (`id`, `x`)"), line_shape("SPATIAL  KEY `g` (`a`, `b`)"))
+    eq_(line_shape("INSERT INTO `t` VALUES (12,'it''s',3.5)"), "INSERT INTO `?` VALUES (N,'?''?',N)")
+
+
+def test_unrecognised_lines_are_aggregated_instead_of_printed():
+    """Both parsers should report the unrecognised lines to the Stats, by shape"""
+    for parser in ('tokenizer', 'legacy'):
+        events = []
+        with Stats() as stats:
+            stats.hooks.append(lambda event, data: events.append(event))
+            tables, printed = parse(MESSY_DUMP.splitlines(True), parser)
+        eq_(printed, '')
+        eq_(sorted(tables['test']['pk']), ['id'])
+        report = stats.report()
+        eq_([(shape['count'], shape['line_number']) for shape in report['unrecognised']], [(2, 3), (2, 7)])
+        eq_(report['unrecognised'][1]['sample'], "# host 'db1', 12 tables")
+        eq_(events, ['unrecognised'] * 4 + ['report'])
+    # once disabled, the warnings are printed again, out of the SQL of stdout
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        eq_(len(parse(MESSY_DUMP.splitlines(True))[1].splitlines()), 4)
+        eq_(sys.stdout.getvalue(), '')
+    finally:
+        sys.stdout = stdout
+
+
+def test_patterns_are_counted_while_enabled():
+    pattern = compdb.RE_FIELD
+    with Stats() as stats:
+        parse(MESSY_DUMP.splitlines(True))
+    assert compdb.RE_FIELD is pattern
+    assert compdb.TOKENIZER_PATTERNS['field'] is pattern
+    eq_(stats.patterns['field'], [1, 0])
+    eq_(stats.patterns['primary_key'], [1, 0])
+    eq_(stats.patterns['create_table'], [1, 0])
+    eq_(stats.lines, 8)
+
+
+def test_phases_of_a_comparison():
+    """Every phase should be timed, their sum staying within the run"""
+    comp = CompDB()
+    comp.set_files(DJANGO_DUMP, SCHEMA_DUMP)
+    comp.set_output(ListSink())
+    with Stats() as stats:
+        comp.compare()
+    report = stats.report()
+    eq_(sorted(report['phases']), sorted(compdb.PHASES))
+    assert report['phases']['parse'] > 0 and report['phases']['compare'] > 0, report['phases']
+    assert sum(report['phases'].values()) <= report['seconds'] + 1e-6
+    assert report['lines'] > 100 and report['lines_per_second'] > 0
+    eq_(json.loads(json.dumps(report)), report)
+
+
+def test_lines_of_the_chunks_are_counted():
+    with Stats() as serial:
+        parse_dump_files([SCHEMA_DUMP, DJANGO_DUMP])
+    with Stats() as parallel:
+        parse_dump_files([SCHEMA_DUMP, DJANGO_DUMP], jobs=2, min_chunk_size=1)
+    eq_(parallel.lines, serial.lines)
+    assert parallel.phases['parse'] > 0
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_report_of_the_command_line():
+    argv = sys.argv
+    stdout = sys.stdout
+    stderr = sys.stderr
+    try:
+        json_file_name = os.path.join(helpers.temp_dir, 'stats.json')
+        sys.argv = ['compdb.py', '--stats', '--stats-json=%s' % json_file_name, DJANGO_DUMP, SCHEMA_DUMP]
+        sys.stdout = StringIO()
+        sys.stderr = StringIO()
+        compdb.parse_cmd_line()
+        report = sys.stderr.getvalue()
+        assert re.match(r'-- [\d.]+ s, \d+ lines', report), report
+        assert '\nemit ' in report
+        with open(json_file_name) as fd:
+            eq_(sorted(json.load(fd)['phases']), sorted(compdb.PHASES))
+    finally:
+        sys.argv = argv
+        sys.stdout = stdout
+        sys.stderr = stderr
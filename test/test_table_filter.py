@@ -0,0 +1,119 @@
+"""Tests for the include and exclude patterns of the tables, applied while parsing."""
+import itertools
+import os
+import sys
+from StringIO import StringIO
+import compdb
+from compdb import CompDB, ListSink, Stats, TableFilter, analyse_dump_file, analyse_file, analyse_indexed_dump_file, \
+    parse_dump_files
+import helpers
+from helpers import make_temp_dir, remove_temp_dir
+from nose.tools import eq_, raises, with_setup
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+SCHEMA_DUMP = os.path.join(FIXTURES, 'mysqldump_schema.sql')
+DJANGO_DUMP = os.path.join(FIXTURES, 'django_sql.sql')
+
+ALL_TABLES = ['auth_group', 'plays_author', 'plays_text', 'plays_text_sample']
+
+
+def test_patterns():
+    names = ALL_TABLES + ['plays_text_log']
+    for include, exclude, expected in [
+            (['plays_text'], [], ['plays_text', 'plays_text_sample', 'plays_text_log']),
+            (['plays_*_log', 'auth_group'], [], ['auth_group', 'plays_text_log']),
+            (['re:plays_(author|text)$'], [], ['plays_author', 'plays_text']),
+            ([], ['plays_text*'], ['auth_group', 'plays_author']),
+            (['plays_'], ['*_log', 're:.*sample'], ['plays_author', 'plays_text'])]:
+        table_filter = TableFilter(include, exclude)
+        eq_([name for name in names if table_filter.match(name)], expected)
+    # the prefix of -p is a regular expression
+    eq_([name for name in names if TableFilter(['*text*'], prefix='plays_t.*_s').match(name)], ['plays_text_sample'])
+
+
+def test_filtered_tables_are_not_parsed():
+    """The fields of the tables filtered out should not even be matched"""
+    for parser in ('tokenizer', 'legacy'):
+        tables = analyse_dump_file(SCHEMA_DUMP, TableFilter(['plays_text']), parser)
+        eq_(sorted(tables), ['plays_text', 'plays_text_sample'])
+        expected = analyse_dump_file(SCHEMA_DUMP, parser=parser)
+        eq_(tables['plays_text_sample'], expected['plays_text_sample'])
+    with Stats() as stats:
+        analyse_dump_file(SCHEMA_DUMP, TableFilter(['auth_group']))
+    fields = len(analyse_dump_file(SCHEMA_DUMP)['auth_group']['fields'])
+    eq_(stats.patterns['field'], [fields, 0])
+
+
+def test_out_of_line_foreign_keys_of_filtered_tables_are_skipped():
+    """The foreign keys referencing the tables filtered out are kept with their table"""
+    stderr = sys.stderr
+    sys.stderr = StringIO()
+    try:
+        tables = analyse_file(open(DJANGO_DUMP).readlines(), TableFilter(exclude=['plays_author']))
+        eq_(sys.stderr.getvalue(), '')
+    finally:
+        sys.stderr = stderr
+    eq_(sorted(tables), ['plays_text', 'plays_text_sample'])
+    eq_([key['table'] for key in tables['plays_text']['fk'].values()], ['plays_author'])
+    tables = analyse_file(open(DJANGO_DUMP).readlines(), TableFilter(exclude=['plays_text']))
+    eq_(sorted(tables), ['plays_author'])
+
+
+def test_partitions_of_filtered_tables_are_skipped():
+    event = ("CREATE TABLE `event` (\n  `id` int(11) NOT NULL\n) ENGINE=InnoDB\n"
+             "/*!50100 PARTITION BY RANGE (`id`)\n(PARTITION p0 VALUES LESS THAN (10) ENGINE = InnoDB,\n"
+             " PARTITION pmax VALUES LESS THAN MAXVALUE ENGINE = InnoDB) */;\n")
+    book = "CREATE TABLE `book` (\n  `id` int(11) NOT NULL\n);\n"
+    # with and without the version comment
+    for dump, parser in itertools.product([event + book, event.replace('/*!50100 ', '').replace(' */;', ';') + book],
+                                          ('tokenizer', 'legacy')):
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            tables = analyse_file(StringIO(dump).readlines(), TableFilter(exclude=['event']), parser)
+            eq_(sys.stderr.getvalue(), '')
+        finally:
+            sys.stderr = stderr
+        eq_(sorted(tables), ['book'])
+        eq_(list(tables['book']['fields']), ['id'])
+
+
+@with_setup(make_temp_dir, remove_temp_dir)
+def test_chunked_and_indexed_parsing_are_filtered():
+    table_filter = TableFilter(['plays_'], ['plays_author'])
+    expected = analyse_dump_file(SCHEMA_DUMP, table_filter)
+    eq_(parse_dump_files([SCHEMA_DUMP], table_filter, jobs=2, min_chunk_size=1), [expected])
+    index_file_name = os.path.join(helpers.temp_dir, 'index')
+    eq_(analyse_indexed_dump_file(SCHEMA_DUMP, table_filter, index_file_name), expected)
+    # the blocks are reparsed under another filter, the index serving both
+    eq_(analyse_indexed_dump_file(SCHEMA_DUMP, TableFilter(['auth_']), index_file_name),
+        analyse_dump_file(SCHEMA_DUMP, 'auth_'))
+    eq_(analyse_indexed_dump_file(SCHEMA_DUMP, table_filter, index_file_name), expected)
+
+
+def test_comparison_of_the_included_tables():
+    comp = CompDB()
+    comp.set_files(DJANGO_DUMP, SCHEMA_DUMP)
+    comp.set_table_filter(['plays_text*'], ['*sample'])
+    sink = ListSink()
+    comp.set_output(sink)
+    comp.compare()
+    eq_([line.split('`')[1] for line in sink.lines if line.startswith(('ALTER', 'CREATE', 'DROP'))],
+        ['plays_text'] * len([line for line in sink.lines if line.startswith('ALTER')]))
+    raises(ValueError)(comp.set_table_filter)(['re:('])
+
+
+def test_command_line_patterns():
+    argv = sys.argv
+    stdout = sys.stdout
+    try:
+        sys.argv = ['compdb.py', '--include=auth_*', '--include=plays_author', '--exclude=plays_*',
+                    DJANGO_DUMP, SCHEMA_DUMP]
+        sys.stdout = StringIO()
+        compdb.parse_cmd_line()
+        output = sys.stdout.getvalue()
+    finally:
+        sys.argv = argv
+        sys.stdout = stdout
+    assert output.startswith('CREATE TABLE `auth_group`'), output
+    assert 'plays_' not in output
@@ -0,0 +1,80 @@
+"""Equivalence tests between the tokenizer parser and the legacy regex cascade.
+Both must produce the same table dictionaries and the same warnings."""
+import os
+import sys
+from StringIO import StringIO
+from compdb import analyse_file
+from nose.tools import eq_
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+SAMPLE_TABLES = [
+    """CREATE TABLE `test` (
+        `first_column` int(11) NOT NULL PRIMARY KEY,
+        `second_column` int(11) DEFAULT NULL,
+        `third_column` varchar(20) DEFAULT NULL
+    ) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+    """,
+    """CREATE TABLE `test` (
+        `first_column` int(11) NOT NULL PRIMARY KEY,
+        `enum_column` enum('a', 'b', 'c', 'd' ) DEFAULT NULL,
+    ) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+    """,
+    """create table `odd` (
+      ,`leading_comma` integer not null auto_increment,
+      `name` varchar(20) default 'x' primary key,
+      unique (`name`),
+      fulltext key `ft_name` (`name`),
+      `no_options` text
+      constraint `odd_fk` foreign key (`name`) references `other` (`name`),
+      SPATIAL KEY `geo` (`name`)
+    );
+    /*!50100 PARTITION BY RANGE (id)
+    (PARTITION p0 VALUES LESS THAN (10) ENGINE = InnoDB) */;
+    this line is ignored
+    ; neither is this one
+    """,
+]
+
+
+def parse_with(parser, lines):
+    """Run analyse_file with the given parser, capturing what it prints"""
+    stderr = sys.stderr
+    sys.stderr = StringIO()
+    try:
+        tables = analyse_file(lines, parser=parser)
+        return tables, sys.stderr.getvalue()
+    finally:
+        sys.stderr = stderr
+
+
+def check_equivalent(lines):
+    legacy_tables, legacy_output = parse_with('legacy', lines)
+    tokenizer_tables, tokenizer_output = parse_with('tokenizer', lines)
+    eq_(legacy_tables, tokenizer_tables)
+    eq_(legacy_output, tokenizer_output)
+
+
+def test_parsers_are_equivalent_on_sample_tables():
+    """The table samples used in the other tests, as lists of lines
+    without line endings, should give identical results"""
+    for sample in SAMPLE_TABLES:
+        yield check_equivalent, sample.splitlines(False)
+
+
+def test_parsers_are_equivalent_on_fixture_files():
+    """Reading the fixture files line by line as streams should
+    give identical results"""
+    for file_name in sorted(os.listdir(FIXTURES)):
+        with open(os.path.join(FIXTURES, file_name), 'r') as fd:
+            lines = fd.readlines()
+        yield check_equivalent, lines
+
+
+def test_tokenizer_attaches_out_of_line_foreign_keys():
+    """ALTER TABLE ... ADD CONSTRAINT statements, as output by 'manage.py sql',
+    should add the foreign key to the table they alter"""
+    with open(os.path.join(FIXTURES, 'django_sql.sql'), 'r') as fd:
+        tables = analyse_file(fd, parser='tokenizer')
+    eq_(tables['plays_text_sample']['fk']['text_id->plays_text.id'],
+        {'table': 'plays_text', 'k': ['text_id'], 'fk': ['id'], 'name': 'text_id_refs_id_4aaf935'})